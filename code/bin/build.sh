@@ -1,5 +1,5 @@
 #!/bin/sh
-g++ -O2 -std=c++11 -o ./bin/main main.cpp include/sampler.h include/sampler.cpp include/Parser.h
+g++ -O2 -std=c++11 -o ./bin/main main.cpp include/sampler.h include/sampler.cpp include/Parser.h include/npz.h -lz
 
 #./bin/build.sh
 #./bin/main --config input/hun/config_KSH.json
\ No newline at end of file
@@ -0,0 +1,84 @@
+import json
+import functools
+import numpy as np
+import scipy.sparse as sp
+
+from trajectory import compartments
+
+# Compartments of the infection curves (new infections of the two waves)
+infection_compartments = ("I", "I2")
+
+def read_cities(pop_file):
+    # (index, city, municip, county) of every city of the network
+    with open(pop_file) as file:
+        return [(row["index"], row["city"], row["admin_municip"], row["admin_county"]) for row in json.load(file)["populations"]]
+
+def get_membership(labels):
+    """
+    Description:
+        Sparse (groups x cities) 0/1 matrix of a city -> group map
+    Returns:
+        * sorted group names, membership matrix
+    """
+    groups, group_of = np.unique(labels, return_inverse=True)
+    M = sp.csr_matrix((np.ones(len(labels)), (group_of, np.arange(len(labels)))), shape=(len(groups), len(labels)))
+    return list(groups), M
+
+class Aggregator:
+    """
+    Description:
+        Aggregated curves (county, district, age, national, deaths) of trajectories of one network.
+        The membership matrices are built once, every view is then one sparse product:
+            views = A @ trajectory[t].ravel()
+        where A is the stacked (views x Npop*K*compartment) matrix.
+    Parameters:
+        * pop_file     : populations file of the network config
+        * K            : number of age groups
+        * death_rate   : infection fatality rate of each age group (for the "deaths" view)
+        * summed       : compartments summed by the views
+    """
+    def __init__(self, pop_file, K, death_rate=None, summed=infection_compartments):
+        cities = sorted(read_cities(pop_file))
+        self.network_size = len(cities)
+        self.K = K
+        self.counties, M_county = get_membership([c[3] for c in cities])
+        self.districts, M_district = get_membership([c[2] for c in cities])
+        death_rate = np.zeros(K) if death_rate is None else np.asarray(death_rate, dtype=float)
+
+        everywhere = np.ones((1, self.network_size))
+        ages = np.ones((1, K))
+        views = {
+            "county": sp.kron(M_county, ages),
+            "district": sp.kron(M_district, ages),
+            "age": sp.kron(everywhere, sp.identity(K)),
+            "all": sp.kron(everywhere, ages),
+            "deaths": sp.kron(everywhere, death_rate[None, :]),
+        }
+        self.slices, start = {}, 0
+        for name, A in views.items():
+            self.slices[name] = slice(start, start + A.shape[0])
+            start += A.shape[0]
+
+        # Select the summed compartments as the fastest axis
+        selected = np.array([[1.0 if c in summed else 0.0 for c in compartments]])
+        self.A = sp.kron(sp.vstack(list(views.values())), selected).tocsr()
+
+    def aggregate(self, traj):
+        """
+        Description:
+            All views of a trajectory, or of a stacked batch of trajectories, with one product
+        Parameters:
+            * traj : (T, Npop, K, compartment) or (runs, T, Npop, K, compartment) array
+        Returns:
+            * dict of view name -> (T, groups) or (runs, T, groups) array
+        """
+        traj = np.asarray(traj)
+        shape = traj.shape[:-3]
+        X = traj.reshape(-1, self.A.shape[1])
+        Y = np.asarray((self.A @ X.T).T)
+        return {name: Y[:, s].reshape(shape + (s.stop - s.start,)) for name, s in self.slices.items()}
+
+@functools.lru_cache(maxsize=8)
+def load_aggregator(pop_file, K, death_rate=None):
+    # One aggregator per network config and process (death_rate: tuple)
+    return Aggregator(pop_file, K, death_rate)
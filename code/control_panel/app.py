@@ -3,12 +3,17 @@ import pandas as pd
 
 import plotly.express as px
 import plotly.graph_objects as go # or plotly.express as px
+from plotly.subplots import make_subplots
 
 import dash
 import json
+import yaml
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+
+from results import get_sweep, get_tail
+from maps import get_geometry, get_map_frames
 
 # === APP ===
 mathjax = 'https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.4/MathJax.js?config=TeX-MML-AM_CHTML'
@@ -17,6 +22,10 @@ external_scripts = [
 ]
 app = dash.Dash(__name__, external_scripts=external_scripts)
 
+def read_args(filename="input.yaml"):
+    with open(filename) as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
 # === Figures ===
 def general_plot(df, title, value_names, xy_labels):
     fig = px.line(df, 
@@ -42,41 +51,75 @@ def general_plot(df, title, value_names, xy_labels):
     return fig
 
 
-def plot_map():
-    with open("log/counties.geojson") as file:
-        line = file.read()
-        counties = json.loads(line)
-    
-    df = pd.read_csv("log/county_.csv")
-    fig = px.choropleth_mapbox(df.where(df["days"]==150),
-                            geojson=counties,
-                            featureidkey="properties.megye",
-                            locations='megye',
-                            color='inf',
-                            color_continuous_scale="Viridis",
-                            mapbox_style="carto-positron",
-                            zoom=8, center = {"lat": 47.49801, "lon": 19.03991},
-                            opacity=0.5,
-                            labels={'inf':'Infections'}
-                            )
-    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+def summary_fig(summary, title, xy_labels):
+    # Fan chart (see results.get_summary), WebGL traces
+    fig = go.Figure()
+    quantiles = sorted(summary["bands"])
+    for low, high in zip(quantiles[:len(quantiles)//2], quantiles[::-1]):
+        fig.add_trace(go.Scattergl(x=summary["days"], y=summary["bands"][low], mode="lines",
+                                   line=dict(width=0), showlegend=False, hoverinfo="skip"))
+        fig.add_trace(go.Scattergl(x=summary["days"], y=summary["bands"][high], mode="lines", fill="tonexty",
+                                   line=dict(width=0), fillcolor="rgba(31, 119, 180, 0.2)", name=f"{low}-{high}%"))
+    if(len(quantiles) % 2):
+        median = quantiles[len(quantiles)//2]
+        fig.add_trace(go.Scattergl(x=summary["days"], y=summary["bands"][median], mode="lines",
+                                   line=dict(width=2, color="rgb(31, 119, 180)"), name=f"{median}%"))
+    for label, curve in summary["representatives"].items():
+        fig.add_trace(go.Scattergl(x=summary["days"], y=curve, mode="lines", line=dict(width=1), opacity=.5, name=label))
+    fig.add_trace(go.Scattergl(x=summary["days"], y=summary["ground_truth"], mode="lines",
+                               line=dict(width=3, color="red"), name="Ground truth"))
+    fig.update_layout(
+        title=title,
+        title_x = 0.5,
+        title_y = 0.85,
+        xaxis_title=xy_labels[0],
+        yaxis_title=xy_labels[1],
+        font=dict(
+            family="Courier New, monospace",
+            size=16,
+            color="black",
+        ),
+    )
     return fig
 
-def plot_map2():
-    df = pd.read_csv("log/county_.csv")
-    fig=px.choropleth(df,
-                geojson="log/counties.geojson",
-                featureidkey='properties.megye',
-                locations='megye',        #column in dataframe
-                animation_frame='days',       #dataframe
-                color='inf',  #dataframe
-                color_continuous_scale='Inferno',
-                title='Infeections per day',
-                height=700
-                )
-    fig.update_geos(fitbounds="locations", visible=False)
+def animation_args(frames, duration):
+    # Arguments of the "animate" method of the play button and of the slider steps
+    return [frames, dict(mode="immediate", frame=dict(duration=duration, redraw=True), transition=dict(duration=0), fromcurrent=True)]
+
+def plot_map(frames, geometry, title):
+    # Choropleth animation (see maps.get_map_frames): the geometry is sent once, the frames only send the values
+    days, values = frames["days"], frames["values"]
+    fig = go.Figure(
+        data=[go.Choroplethmapbox(geojson=geometry, locations=frames["locations"], z=values[0],
+                                  zmin=0, zmax=frames["zmax"], colorscale="Viridis",
+                                  marker_opacity=0.5, marker_line_width=0, colorbar_title="Infections")],
+        frames=[go.Frame(data=[go.Choroplethmapbox(z=v)], traces=[0], name=str(d)) for d, v in zip(days, values)])
+    fig.update_layout(
+        title=title,
+        mapbox_style="carto-positron",
+        mapbox_zoom=6, mapbox_center = {"lat": 47.16, "lon": 19.5},
+        margin={"r":0,"t":40,"l":0,"b":0},
+        updatemenus=[dict(type="buttons", x=0.0, y=0.0, xanchor="left", yanchor="top",
+                          buttons=[dict(label="Play", method="animate", args=animation_args(None, 200))])],
+        sliders=[dict(currentvalue={"prefix": "Day "}, pad={"t": 30},
+                      steps=[dict(label=str(d), method="animate", args=animation_args([str(d)], 0)) for d in days])],
+    )
     return fig
 
+@app.callback(
+    Output('map-fig', 'figure'),
+    [Input('folder-dropdown', 'value'), Input('map-level', 'value')])
+def map_fig(sim_name, level):
+    # Map of the best run of the sweep
+    sweep = get_sweep(sim_name)
+    path = sweep.run_file(sweep.distribution.iloc[0]) if len(sweep.distribution) else None
+    if(path is None):
+        return go.Figure()
+    args = read_args()
+    pop_file = f"{args['network_config_folder']}/populations_KSH.json"
+    frames = get_map_frames(path, level, pop_file, args['age_groups'])
+    return plot_map(frames, get_geometry(level), title=f"Infections of the best run ({level})")
+
 # Age
 def ages_fig():
     df = pd.read_csv("log/ages.csv", index_col=0)
@@ -86,21 +129,28 @@ def ages_fig():
         value_names = ["Ages", "Age groups"],
         xy_labels = ["Days", "Deaths"])
 
-def loss_restrict(df, sim_name, th):
-    df_dist = pd.read_csv(f"log/helper/{sim_name}_distribution.csv", index_col=0, dtype=str)
-    params_best = [row[["R0", "R1", "R1_shift"]] for index,row in df_dist.iterrows() if float(row["loss"])<float(th)]
-
-    df = df[["_".join([str(r) for r in row]) for row in params_best]+["Ground truth"]]
-    return df
+def loss_restrict(sim_name, th):
+    # Curves of the runs below the loss threshold (see results.Sweep)
+    return get_sweep(sim_name).curves(th)
 
 # Sims
+# Runs drawn one by one up to this number ("auto" view), a fan chart above it
+max_lines = 100
+
 @app.callback(
     Output('sims-fig', 'figure'),
-    [Input('folder-dropdown', 'value'), Input(component_id='loss_th', component_property='value')])
-def sims_fig(sim_name, th):
-    df = pd.read_csv(f"log/helper/{sim_name}_agg.csv", index_col=0)
-    df = loss_restrict(df, sim_name, th)
-    
+    [Input('folder-dropdown', 'value'), Input(component_id='loss_th', component_property='value'),
+     Input('sims-view', 'value')])
+def sims_fig(sim_name, th, view):
+    sweep = get_sweep(sim_name)
+    if(view == "summary" or (view == "auto" and len(sweep.below(th)) > max_lines)):
+        summary = sweep.summary(th, max_points=500)
+        return summary_fig(
+            summary,
+            title = f'Simulations {th} ({summary["runs"]} runs)',
+            xy_labels = ["Days", "Infections"])
+
+    df = loss_restrict(sim_name, th)
     return general_plot(
         df,
         title = f'Simulations {th}',
@@ -108,8 +158,7 @@ def sims_fig(sim_name, th):
         xy_labels = ["Days", "Infections"])
 
 def param_loss(param, sim_name, th):
-    df = pd.read_csv(f"log/helper/{sim_name}_distribution.csv", index_col=0)
-    df = df[df["loss"]<float(th)]
+    df = get_sweep(sim_name).below(th)
 
     fig = px.scatter(df, 
         x=df[param], y=df["loss"],
@@ -117,9 +166,7 @@ def param_loss(param, sim_name, th):
     return fig
 
 def param_histogram(param, sim_name, th):
-    df = pd.read_csv(f"log/helper/{sim_name}_distribution.csv", index_col=0)
-    #df = loss_restrict(df, sim_name, th)
-    df = df[df["loss"]<float(th)]
+    df = get_sweep(sim_name).below(th)
 
     fig = px.histogram(df, 
         x=df[param],
@@ -128,8 +175,7 @@ def param_histogram(param, sim_name, th):
     return fig
 
 def violin_plot(key, sim_name, th):
-    df = pd.read_csv(f"log/helper/{sim_name}_distribution.csv", index_col=0)
-    df = df[df["loss"]<float(th)]
+    df = get_sweep(sim_name).below(th)
 
     fig = go.Figure()
 
@@ -223,6 +269,64 @@ def hist_equalRatio(sim_name, th):
 def hist_R1Shift(sim_name, th):
     return param_histogram("R1_shift", sim_name, th)
 
+# === Live sweep ===
+# Parameters of the live histograms
+live_params = ["R0", "R1", "R1_shift"]
+
+def live_columns(df, best, start):
+    # Values of the traces of the live figures, of the runs from start on
+    runs = list(range(start, start+len(df)))
+    loss = {"x": [runs, runs], "y": [df["loss"].tolist(), best.tolist()]}
+    hist = {"x": [df[param].tolist() if param in df else [] for param in live_params]}
+    return loss, hist
+
+def live_loss_fig(loss, title):
+    fig = make_subplots(rows=1, cols=2, subplot_titles=["Loss of the runs", "Best loss so far"])
+    fig.add_trace(go.Scattergl(x=loss["x"][0], y=loss["y"][0], mode="markers", name="Loss"), row=1, col=1)
+    fig.add_trace(go.Scattergl(x=loss["x"][1], y=loss["y"][1], mode="lines", name="Best loss"), row=1, col=2)
+    fig.update_xaxes(title_text="Runs")
+    fig.update_layout(title=title, showlegend=False)
+    return fig
+
+def live_hist_fig(hist):
+    fig = make_subplots(rows=1, cols=len(live_params), subplot_titles=[f"{param} - distribution" for param in live_params])
+    for i, (param, x) in enumerate(zip(live_params, hist["x"])):
+        fig.add_trace(go.Histogram(x=x, name=param), row=1, col=i+1)
+    fig.update_layout(showlegend=False)
+    return fig
+
+@app.callback(
+    Output('live-interval', 'disabled'),
+    [Input('live', 'value')])
+def live_toggle(live):
+    return 'live' not in (live or [])
+
+@app.callback(
+    [Output('live-loss-fig', 'figure'), Output('live-loss-fig', 'extendData'),
+     Output('live-hist-fig', 'figure'), Output('live-hist-fig', 'extendData'),
+     Output('live-sent', 'data'), Output('live-info', 'children')],
+    [Input('live-interval', 'n_intervals'), Input('folder-dropdown', 'value')],
+    [State('live-sent', 'data')])
+def live_figs(_, sim_name, sent):
+    # Runs of the sweep as they finish (see results.SweepTail): the figures are drawn once,
+    # then only the new runs are sent and appended to their traces (extendData)
+    tail = get_tail(sim_name)
+    start = sent["runs"] if sent and sent["sim"] == sim_name else None
+    df, best, runs = tail.since(start or 0)
+    if(start is not None and runs < start):
+        start = None  # a new sweep of the same ID
+        df, best, runs = tail.since(0)
+    info = f"{runs} runs, best loss: {tail.best[-1]:.4f}" if len(tail.best) else "No runs yet"
+    info += " (finished)" if tail.finished() else " (running)"
+    if(start is not None and len(df) == 0):
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, info
+
+    loss, hist = live_columns(df, best, start or 0)
+    sent = {"sim": sim_name, "runs": runs}
+    if(start is None):
+        return live_loss_fig(loss, f"Sweep {sim_name}"), dash.no_update, live_hist_fig(hist), dash.no_update, sent, info
+    return dash.no_update, (loss, [0, 1]), dash.no_update, (hist, list(range(len(live_params)))), sent, info
+
 # County
 def countys_fig():
     df = pd.read_csv("log/county.csv", index_col=0)
@@ -280,14 +384,36 @@ app.layout = html.Div(children=[
             ]),
             html.Br(),
 
+            html.Div([
+                html.Label("Simulations view", className='dropdown-labels'),
+                dcc.RadioItems(id='sims-view', value='auto', labelStyle={'display': 'inline-block'},
+                               options=[{'label': 'Auto', 'value': 'auto'}, {'label': 'Runs', 'value': 'runs'},
+                                        {'label': 'Quantiles', 'value': 'summary'}])
+            ]),
+            html.Br(),
+
+            html.Div([
+                dcc.Checklist(id='live', value=[], options=[{'label': 'Follow the running sweep', 'value': 'live'}]),
+                html.Div(id='live-info')
+            ]),
+            dcc.Interval(id='live-interval', interval=5000, disabled=True),
+            dcc.Store(id='live-sent'),
+            html.Br(),
+
         ], style={'width': '100%', 'height': '400px'})
 
     ], id='left-container'),
     # Right: plots
     html.Div(children=[
         html.Div(children=[
-            #dcc.Graph(figure=plot_map(), style={'width': '100%'}),
-            #dcc.Graph(figure=plot_map(), style={'width': '100%', 'height': '500px', 'display': 'inline-block'}),
+            # === Map ===
+            dcc.RadioItems(id='map-level', value='county', labelStyle={'display': 'inline-block'},
+                           options=[{'label': 'Counties', 'value': 'county'}, {'label': 'Cities', 'value': 'city'}]),
+            dcc.Graph(id="map-fig", style={'width': '100%', 'height': '600px'}),
+
+            # === Live sweep ===
+            dcc.Graph(id="live-loss-fig"),
+            dcc.Graph(id="live-hist-fig"),
             
             #dcc.Graph(figure=ages_fig(), style={'width': '50%', 'height': '500px', 'display': 'inline-block'}),
             #dcc.Graph(figure=countys_fig(), style={'width': '50%', 'height': '500px', 'display': 'inline-block'}),
@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+import functools
+
+from trajectory import meta_file
+
+# Model arguments that identify a run (besides the network and the engine)
+model_args = ["--R0", "--R1", "--second_wave", "--maxT", "--c", "--seed", "--tau", "--second_infected_ratio"]
+
+# Trajectory formats, in order of preference when looking up a run
+formats = ["npy", "csv"]
+
+def hash_file(file, h=None):
+    h = h if h is not None else hashlib.sha256()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h
+
+@functools.lru_cache(maxsize=32)
+def hash_folder(folder, stamp):
+    # Content hash of the files of a network config folder (stamp: see folder_stamp)
+    h = hashlib.sha256()
+    for name, _, _ in stamp:
+        h.update(name.encode())
+        hash_file(os.path.join(folder, name), h)
+    return h.hexdigest()
+
+def folder_stamp(folder):
+    # (name, mtime, size) of the files of a folder: the content is only rehashed when it changes
+    stamp = []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if os.path.isfile(path):
+            st = os.stat(path)
+            stamp.append((name, st.st_mtime_ns, st.st_size))
+    return tuple(stamp)
+
+@functools.lru_cache(maxsize=8)
+def engine_version(engine, binary):
+    """
+    Description:
+        Version of an engine: content hash of the binary (main.cpp), or of the sources of
+        the in-process engine (engine.py)
+    """
+    if(engine == "python"):
+        h = hashlib.sha256()
+        for name in ["engine.py", "trajectory.py"]:
+            hash_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), h)
+        return "python-" + h.hexdigest()
+    return "binary-" + hash_file(binary).hexdigest()
+
+class RunCache:
+    """
+    Description:
+        Content-addressed store of simulation outputs:
+            key = sha256(network config contents, engine version, model arguments, seed)
+        A run is stored as {folder}/{key[:2]}/{key}.{format} (and its metadata), so identical
+        runs of any sweep are simulated only once.
+    Parameters:
+        * folder : cache folder
+        * engine : "python" or "binary"
+        * binary : path of the binary engine
+    """
+    def __init__(self, folder, engine="binary", binary="../bin/main"):
+        self.folder = folder
+        self.engine = engine
+        self.binary = binary
+
+    def key(self, config_folder, c_args):
+        config = hash_folder(os.path.abspath(config_folder), folder_stamp(config_folder))
+        args = {arg: c_args[arg] for arg in model_args if arg in c_args}
+        content = json.dumps({"config": config, "engine": engine_version(self.engine, self.binary), "args": args},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def path(self, key, format="npy"):
+        return os.path.join(self.folder, key[:2], f"{key}.{format}")
+
+    def get(self, key):
+        # Path of a stored run, None if it is not in the cache
+        for format in formats:
+            path = self.path(key, format)
+            if os.path.exists(path) and (format != "npy" or os.path.exists(meta_file(path))):
+                return path
+        return None
+
+    def state_path(self, key):
+        # Saved state of a run (to continue it, see runner.successive_halving)
+        return self.path(key, "state")
+
+    def get_state(self, key):
+        path = self.state_path(key)
+        return path if os.path.exists(path) else None
+
+    def tmp_path(self, key, format="npy"):
+        # Runs are written here first, and moved by commit() when complete
+        path = self.path(key, format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{os.getpid()}.tmp"
+
+    def commit(self, tmp, key, format="npy"):
+        path = self.path(key, format)
+        if os.path.exists(meta_file(tmp)):
+            os.replace(meta_file(tmp), meta_file(path))
+        os.replace(tmp, path)
+        return path
+
+    def pack(self, key):
+        # Contents of a stored run (format, data, metadata), to be stored in another cache by unpack()
+        path = self.get(key)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        meta = None
+        if os.path.exists(meta_file(path)):
+            with open(meta_file(path), "rb") as f:
+                meta = f.read()
+        return path.rsplit(".", 1)[1], data, meta
+
+    def unpack(self, key, format, data, meta=None):
+        tmp = self.tmp_path(key, format)
+        if meta is not None:
+            with open(meta_file(tmp), "wb") as f:
+                f.write(meta)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        return self.commit(tmp, key, format)
+
+class Manifest:
+    """
+    Description:
+        Append-only record (json lines) of the finished runs of a sweep: name -> cache key,
+        and of its parameter design (the last one recorded, see sampling.get_design).
+        An interrupted sweep is resumed from it.
+    """
+    def __init__(self, file):
+        self.file = file
+        self.runs = {}
+        self.design = None
+        if os.path.exists(file):
+            with open(file) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # last line of an interrupted write
+                    if "design" in entry:
+                        self.design = entry["design"]
+                    else:
+                        self.runs[entry["name"]] = entry["key"]
+
+    def add(self, name, key):
+        if self.runs.get(name) == key:
+            return
+        self.runs[name] = key
+        with open(self.file, "a") as f:
+            f.write(json.dumps({"name": name, "key": key}) + "\n")
+
+    def set_design(self, design):
+        if self.design == design:
+            return
+        self.design = design
+        with open(self.file, "a") as f:
+            f.write(json.dumps({"design": design}) + "\n")
@@ -0,0 +1,201 @@
+import os
+import json
+import functools
+import numpy as np
+import scipy.sparse as sp
+
+from trajectory import compartments
+
+# === Model constants (same as ../main.cpp) ===
+mu = 1 / 2.5
+eps = 1 / 4.0
+tau = 3.0
+# Leading eigenvalue used by main.cpp to get beta from R0
+eigen_C = 16.204308331681283
+# First simulated day of the year
+T0 = 243
+# Compartments of the state of a run (see simulate, save_state)
+state_compartments = ["S", "L", "I", "R", "L2", "I2"]
+
+
+def seasonality(c, t):
+    return 0.5*c*np.cos(2*np.pi*t/366.0)+(1-0.5*c)
+
+def get_beta(R0, mu, eigenV):
+    return R0 * mu / eigenV
+
+def read_contacts(file):
+    with open(file) as f:
+        d = json.load(f)
+    C = np.zeros((int(d["K"]), int(d["K"])))
+    for rate in d["rates"]:
+        C[int(rate["from"]), int(rate["to"])] = float(rate["rate"])
+    return C
+
+def read_commuting(file):
+    """
+    Description:
+        Reads a commuting network into a csr matrix, either from the sparse .npz written by
+        generate_init (scipy.sparse.save_npz) or from the json edge list read by main.cpp
+    """
+    if file.endswith(".npz"):
+        return sp.load_npz(file).tocsr()
+    with open(file) as f:
+        commuting = json.load(f)
+    N = int(commuting["N"])
+    edges = commuting["network"]
+    rows = np.array([int(edge["from"]) for edge in edges], dtype=np.int64)
+    cols = np.array([int(edge["to"]) for edge in edges], dtype=np.int64)
+    weights = np.array([float(edge["weight"]) for edge in edges])
+    keep = weights != 0
+    return sp.csr_matrix((weights[keep], (rows[keep], cols[keep])), shape=(N, N))
+
+class Network:
+    """
+    Description:
+        Network config folder parsed into arrays (same inputs as the Parser of main.cpp)
+    Parameters:
+        * config_folder : folder containing config.json
+        * contact_mtx   : home contacts file (default: contacts_file_home of the config)
+    """
+    def __init__(self, config_folder, contact_mtx=""):
+        with open(os.path.join(config_folder, "config.json")) as f:
+            config = json.load(f)
+        self.folder = config_folder
+        self.Npop = int(config["Npop"])
+        self.K = int(config["K"])
+
+        # === Commuting (sparse file if generated, json otherwise) ===
+        commuting_file = os.path.join(config_folder, config.get("commuting_file_sparse", ""))
+        if not os.path.isfile(commuting_file):
+            commuting_file = os.path.join(config_folder, config["commuting_file"])
+        self.sigmas = read_commuting(commuting_file)
+
+        # === Populations ===
+        with open(os.path.join(config_folder, config["populations_file"])) as f:
+            populations = json.load(f)["populations"]
+        for c in ["S", "L", "I", "R", "N"]:
+            setattr(self, c, np.array([[age[c] for age in pop["age"]] for pop in populations], dtype=np.int64))
+        self.r1 = np.array([pop["r1"] for pop in populations], dtype=float)
+        self.r2 = np.array([pop["r2"] for pop in populations], dtype=float)
+
+        # === Contacts (home, other) ===
+        self.C1 = read_contacts(os.path.join(config_folder, contact_mtx if contact_mtx else config["contacts_file_home"]))
+        self.C2 = read_contacts(os.path.join(config_folder, config["contacts_file_other"]))
+
+@functools.lru_cache(maxsize=8)
+def load_network(config_folder, contact_mtx=""):
+    # Parsed once per process
+    return Network(config_folder, contact_mtx)
+
+def get_coupling(sigmas, tau):
+    """
+    Description:
+        Commuting coupling of the force of infection, as matrices:
+            * P[i,j] = (delta_ij + sigma_ij/tau) / (1 + sigma_i/tau)
+            * Q      : same as P, without the diagonal of sigma
+        N_eff = P^T N, and lambda_tot = P (beta r C (Q^T I / N_eff)), which is
+        get_Nk_eff/get_lambda/get_lambda_tot of main.cpp for all cities and ages at once.
+        Sparse in, sparse out: a step costs O(links * K) instead of O(Npop^2 * K)
+    """
+    sigmas = sp.csr_matrix(sigmas)
+    n = sigmas.shape[0]
+    a = sp.diags(1 / (1 + np.asarray(sigmas.sum(axis=1)).ravel() / tau))
+    P = a @ (sp.identity(n, format="csr") + sigmas / tau)
+    Q = a @ (sp.identity(n, format="csr") + (sigmas - sp.diags(sigmas.diagonal())) / tau)
+    return P.tocsr(), Q.tocsr()
+
+def force_of_infection(I, beta, r, C, P, QT, N_eff):
+    # QT: transpose of Q (see get_coupling), kept in csr form
+    I_eff = QT @ I
+    lam = beta * r[:, None] * (np.divide(I_eff, N_eff, out=np.zeros_like(I_eff), where=N_eff > 0) @ C.T)
+    return np.clip(P @ lam, 0.0, 1.0)
+
+def simulate(network, R0=2.6, R1=2.6, maxT=175, c=0.0, second_wave=-1, seed=0,
+             r1=1.0, r2=1.0, moving_t=-1, tau=tau, second_infected_ratio=0.01, state=None, return_state=False):
+    """
+    Description:
+        In-process version of ../main.cpp: L/I/I2/R dynamics with commuting coupling,
+        seasonality and second-wave injection. The only difference is that the second
+        wave infects from S-newL instead of S, so S can not become negative.
+    Parameters:
+        * network : Network (see load_network)
+        * r1, r2  : contact reduction before/after moving_t (-1: read from the populations file)
+        * state   : continue a run from its state at a day (returned with return_state), the
+                    days before it are not simulated again (same result as the uninterrupted run)
+    Returns:
+        * (days, Npop, K, 3) array of the daily new I, new I2 and R (see compartments),
+          and the state at day maxT if return_state
+    """
+    rng = np.random.default_rng(seed)
+    Npop, K = network.Npop, network.K
+
+    beta = get_beta(R0, mu, eigen_C)
+    beta2 = get_beta(R1, mu, eigen_C)
+
+    r_before = network.r1 if r1 == -1.0 else np.full(Npop, r1)
+    r_after = network.r2 if r1 == -1.0 else np.full(Npop, r2)
+    r = r_before
+    C = network.C1 + network.C2
+
+    P, Q = get_coupling(network.sigmas, tau)
+    N_eff = P.T @ network.N
+    QT = Q.T.tocsr()
+
+    S, L, I, R = network.S.copy(), network.L.copy(), network.I.copy(), network.R.copy()
+    L2, I2 = np.zeros_like(L), np.zeros_like(I)
+
+    start = T0
+    if state is not None:
+        start = state["t"]
+        S, L, I, R, L2, I2 = (np.array(state[name]) for name in state_compartments)
+        rng.bit_generator.state = state["rng"]
+        if 0 <= moving_t < start:
+            r = r_after
+
+    traj = np.zeros((max(0, T0+maxT-start), Npop, K, len(compartments)), dtype=np.int64)
+    for day, t in enumerate(range(start, T0+maxT)):
+        if t == T0+second_wave:
+            newL = rng.binomial(L, second_infected_ratio)
+            newI = rng.binomial(I, second_infected_ratio)
+            L, L2 = L-newL, L2+newL
+            I, I2 = I-newI, I2+newI
+        if t == moving_t:
+            r = r_after
+
+        act_beta = beta*seasonality(c, t)
+        act_beta2 = beta2*seasonality(c, t) if t >= T0+second_wave else act_beta
+
+        # S -> L
+        newL = rng.binomial(S, force_of_infection(I, act_beta, r, C, P, QT, N_eff))
+        newL2 = rng.binomial(S-newL, force_of_infection(I2, act_beta2, r, C, P, QT, N_eff))
+        # L -> I
+        newI = rng.binomial(L, eps)
+        newI2 = rng.binomial(L2, eps)
+        # I -> R
+        newR1 = rng.binomial(I, mu)
+        newR2 = rng.binomial(I2, mu)
+
+        S = S - newL - newL2
+        L, I = L + newL - newI, I + newI - newR1
+        L2, I2 = L2 + newL2 - newI2, I2 + newI2 - newR2
+        R = R + newR1 + newR2
+
+        traj[day, :, :, 0] = newI
+        traj[day, :, :, 1] = newI2
+        traj[day, :, :, 2] = R
+    if return_state:
+        return traj, dict(zip(state_compartments, (S, L, I, R, L2, I2)), t=T0+maxT, rng=rng.bit_generator.state)
+    return traj
+
+def save_state(path, state):
+    # State of a run (see simulate), continued with load_state
+    arrays = {name: state[name] for name in state_compartments}
+    with open(path, "wb") as f:
+        np.savez(f, t=state["t"], rng=np.array(json.dumps(state["rng"])), **arrays)
+
+def load_state(path):
+    with np.load(path) as data:
+        state = {name: data[name] for name in state_compartments}
+        state.update(t=int(data["t"]), rng=json.loads(str(data["rng"])))
+    return state
@@ -1,25 +1,89 @@
 import numpy as np
 import pandas as pd
 
-def get_county_loss(county_ground_truth, sim_data, equal_ratio):
-    # Squared Mean Loss for each day
-    # Mean for all county
-    c_losses = []
-    for county,chart in sim_data:
-        # TODO
-        if(county == "főváros"): county="Budapest"
-        
-        if(county not in county_ground_truth.columns):
-            print(f"County not found! {county}")
-        else:
-            g_truth = county_ground_truth[county].to_numpy()
-            loss = np.mean(np.abs(g_truth-equal_ratio*chart)**1)
-            c_losses.append(loss)
-    
-    return np.mean(c_losses)
-
-def get_global_loss(global_ground_truth, sim_data, equal_ratio):
-    # Squared Mean Loss for each day
-    loss = np.mean(np.abs(global_ground_truth-equal_ratio*sim_data)**1)
-
-    return loss
\ No newline at end of file
+# === Vectorized shift search ===
+# County names of the simulation that have a different name in the ground truth
+county_aliases = {"főváros": "Budapest"}
+
+def get_ground_truth(county_data, counties, total="Összesen"):
+    """
+    Description:
+        Ground truth as arrays, with the counties in the order of the simulated ones
+    Parameters:
+        * county_data : ground truth table (see precompute.py)
+        * counties    : county names of the simulation (see aggregation.Aggregator)
+    Returns:
+        * (days, found counties) array, (days,) national array, indexes of the found counties
+    """
+    names = [county_aliases.get(c, c) for c in counties]
+    found = [i for i,c in enumerate(names) if c in county_data.columns]
+    for c in names:
+        if(c not in county_data.columns):
+            print(f"County not found! {c}")
+    g_counties = county_data[[names[i] for i in found]].to_numpy(dtype=float)
+    return g_counties, county_data[total].to_numpy(dtype=float), np.array(found, dtype=int)
+
+def get_shift_losses(g_counties, g_total, found, sim_counties, shifts, start, global_rate, max_elements=2**20):
+    """
+    Description:
+        Loss of every candidate shift, for one or a batch of simulations at once.
+        The simulation of T days is compared to the ground truth days [start-shift, start-shift+T),
+        after scaling it by equal_ratio = sum(ground truth) / sum(simulation) of that window:
+            loss = (1-global_rate)*mean_counties(MAE) + global_rate*MAE(national)
+    Parameters:
+        * g_counties, g_total, found : see get_ground_truth
+        * sim_counties               : (T, counties) or (runs, T, counties) simulated curves
+        * shifts                     : candidate shifts
+        * start                      : ground truth day of the first simulated day at shift 0
+        * max_elements               : size of the temporary arrays (runs are processed in chunks)
+    Returns:
+        * losses, equal_ratios : (shifts,) or (runs, shifts) arrays
+    """
+    sim_counties = np.asarray(sim_counties, dtype=float)
+    single = sim_counties.ndim == 2
+    sim_counties = sim_counties[None] if single else sim_counties
+    runs, T, _ = sim_counties.shape
+    first = start - np.asarray(shifts)
+
+    # Sliding windows of the ground truth: (shifts, T) and (shifts, counties, T)
+    w_total = np.lib.stride_tricks.sliding_window_view(g_total, T)[first]
+    w_counties = np.ascontiguousarray(np.lib.stride_tricks.sliding_window_view(g_counties, T, axis=0)[first])
+
+    sim_total = sim_counties.sum(axis=2)                                          # (runs, T)
+    sim_found = np.ascontiguousarray(sim_counties[:, :, found].transpose(0, 2, 1))  # (runs, counties, T)
+    ratios = w_total.sum(axis=1)[None, :] / sim_total.sum(axis=1)[:, None]          # (runs, shifts)
+
+    # Runs are processed in chunks, the (chunk, shifts, counties, T) buffer is reused
+    losses = np.zeros((runs, len(first)))
+    chunk = max(1, max_elements // max(1, w_counties.size))
+    buf = np.empty((min(chunk, runs),) + w_counties.shape)
+    for b in range(0, runs, chunk):
+        n = min(chunk, runs-b)
+        r = ratios[b:b+n, :, None]
+        global_loss = np.mean(np.abs(w_total[None] - r*sim_total[b:b+n, None, :]), axis=2)
+
+        diff = buf[:n]
+        np.multiply(r[..., None], sim_found[b:b+n, None], out=diff)
+        np.subtract(w_counties[None], diff, out=diff)
+        np.abs(diff, out=diff)
+        county_loss = diff.reshape(n, len(first), -1).mean(axis=2) if w_counties.size else np.full((n, len(first)), np.nan)
+        losses[b:b+n] = (1-global_rate)*county_loss + global_rate*global_loss
+
+    if single:
+        return losses[0], ratios[0]
+    return losses, ratios
+
+def get_optimal_shift(g_counties, g_total, found, sim_counties, shifts, start, global_rate):
+    """
+    Description:
+        Best shift of one or a batch of simulations (see get_shift_losses)
+    Returns:
+        * loss, equal_ratio, shift (scalars, or (runs,) arrays for a batch)
+    """
+    shifts = np.asarray(shifts)
+    losses, ratios = get_shift_losses(g_counties, g_total, found, sim_counties, shifts, start, global_rate)
+    best = np.argmin(losses, axis=-1)
+    if losses.ndim == 1:
+        return losses[best], ratios[best], shifts[best]
+    rows = np.arange(len(losses))
+    return losses[rows, best], ratios[rows, best], shifts[best]
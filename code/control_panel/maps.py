@@ -0,0 +1,148 @@
+import json
+import functools
+import numpy as np
+
+from trajectory import read_trajectory, compartments
+from aggregation import load_aggregator, read_cities, infection_compartments
+from losses import county_aliases
+from results import file_stamp
+
+# Geometries of the map levels: file (GeoJSON or TopoJSON), property naming the features
+geometries = {
+    "county": ("log/counties.geojson", "megye"),
+    "city": ("../hun_codes/scripts/cities.topojson", "NAME"),
+}
+
+def simplify(points, tolerance):
+    """
+    Description:
+        Douglas-Peucker simplification of a line, its end points are kept
+    Parameters:
+        * points    : (n, 2) array of lon/lat
+        * tolerance : maximal distance (degrees) of the removed points from the simplified line
+    """
+    if len(points) < 3 or tolerance <= 0:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points)-1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        segment, rel = points[b] - points[a], points[a+1:b] - points[a]
+        norm = np.hypot(*segment)
+        if norm > 0:
+            dist = np.abs(segment[0]*rel[:, 1] - segment[1]*rel[:, 0]) / norm
+        else:
+            dist = np.hypot(rel[:, 0], rel[:, 1])  # closed ring
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            stack += [(a, a+1+i), (a+1+i, b)]
+            keep[a+1+i] = True
+    return points[keep]
+
+def simplify_ring(ring, tolerance):
+    # A ring keeps at least 4 points (closed triangle)
+    simple = simplify(ring, tolerance)
+    return simple if len(simple) >= 4 else ring
+
+def decode_arcs(topology):
+    # Arcs of a TopoJSON topology as (n, 2) lon/lat arrays (quantized arcs are delta-encoded)
+    transform = topology.get("transform")
+    arcs = []
+    for arc in topology["arcs"]:
+        arc = np.array(arc, dtype=float)[:, :2]
+        if transform:
+            arc = np.cumsum(arc, axis=0) * transform["scale"] + transform["translate"]
+        arcs.append(arc)
+    return arcs
+
+def topology_polygons(geometry, arcs):
+    # Polygons (lists of rings) of a TopoJSON geometry
+    def ring(indices):
+        parts = [arcs[i] if i >= 0 else arcs[~i][::-1] for i in indices]
+        return np.concatenate([parts[0]] + [part[1:] for part in parts[1:]])
+    if geometry["type"] == "Polygon":
+        return [[ring(r) for r in geometry["arcs"]]]
+    if geometry["type"] == "MultiPolygon":
+        return [[ring(r) for r in polygon] for polygon in geometry["arcs"]]
+    return []
+
+def geojson_polygons(geometry):
+    if geometry is None:
+        return []
+    if geometry["type"] == "Polygon":
+        return [[np.array(r, dtype=float)[:, :2] for r in geometry["coordinates"]]]
+    if geometry["type"] == "MultiPolygon":
+        return [[np.array(r, dtype=float)[:, :2] for r in polygon] for polygon in geometry["coordinates"]]
+    return []
+
+def to_feature(name, polygons, digits=5):
+    coordinates = [[np.round(ring, digits).tolist() for ring in polygon] for polygon in polygons]
+    return {"type": "Feature", "id": name, "properties": {},
+            "geometry": {"type": "MultiPolygon", "coordinates": coordinates}}
+
+@functools.lru_cache(maxsize=8)
+def load_geometry(path, stamp, key, tolerance=0.002):
+    """
+    Description:
+        Simplified GeoJSON of a geometry file, parsed and simplified once per file version (stamp).
+        The arcs of a TopoJSON are simplified once, so neighbouring features keep a common border.
+    Parameters:
+        * key       : property naming the features (the feature ids of the result)
+        * tolerance : see simplify
+    Returns:
+        * FeatureCollection (feature ids: names)
+    """
+    with open(path) as file:
+        data = json.load(file)
+
+    features = []
+    if data.get("type") == "Topology":
+        arcs = [simplify(arc, tolerance) for arc in decode_arcs(data)]
+        for obj in data["objects"].values():
+            for geometry in obj.get("geometries", []):
+                polygons = topology_polygons(geometry, arcs)
+                if polygons:
+                    features.append(to_feature(geometry["properties"][key], polygons))
+    else:
+        for feature in data["features"]:
+            polygons = [[simplify_ring(ring, tolerance) for ring in polygon] for polygon in geojson_polygons(feature["geometry"])]
+            if polygons:
+                features.append(to_feature(feature["properties"][key], polygons))
+    return {"type": "FeatureCollection", "features": features}
+
+def get_geometry(level, tolerance=0.002):
+    path, key = geometries[level]
+    return load_geometry(path, file_stamp(path), key, tolerance)
+
+@functools.lru_cache(maxsize=16)
+def load_map_frames(run_file, stamp, level, pop_file, K, max_frames):
+    """
+    Description:
+        Daily values of a map animation of a run: new infections of each county or city,
+        only of the features of the geometry, every k-th day (at most max_frames frames)
+    Returns:
+        * {"locations": names, "days": (frames,), "values": (frames, locations) array, "zmax"}
+    """
+    traj = read_trajectory(run_file)[0]
+    if level == "county":
+        aggregator = load_aggregator(pop_file, K)
+        names = [county_aliases.get(c, c) for c in aggregator.counties]
+        curves = aggregator.aggregate(traj)["county"]
+    else:
+        names = [city for _, city, _, _ in sorted(read_cities(pop_file))]
+        summed = [compartments.index(c) for c in infection_compartments]
+        curves = np.asarray(traj)[..., summed].sum(axis=(2, 3))
+
+    known = {feature["id"] for feature in get_geometry(level)["features"]}
+    columns = [i for i, name in enumerate(names) if name in known]
+    step = max(1, int(np.ceil(len(curves) / max_frames)))
+    days = np.arange(0, len(curves), step)
+    values = np.rint(np.asarray(curves, dtype=float)[days][:, columns])
+    return {"locations": [names[i] for i in columns], "days": days, "values": values,
+            "zmax": float(values.max()) if values.size else 1.0}
+
+def get_map_frames(run_file, level, pop_file, K, max_frames=100):
+    return load_map_frames(run_file, file_stamp(run_file), level, pop_file, K, max_frames)
@@ -0,0 +1,242 @@
+import io
+import os
+import functools
+import threading
+import numpy as np
+import pandas as pd
+
+from cache import RunCache, Manifest
+from store import has_store, read_runs, read_curves, read_metadata, runs_file, curves_file
+
+# === Results of the sweeps (log/helper, written by runner.py) for the app ===
+
+def helper_file(sim, suffix):
+    return f"log/helper/{sim}_{suffix}"
+
+def file_stamp(path):
+    # (mtime, size) of a file: the cached tables of a file are reloaded when it changes (None: no file yet)
+    if(not os.path.exists(path)):
+        return None
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+def sweep_files(sim):
+    """
+    Description:
+        Tables of a sweep:
+            * the columnar store (see store), written when the sweep ends
+            * the csv files of the sweeps written before the store
+            * the logs of a running sweep (_distribution.csv and _agg_stream.csv)
+    """
+    prefix = f"log/helper/{sim}"
+    if(has_store(prefix)):
+        return (runs_file(prefix), curves_file(prefix))
+    agg = helper_file(sim, "agg.csv")
+    return (helper_file(sim, "distribution.csv"), agg if os.path.exists(agg) else helper_file(sim, "agg_stream.csv"))
+
+def run_labels(df):
+    # Names of the curves of the runs (see runner.SweepLog)
+    columns = ["R0", "R1", "R1_shift", "id"] + (["replicate"] if "replicate" in df else [])
+    return functools.reduce(lambda a, b: a + "_" + b, [df[c].astype(float).astype(str) for c in columns])
+
+@functools.lru_cache(maxsize=16)
+def read_distribution(path, stamp):
+    # Distribution table of a sweep, sorted by loss (stamp: see file_stamp)
+    if(stamp is None):
+        df = pd.DataFrame(columns=["R0", "R1", "R1_shift", "loss", "equal_ratio", "shift", "id"], dtype=float)
+    elif(path.endswith(".parquet")):
+        df = read_runs(path[:-len("_runs.parquet")])
+    else:
+        df = pd.read_csv(path, index_col=0, float_precision="round_trip")
+    df["label"] = run_labels(df)
+    return df.sort_values("loss", kind="stable")
+
+@functools.lru_cache(maxsize=8)
+def read_agg(path, stamp):
+    # Curves of the runs (columns) and the ground truth
+    if(stamp is None):
+        return pd.DataFrame(columns=["Ground truth"], dtype=float)
+    if(path.endswith("_agg_stream.csv")):
+        # Running sweep: one row per run, the ground truth (of the best shift) is known at the end
+        agg = pd.read_csv(path, header=None, index_col=0).T.reset_index(drop=True)
+        agg["Ground truth"] = np.nan
+        return agg
+    return pd.read_csv(path, index_col=0)
+
+@functools.lru_cache(maxsize=8)
+def read_below(dist_path, dist_stamp, agg_path, agg_stamp, th):
+    """
+    Description:
+        Curves of the runs with loss < th (columns: labels, best first) and the ground truth.
+        From the store only the row groups of these runs are read.
+    """
+    distribution = read_distribution(dist_path, dist_stamp)
+    below = distribution.iloc[:np.searchsorted(distribution["loss"].to_numpy(), th, side="left")]
+    if(agg_path.endswith(".parquet")):
+        prefix = agg_path[:-len("_curves.parquet")]
+        ground_truth = read_metadata(prefix)["ground_truth"]
+        curves = read_curves(prefix, below["run"].to_numpy()).reindex(np.arange(len(ground_truth)))
+        curves.columns = below["label"].to_numpy()
+        curves["Ground truth"] = ground_truth
+        return curves
+    agg = read_agg(agg_path, agg_stamp)
+    labels = [label for label in below["label"] if label in agg.columns]
+    return agg[labels + ["Ground truth"]]
+
+@functools.lru_cache(maxsize=16)
+def read_manifest(path, stamp):
+    # (id, replicate) -> cache key of the runs of a sweep manifest
+    runs = {}
+    for name, key in Manifest(path).runs.items():
+        params = dict(p.split("=") for p in os.path.basename(name).split("_"))
+        runs[(float(params["id"]), float(params["rep"]) if "rep" in params else None)] = key
+    return runs
+
+class Sweep:
+    """
+    Description:
+        Tables of a sweep, each file is parsed once (and again only when it changes):
+            * distribution : one row per run, sorted by loss
+            * curves       : curves of the runs (columns), with the ground truth
+        From the columnar store (see store) if the sweep has one, else from the csv files.
+        A loss threshold is a binary search in the sorted losses, the result is a slice of the table.
+    Parameters:
+        * sim : ID of the sweep
+    """
+    def __init__(self, sim):
+        self.sim = sim
+        self.files = sweep_files(sim)
+        self.distribution = read_distribution(self.files[0], file_stamp(self.files[0]))
+        self.losses = self.distribution["loss"].to_numpy()
+
+    def below(self, th):
+        # Runs with loss < th (best first)
+        return self.distribution.iloc[:np.searchsorted(self.losses, float(th), side="left")]
+
+    def run_file(self, row):
+        # Stored trajectory of a run (a row of the distribution table), None if not found
+        path = helper_file(self.sim, "manifest.jsonl")
+        if not os.path.exists(path):
+            return None
+        replicate = row.get("replicate")
+        key = read_manifest(path, file_stamp(path)).get((float(row["id"]), None if pd.isna(replicate) else float(replicate)))
+        return RunCache("log/cache").get(key) if key else None
+
+    def stamped(self):
+        # Files of the sweep with their stamps (the keys of the cached tables)
+        dist_path, agg_path = self.files
+        return (dist_path, file_stamp(dist_path), agg_path, file_stamp(agg_path))
+
+    def curves(self, th):
+        # Curves of the runs with loss < th, and the ground truth
+        return read_below(*self.stamped(), float(th))
+
+    def summary(self, th, quantiles=(5, 25, 50, 75, 95), max_points=None):
+        # Fan chart of the runs with loss < th (see get_summary)
+        return get_summary(*self.stamped(), float(th), tuple(quantiles), max_points)
+
+@functools.lru_cache(maxsize=64)
+def get_summary(dist_path, dist_stamp, agg_path, agg_stamp, th, quantiles, max_points):
+    """
+    Description:
+        Fan chart of the curves of the runs with loss < th, of a constant size whatever the number of runs:
+            * bands           : the quantile curves (percent)
+            * representatives : the best run, and the runs closest to the quartile and median curves
+            * ground truth
+        Cached per sweep file versions and threshold.
+    Parameters:
+        * max_points : decimation of the time axis (every k-th day, at most max_points days)
+    Returns:
+        * {"days", "runs", "bands": {q: curve}, "representatives": {label: curve}, "ground_truth"}
+    """
+    agg = read_below(dist_path, dist_stamp, agg_path, agg_stamp, th)
+    labels = list(agg.columns[:-1])
+    step = max(1, int(np.ceil(len(agg) / max_points))) if max_points else 1
+    summary = {"days": agg.index.to_numpy()[::step], "runs": len(labels), "bands": {}, "representatives": {},
+               "ground_truth": agg["Ground truth"].to_numpy()[::step]}
+    if not labels:
+        return summary
+
+    curves = agg[labels].to_numpy(dtype=float)
+    bands = np.percentile(curves, quantiles, axis=1)
+    summary["bands"] = {q: band[::step] for q, band in zip(quantiles, bands)}
+    chosen = [0] + [int(np.argmin(np.abs(curves - bands[quantiles.index(q)][:, None]).mean(axis=0)))
+                    for q in (25, 50, 75) if q in quantiles]
+    summary["representatives"] = {labels[i]: curves[::step, i] for i in dict.fromkeys(chosen)}
+    return summary
+
+def get_sweep(sim):
+    return Sweep(sim)
+
+class SweepTail:
+    """
+    Description:
+        Follows the results log of a sweep while it runs (the append-only {ID}_distribution.csv
+        of runner.SweepLog): each poll parses only the records appended since the last offset,
+        a partly written line is left for the next poll. A new sweep of the same ID (a new or
+        shorter file) starts again from the beginning.
+    Parameters:
+        * sim : ID of the sweep
+    """
+    def __init__(self, sim):
+        self.sim = sim
+        self.path = helper_file(sim, "distribution.csv")
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.inode = None
+        self.header = None
+        self.table = pd.DataFrame()
+        self.best = np.empty(0)  # best loss so far, after each run
+
+    def finished(self):
+        # The columnar store is written when the sweep ends
+        return has_store(f"log/helper/{self.sim}")
+
+    def poll(self):
+        # Reads the new records, returns their number
+        with self.lock:
+            if(not os.path.exists(self.path)):
+                self.reset()
+                return 0
+            st = os.stat(self.path)
+            if(st.st_ino != self.inode or st.st_size < self.offset):
+                self.reset()
+                self.inode = st.st_ino
+            with open(self.path, "rb") as file:
+                file.seek(self.offset)
+                data = file.read()
+            end = data.rfind(b"\n") + 1
+            if(end == 0):
+                return 0
+            self.offset += end
+            data = data[:end]
+            if(self.header is None):
+                line = data.index(b"\n") + 1
+                self.header, data = data[:line], data[line:]
+            if(not data):
+                return 0
+
+            new = pd.read_csv(io.BytesIO(self.header + data), index_col=0, float_precision="round_trip")
+            best = np.minimum.accumulate(new["loss"].to_numpy(dtype=float))
+            if(len(self.best)):
+                best = np.minimum(best, self.best[-1])
+            self.table = pd.concat([self.table, new]) if len(self.table) else new
+            self.best = np.concatenate([self.best, best])
+            return len(new)
+
+    def since(self, start):
+        # Records from the start-th run on, with the best loss so far after each of them, and the number of runs
+        with self.lock:
+            return self.table.iloc[start:], self.best[start:], len(self.best)
+
+# Tails of the sweeps followed by the app
+tails = {}
+
+def get_tail(sim):
+    if(sim not in tails):
+        tails[sim] = SweepTail(sim)
+    tails[sim].poll()
+    return tails[sim]
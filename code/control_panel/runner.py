@@ -1,116 +1,391 @@
 import os
 import json
+import time
 import yaml
 import argparse
 import itertools
+import queue
+import threading
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from subprocess import Popen, STDOUT, PIPE
-from multiprocessing import Pool
+from multiprocessing import Pool, Process
 from logger import TBLogger
 
-from losses import get_county_loss, get_global_loss
+from losses import get_ground_truth, get_optimal_shift
+from engine import load_network, simulate, save_state, load_state
+from trajectory import read_trajectory, write_trajectory, is_meta_file, meta_file
+from cache import RunCache, Manifest
+from scheduler import Job, run_jobs, available_cores
+from aggregation import load_aggregator
+from sampling import get_design, get_runs, model_parameters
+from workqueue import Coordinator, run_worker, parse_address
+from store import write_store
 
 def read_yaml(filename="input.yaml"):
     with open(filename) as file:
         args = yaml.load(file, Loader=yaml.FullLoader)
     return args
 
-def run(c_args, R0, R1, shift, ind):
+def get_command(c_args, R0, R1, shift, ind, out=None):
+    c_args = dict(c_args)
     c_args["--R0"]=R0
     c_args["--R1"]=R1
     #c_args["--seed"]=ind
     c_args["--second_wave"] = shift
-    c_args["--out"]=c_args["--out"]+f"R0={R0}_R1={R1}_shift={shift}_id={ind}"
+    c_args["--out"]=out if out is not None else c_args["--out"]+get_name(R0, R1, shift, ind)
 
     str_args = [str(item) for pair in c_args.items() for item in pair]
-    p = Popen([ "../bin/main"] + str_args,
-          stdout=PIPE, stdin=PIPE, stderr=STDOUT, bufsize=1, universal_newlines=True)
-    p.communicate()
-
-def get_inf_curve(df, K, death_rate):
-    # Works for only 2 I compartment
-    # TODO: make it tiny
-    inf_cols = [c for c in df.columns if c[0:2]=='I_']
-    inf_cols2 = [c for c in df.columns if c[0:2]=='I2']
-    Is = df.filter(inf_cols, axis=1)
-    Is2 = df.filter(inf_cols2, axis=1)
-    
-    I = np.zeros((len(Is), K, len(Is.columns)//K))
-    for c in Is.columns:
-        _,city,age = c.split("_")
-        I[:,int(age), int(city)] = Is.loc[:, c]
-    I2 = np.zeros((len(Is2), K, len(Is2.columns)//K))
-    for c in Is2.columns:
-        _,city,age = c.split("_")
-        I2[:,int(age), int(city)] = Is2.loc[:, c]
-    
-    I = np.sum(I, axis=2)
-    I2 = np.sum(I2, axis=2)
-    # Aggregate over cities
-    return np.sum(I*death_rate, axis=1)+np.sum(I2*death_rate, axis=1), Is.sum(axis=1), Is2.sum(axis=1)
-
-def aggregate_county(df, K, pop_file):
-    # Get city indexes of county
-    with open(pop_file) as file:
-        rows = []
-        for row in json.load(file)["populations"]:
-            rows.append((row["index"], row["city"],row["admin_municip"], row["admin_county"]))
-        city_df = pd.DataFrame(rows, columns=["index", "city", "municip", "county"])
-        network_size = len(city_df)
-        county_IDs = city_df.groupby('county').index.apply(list).to_dict()
-
-    charts = []
-    for county, cities in county_IDs.items():
-        infs = [f"I_{city}_{age}" for city in cities for age in range(K)] + \
-               [f"I2_{city}_{age}" for city in cities for age in range(K)]
-        chart = df[infs].agg(sum, axis=1)
-        charts.append((county, chart))
-    
-    df = pd.DataFrame({county:chart for county,chart in charts})
-    #df.to_csv(f"log/{args['simulation']['ID']}/county.csv")
-    return network_size, charts
-
-def aggregate_age(df, K, network_size):
-    charts = []
-    for age in range(K):
-        infs = [f"I_{city}_{age}" for city in range(network_size)] + \
-               [f"I2_{city}_{age}" for city in range(network_size)]
-        chart = df[infs].agg(sum, axis=1)
-        charts.append(chart)
-            
-    df = pd.DataFrame({str(age):charts[age] for age in range(K)})
-    #df.to_csv(f"log/{args['simulation']['ID']}/ages.csv")
-
-
-def aggregate_all(df, K, network_size):
-    # TODO multiply with death ratio
-    infs = [f"I_{city}_{age}" for city in range(network_size) for age in range(K)] + \
-            [f"I2_{city}_{age}" for city in range(network_size) for age in range(K)]
-    chart = df[infs].agg(sum, axis=1)
-
-def get_optimal_shift(county_data, c_charts):
-    sim_aggregated = np.sum([chart for label,chart in c_charts], axis=0)
-    losses = []
-    for i in range(80):
-        # Compute shift
-        shifted_GT = county_data.iloc[154-i:154+args['simulation']['simulated_days']-i]
-
-        # Normalize
-        equal_ratio = np.sum(shifted_GT["Összesen"])/np.sum(sim_aggregated)
-
-        # Get loss components
-        county_loss = get_county_loss(shifted_GT, c_charts, equal_ratio)
-        global_loss = get_global_loss(shifted_GT["Összesen"].to_numpy(), sim_aggregated, equal_ratio)
-
-        # Compute final loss
-        r = args["loss"]["global_rate"]
-        loss = (1-r)*county_loss + r*global_loss
-        losses.append((loss, equal_ratio, i))
-
-    ind_min = np.argmin(losses)
-    return losses[ind_min]
+    return [ "../bin/main"] + str_args
+
+def get_engine_kwargs(c_args):
+    # Model constants of engine.simulate given as engine arguments (see sampling.model_parameters)
+    return {arg[2:]: c_args[arg] for arg in ["--tau", "--second_infected_ratio"] if arg in c_args}
+
+def run_python(c_args, R0, R1, shift, ind):
+    # In-process engine: no subprocess, returns the trajectory instead of writing csv
+    network = load_network(c_args["--config"])
+    traj = simulate(network, R0=R0, R1=R1, maxT=c_args["--maxT"], c=c_args["--c"],
+                    second_wave=shift, seed=c_args["--seed"], **get_engine_kwargs(c_args))
+    return get_name(R0, R1, shift, ind), traj
+
+def get_name(R0, R1, shift, ind, replicate=None, seed=None, params=None):
+    # params: sampled model constants (see sampling.model_parameters)
+    name = f"R0={R0}_R1={R1}_shift={shift}_id={ind}"
+    name += "".join(f"_{model_parameters[p][1]}={value}" for p, value in (params or {}).items())
+    return name if replicate is None else name + f"_rep={replicate}_seed={seed}"
+
+def get_key_args(c_args, R0, R1, shift):
+    # Model arguments of a run (see cache.model_args)
+    return dict(c_args, **{"--R0": R0, "--R1": R1, "--second_wave": shift})
+
+def list_results(folder):
+    # Binary (.npy) or csv outputs of main.cpp
+    return [f"{folder}/{file}" for file in os.listdir(folder) if not is_meta_file(file)]
+
+def parse_name(name):
+    # R0=..._R1=..._shift=..._id=...[_rep=..._seed=...] -> {"R0":.., "R1":.., "shift":.., "id":.., ...}
+    return {p.split('=')[0]: float(p.split('=')[1]) for p in os.path.basename(name).split('_')}
+
+# === Scoring in the worker processes (see init_worker) ===
+context = {}
+
+def init_worker(args):
+    pop_file = f"{args['network_config_folder']}/populations_KSH.json"
+    context["aggregator"] = load_aggregator(pop_file, args['age_groups'], tuple(args['death_rate']))
+    context["ground_truth"] = get_ground_truth(pd.read_csv("log/ground_truth_county.csv"), context["aggregator"].counties)
+    context["shifts"] = np.arange(args['loss'].get('max_shift', 80))
+    context["shift_start"] = args['loss'].get('shift_start', 154)
+    context["global_rate"] = args['loss']['global_rate']
+    context["cache"] = get_cache(args)
+
+def get_cache(args):
+    return RunCache("log/cache", args['simulation'].get('engine', 'binary'), "../bin/main")
+
+def score(name, traj):
+    # Aggregation and shift search of one finished simulation
+    views = context["aggregator"].aggregate(traj)
+    loss, equal_ratio, shift = get_optimal_shift(*context["ground_truth"], views["county"], context["shifts"],
+                                                 context["shift_start"], context["global_rate"])
+    return name, loss, equal_ratio, shift, views["county"].sum(axis=1)
+
+def simulate_and_score(task):
+    # Simulates a run of the in-process engine into the cache, and scores it (the result is named by the cache key)
+    engine, c_args, R0, R1, shift, ind, key = task
+    cache = context["cache"]
+    tmp = cache.tmp_path(key)
+    _, traj = run_python(c_args, R0, R1, shift, ind)
+    write_trajectory(tmp, traj, R0=R0, R1=R1, second_wave=int(shift), maxT=c_args["--maxT"], c=c_args["--c"], seed=c_args["--seed"], **get_engine_kwargs(c_args))
+    path = cache.commit(tmp, key)
+    return score(key, read_trajectory(path)[0])
+
+def read_and_score(task):
+    name, file = task
+    return score(name, read_trajectory(file)[0])
+
+def read_and_score_partial(task):
+    # First days of a stored run (a checkpoint of successive_halving)
+    name, file, day = task
+    return score(name, read_trajectory(file, days=slice(0, day))[0])
+
+def commit_segment(cache, traj, c_args, R0, R1, shift, start_key, day_key):
+    # Stores a run up to a checkpoint day: the run of the previous checkpoint (start_key, if any) and the new days
+    if(start_key is not None):
+        traj = np.concatenate([read_trajectory(cache.get(start_key))[0], traj])
+    tmp = cache.tmp_path(day_key)
+    write_trajectory(tmp, traj, R0=R0, R1=R1, second_wave=int(shift), maxT=c_args["--maxT"], c=c_args["--c"], seed=c_args["--seed"],
+                     **get_engine_kwargs(c_args))
+    return cache.commit(tmp, day_key)
+
+def simulate_segment(task):
+    # Continues a run of the in-process engine up to a checkpoint day (see get_segment), and scores it
+    engine, c_args, R0, R1, shift, ind, key, start, start_key, day_key = task
+    cache = context["cache"]
+    network = load_network(c_args["--config"])
+    state = load_state(cache.state_path(start_key)) if start else None
+    traj, state = simulate(network, R0=R0, R1=R1, maxT=c_args["--maxT"], c=c_args["--c"],
+                           second_wave=shift, seed=c_args["--seed"], state=state, return_state=True, **get_engine_kwargs(c_args))
+    tmp = cache.tmp_path(day_key, "state")
+    save_state(tmp, state)
+    cache.commit(tmp, day_key, "state")
+    path = commit_segment(cache, traj, c_args, R0, R1, shift, start_key if start else None, day_key)
+    return score(key, read_trajectory(path)[0])
+
+def process(job):
+    kind, task = job
+    if(kind == "simulate"):
+        return simulate_and_score(task)
+    if(kind == "segment"):
+        return simulate_segment(task)
+    if(kind == "partial"):
+        return read_and_score_partial(task)
+    return read_and_score(task)
+
+def schedule_binary(jobs, cache, args):
+    """
+    Description:
+        Jobs of the scoring pool. Runs of the binary engine are not pool jobs: they are
+        run by the async scheduler (in a thread), and yielded to be scored as they finish.
+        A run whose output could not be stored does not stop the others: the errors are
+        raised once every run has finished
+    """
+    is_binary = lambda kind, task: kind in ("simulate", "segment") and task[0] != "python"
+    binary = [(kind, task) for kind,task in jobs if is_binary(kind, task)]
+    for kind, task in jobs:
+        if(not is_binary(kind, task)):
+            yield kind, task
+    if(not binary):
+        return
+
+    finished = queue.Queue()
+    def on_done(job):
+        kind, task, tmp, state = job.data
+        engine, c_args, R0, R1, shift, ind, key = task[:7]
+        if(job.status == "ok" and kind == "simulate"):
+            finished.put(("score", (key, cache.commit(tmp, key, c_args["--format"]))))
+        elif(job.status == "ok"):
+            # Segment of a run: the days after the state of the previous checkpoint
+            start, start_key, day_key = task[7:]
+            cache.commit(state, day_key, "state")
+            if(start):
+                path = commit_segment(cache, read_trajectory(tmp)[0], c_args, R0, R1, shift, start_key, day_key)
+            else:
+                path = cache.commit(tmp, day_key, c_args["--format"])
+            finished.put(("score", (key, path)))
+        for file in [tmp, meta_file(tmp), state]:
+            if file is not None and os.path.exists(file):
+                os.remove(file)
+
+    engine_jobs = []
+    for kind, task in binary:
+        engine, c_args, R0, R1, shift, ind, key = task[:7]
+        out_key = key if kind == "simulate" else task[9]
+        tmp = cache.tmp_path(out_key, c_args["--format"])
+        command = get_command(c_args, R0, R1, shift, ind, out=tmp)
+        state = None
+        if(kind == "segment"):
+            start, start_key = task[7:9]
+            state = cache.tmp_path(out_key, "state")
+            command += (["--load_state", cache.state_path(start_key)] if start else []) + ["--save_state", state]
+        engine_jobs.append(Job(command, name=get_name(R0, R1, shift, ind), data=(kind, task, tmp, state)))
+
+    errors = []
+    def schedule():
+        try:
+            run_jobs(engine_jobs, max_jobs=min(args['simulation']["threads"], available_cores()),
+                     timeout=args['simulation'].get('timeout'), retries=args['simulation'].get('retries', 1),
+                     on_done=on_done, status_file=f"log/helper/{args['simulation']['ID']}_jobs.jsonl",
+                     run_id=args['simulation'].get('run_id'))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            finished.put(None)
+    threading.Thread(target=schedule, daemon=True).start()
+
+    while True:
+        job = finished.get()
+        if(job is None):
+            break
+        yield job
+    if(errors):
+        raise errors[0]
+    failed = [job for job in engine_jobs if job.error is not None]
+    if(failed):
+        raise RuntimeError(f"{len(failed)} of {len(engine_jobs)} runs could not be stored or scored, first one ({failed[0].name}):\n{failed[0].error}")
+
+# === Worker agents of a distributed sweep (see workqueue) ===
+def setup_worker(args):
+    # args: input.yaml of the coordinator
+    os.makedirs("log/helper", exist_ok=True)
+    context["args"] = args
+    init_worker(args)
+
+def run_remote(job):
+    # Simulation (either engine) and scoring of a job of the coordinator, None if the run failed.
+    # The stored run is sent back with the score, for the cache of the coordinator (see receive)
+    for local in schedule_binary([job], context["cache"], context["args"]):
+        result = process(local)
+        return result, context["cache"].pack(result[0])
+    return None
+
+def receive(results, cache):
+    # Results of the worker agents: their runs are stored in the cache of the coordinator
+    for result, run in results:
+        if(run is not None and cache.get(result[0]) is None):
+            cache.unpack(result[0], *run)
+        yield result
+
+def get_authkey(authkey=None):
+    # Shared key of the coordinator and the workers: --authkey, or the SWEEP_AUTHKEY environment variable
+    authkey = authkey or os.environ.get("SWEEP_AUTHKEY", "")
+    if(not authkey):
+        raise SystemExit("[main] distributed sweeps need a key: --authkey KEY or the SWEEP_AUTHKEY environment variable")
+    return authkey.encode()
+
+def serve(jobs, args, authkey):
+    """
+    Description:
+        Serves the simulations of a sweep to worker agents (runner.py --worker HOST:PORT),
+        returns the coordinator (iterated for the results)
+    """
+    distributed = args['simulation'].get('distributed') or {}
+    address = (distributed.get('host', '127.0.0.1'), distributed.get('port', 5757))
+    coordinator = Coordinator(jobs, address, authkey, hello=args, heartbeat=distributed.get('heartbeat', 10),
+                              retries=distributed.get('retries', 3))
+    print(f"[main] {len(jobs)} simulations served at {address[0]}:{address[1]}", flush=True)
+    return coordinator
+
+def get_segment(task, day, days, cache, args):
+    """
+    Description:
+        Job of a run up to a checkpoint day (see successive_halving), from the furthest point available:
+            * the run is stored in full, or up to this day : its first days are scored
+            * otherwise it is simulated from the saved state of the latest stored checkpoint (or from the beginning)
+    Parameters:
+        * task : simulation task of the full run (see the sweep)
+        * days : checkpoint days of the sweep
+    """
+    engine, c_args, R0, R1, shift, ind, key = task
+    path = cache.get(key)
+    if(path):
+        return "partial", (key, path, day)
+    day_keys = {d: cache.key(args['network_config_folder'], get_key_args(dict(c_args, **{"--maxT": d}), R0, R1, shift))
+                for d in days if d <= day}
+    path = cache.get(day_keys[day])
+    if(path):
+        return "score", (key, path)
+    start = max([d for d in day_keys if d < day and cache.get(day_keys[d]) and cache.get_state(day_keys[d])], default=0)
+    return "segment", (engine, dict(c_args, **{"--maxT": day}), R0, R1, shift, ind, key, start, day_keys.get(start), day_keys[day])
+
+def successive_halving(runs, names, cache, args, pool):
+    """
+    Description:
+        Early-stopping sweep: every run is simulated up to the first checkpoint day and scored
+        on its partial trajectory, only the best keep fraction is continued (from its saved state)
+        up to the next checkpoint, and so on. The runs that reach the last day (simulated_days) are
+        yielded like the results of a full sweep, the losses at the checkpoints are written to
+        log/helper/{ID}_rungs.csv.
+    Parameters:
+        * runs  : cache key -> simulation task of the full run
+        * names : cache key -> run names
+    """
+    early_stopping = args['simulation']['early_stopping']
+    maxT = args['simulation']['simulated_days']
+    days = sorted(d for d in set(early_stopping.get('checkpoints', [])) if 0 < d < maxT) + [maxT]
+    keep = early_stopping.get('keep', 0.5)
+    rung_file = f"log/helper/{args['simulation']['ID']}_rungs.csv"
+    if os.path.exists(rung_file):
+        os.remove(rung_file)
+
+    candidates, simulated_days = list(runs), 0
+    for day in days:
+        jobs = [get_segment(runs[key], day, days, cache, args) for key in candidates]
+        segments = [task for kind,task in jobs if kind == "segment"]
+        simulated_days += sum(day - task[7] for task in segments)
+        print(f"[halving] day {day}: {len(candidates)} runs, {len(segments)} to simulate", flush=True)
+        results = pool.imap_unordered(process, schedule_binary(jobs, cache, args))
+        if(day == maxT):
+            print(f"[halving] {simulated_days} simulated days ({simulated_days/(len(runs)*maxT):.1%} of the full sweep)", flush=True)
+            yield from results
+            return
+
+        losses = {key: (loss if np.isfinite(loss) else np.inf) for key, loss, *_ in results}
+        candidates = sorted(losses, key=losses.get)[:max(1, int(np.ceil(keep*len(losses))))]
+        promoted = set(candidates)
+        rows = [{"name": name, "day": day, "loss": loss, "promoted": key in promoted}
+                for key, loss in losses.items() for name in names.get(key, [key])]
+        pd.DataFrame(rows).to_csv(rung_file, mode="a", header=not os.path.exists(rung_file), index=False)
+
+class SweepLog:
+    """
+    Description:
+        Results of a sweep, written as they arrive:
+            * {ID}_distribution.csv : one row per simulation
+            * {ID}_agg_stream.csv   : one row per simulation, its scaled curve
+            * {ID}_runs.parquet     : written by close(), one row per simulation (run id, name, parameters, loss, ...)
+            * {ID}_curves.parquet   : written by close(), the scaled curves, with the ground truth of the best shift (see store)
+            * {ID}_points.csv       : written by close(), loss statistics of each parameter point over its replicates
+            * {ID}_agg.csv          : written by close(), the scaled curves (columns) and the ground truth,
+                                      for the readers of the csv files (see results.sweep_files)
+    """
+    def __init__(self, ID, county_data, shift_start, days):
+        self.prefix = f"log/helper/{ID}"
+        self.county_data = county_data
+        self.shift_start = shift_start
+        self.days = days
+        self.count = 0
+        self.best = None
+        self.rows = []
+        self.curves = []
+        self.labels = []
+        self.points = {}
+        for suffix in ["_distribution.csv", "_agg_stream.csv", "_agg.csv", "_runs.parquet", "_curves.parquet"]:
+            if os.path.exists(self.prefix + suffix):
+                os.remove(self.prefix + suffix)
+
+    def add(self, name, loss, equal_ratio, shift, sim_aggregated):
+        params = parse_name(name)
+        R0, R1, R1_shift, ind = params["R0"], params["R1"], params["shift"], params["id"]
+        point = {"R0":R0, "R1":R1, "R1_shift":R1_shift}
+        point.update({label: params[label] for _, label in model_parameters.values() if label in params})
+        row = dict(point, loss=loss, equal_ratio=equal_ratio, shift=shift, id=ind)
+        if("rep" in params):
+            row.update(replicate=params["rep"], seed=params["seed"])
+        pd.DataFrame([row], index=[self.count]).to_csv(self.prefix+"_distribution.csv", mode="a", header=(self.count==0))
+
+        label = (R0, R1, R1_shift, ind) + ((params["rep"],) if "rep" in params else ())
+        chart = equal_ratio*sim_aggregated
+        pd.DataFrame([[get_str(label)] + list(chart)]).to_csv(
+            self.prefix+"_agg_stream.csv", mode="a", header=False, index=False)
+        self.rows.append(dict(row, run=self.count, name=name))
+        self.curves.append(chart)
+        self.labels.append(label)
+        self.points.setdefault(tuple(point.items()), []).append(loss)
+
+        self.count += 1
+        if(self.best is None or loss < self.best[0]):
+            self.best = (loss, R0, R1, R1_shift, shift, ind)
+        return self.best
+
+    def close(self, metadata=None):
+        loss, R0, R1, R1_shift, shift, ind = self.best
+        g_truth = self.county_data["Összesen"].to_numpy()[self.shift_start-shift:self.shift_start-shift+self.days]
+        metadata = dict(metadata or {}, ground_truth=g_truth.tolist(), shift_start=self.shift_start, days=self.days,
+                        best={"loss": float(loss), "R0": R0, "R1": R1, "R1_shift": R1_shift, "shift": int(shift), "id": ind})
+        write_store(self.prefix, pd.DataFrame(self.rows), np.array(self.curves), metadata)
+        order = sorted(range(self.count), key=lambda i: self.labels[i])
+        pd.DataFrame(dict([("Ground truth", g_truth)] + [(get_str(self.labels[i]), self.curves[i]) for i in order])).to_csv(
+            self.prefix+"_agg.csv")
+
+        points = pd.DataFrame([dict(point, loss_mean=np.mean(l), loss_std=np.std(l), replicates=len(l))
+                               for point, l in self.points.items()]).sort_values("loss_mean")
+        points.to_csv(self.prefix+"_points.csv", index=False)
+        return self.best
+
+    def best_point(self):
+        # Parameter point with the lowest mean loss over its replicates
+        mean_loss, point = min((np.mean(l), point) for point, l in self.points.items())
+        return mean_loss, dict(point)
 
 def get_str(arr):
     return "_".join([str(a) for a in arr])
@@ -124,10 +399,27 @@ if __name__ == "__main__":
     parser.add_argument('--yaml', dest='yaml', default="input.yaml", help='Input yaml file')
     parser.add_argument('--sim', dest='sim', action='store_true',default=False, help='Do simulation, or use already simulated')
     parser.add_argument('--args', dest='show_args', action='store_true',default=False, help='Shows args from .yaml')
+    parser.add_argument('--serve', dest='serve', action='store_true',default=False, help='Serve the simulations to worker agents')
+    parser.add_argument('--worker', dest='worker', default=None, help='Run worker agents of the coordinator at HOST:PORT')
+    parser.add_argument('--procs', dest='procs', type=int, default=None, help='Number of worker agents (default: cores)')
+    parser.add_argument('--authkey', dest='authkey', default=None, help='Key of the coordinator and the workers (default: SWEEP_AUTHKEY)')
     options = parser.parse_args()
 
+    # === Worker agents: the args come from the coordinator ===
+    if(options.worker):
+        authkey = get_authkey(options.authkey)
+        agents = [Process(target=run_worker, args=(parse_address(options.worker), authkey, setup_worker, run_remote))
+                  for _ in range(options.procs or available_cores())]
+        for agent in agents:
+            agent.start()
+        for agent in agents:
+            agent.join()
+        exit(0)
+
     # === Read args ===
     args = read_yaml()
+    # Tag of this sweep in the job records (log/helper/{ID}_jobs.jsonl), also sent to the workers
+    args['simulation']['run_id'] = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
     if(options.show_args):
         print("[main] Args:")
         for key,val in args.items():
@@ -136,12 +428,15 @@ if __name__ == "__main__":
     # === Check some consistency in the doc ===
     assert(args['age_groups'] == len(args['death_rate']))
     assert(os.path.exists(args['network_config_folder']))
+    authkey = get_authkey(options.authkey) if(options.serve) else None
 
     ########################
     #      SIMULATION      #
     ########################
     if(not  os.path.exists(f"log/{args['simulation']['ID']}")):
         os.mkdir(f"log/{args['simulation']['ID']}")
+    cache = get_cache(args)
+    manifest = Manifest(f"log/helper/{args['simulation']['ID']}_manifest.jsonl")
     # === Run simulation ===
     if(options.sim):
         c_args = {
@@ -150,101 +445,86 @@ if __name__ == "__main__":
             "--maxT": args['simulation']['simulated_days'],
             "--c": args['seasonality'],
             "--seed":0,
+            "--format": args['simulation'].get('output', 'npy'),
         }
 
-        R0 = args['first_wave']['R0']['val']
-        R0_std = args['first_wave']['R0']['std']
-        R0_num = args['first_wave']['R0']['num']
-
-        R1 = args['second_wave']['R1']['val']
-        R1_std = args['second_wave']['R1']['std']
-        R1_num = args['second_wave']['R1']['num']
-        
-        shift = args['second_wave']['time']['val']
-        shift_std = args['second_wave']['time']['std']
-        shift_num = args['second_wave']['time']['num']
-
-        if(args['simulation']['distribution'] == 'grid'):
-            R0_distribution = np.linspace(R0-R0_std, R0+R0_std, R0_num)
-            R1_distribution = np.linspace(R1-R1_std, R1+R1_std, R1_num)
-            shift_distribution = np.linspace(shift-shift_std, shift+shift_std, shift_num, dtype=int)
-            
-            param_distribution = itertools.product(R0_distribution, R1_distribution, shift_distribution)
-        elif(args['simulation']['distribution'] == 'uniform'):
-            sim_num = args['simulation']['sim_num']
-            R0_distribution = np.random.uniform(R0-R0_std, R0+R0_std, sim_num)
-            R1_distribution = np.random.uniform(R1-R1_std, R1+R1_std, sim_num)
-            shift_distribution = np.random.randint(shift-shift_std, shift+shift_std, sim_num, dtype=int)
-
-            param_distribution = zip(R0_distribution, R1_distribution, shift_distribution)
-        else:
-            print("{args['simulation']['distribution']} parameter distribution not found!")
-            exit(1)
-
-        print([R0-R0_std, R0+R0_std], [R1-R1_std, R1+R1_std], [shift-shift_std, shift+shift_std])
-        pool = Pool(processes=args['simulation']["threads"])
-        for ind,(R0,R1,shift) in enumerate(param_distribution):
-            pool.apply_async(run, args=[c_args, R0, R1, shift, ind])
-        pool.close()
-        pool.join()
-        print('[main] Simulation ended')
+        # Parameter points (the design of the manifest is extended, see sampling.get_design)
+        design = get_design(args, manifest.design)
+        manifest.set_design(design)
+        sampled = [name for name, *_ in design["dimensions"][3:]]
+        print(f"[main] {design['distribution']}: {len(design['points'])} points of",
+              ", ".join(f"{name} [{low}, {high}]" for name, low, high, *_ in design["dimensions"]))
+        # Replicates of each point, with derived seeds (shared by the points in crn mode)
+        replicates = args['simulation'].get('replicates', 1)
+        base_seed = args['simulation'].get('seed', 0)
+        crn = args['simulation'].get('crn', False)
+
+        # Identical runs (same cache key) are simulated once, cached runs are only scored
+        engine = args['simulation'].get('engine', 'binary')
+        names, jobs, runs = {}, [], {}
+        for ind, (R0,R1,shift,*values), replicate, seed in get_runs(design["points"], replicates, base_seed, crn):
+            params = dict(zip(sampled, values))
+            run_args = dict(c_args, **{"--seed": seed}, **{model_parameters[name][0]: value for name, value in params.items()})
+            key = cache.key(args['network_config_folder'], get_key_args(run_args, R0, R1, shift))
+            if(key not in names):
+                names[key] = []
+                runs[key] = (engine, run_args, R0, R1, shift, ind, key)
+                path = cache.get(key)
+                jobs.append(("score", (key, path)) if path else ("simulate", runs[key]))
+            names[key].append(get_name(R0, R1, shift, ind, *((replicate, seed) if replicates > 1 else ()), params=params))
+        n_simulated = sum(kind == "simulate" for kind,_ in jobs)
+        print(f"[main] {sum(len(n) for n in names.values())} runs, {len(names)} distinct, {n_simulated} to simulate")
     else:
         print('[main] Simulations skiped')
+        # Runs of the manifest (if any), or the outputs of the log folder
+        names, jobs, runs = {}, [], {}
+        for name, key in manifest.runs.items():
+            path = cache.get(key)
+            if(path and key not in names):
+                jobs.append(("score", (key, path)))
+            names.setdefault(key, []).append(name)
+        if(not jobs):
+            names = {}
+            jobs = [("score", (os.path.basename(file), file)) for file in list_results(f"log/{args['simulation']['ID']}")]
     
     ########################
-    #       LOG/SIM        #
+    #       LOG/LOSS       #
     ########################
-    pop_file = f"{args['network_config_folder']}/populations_KSH.json" # TODO ==> read only once
+    # Each simulation is scored by the worker as soon as it finishes
     county_data = pd.read_csv("log/ground_truth_county.csv")
-    
-    losses_R0 = []
-    agg_charts = []
-    param_distribution = []
-    for file in os.listdir(f"log/{args['simulation']['ID']}"):
-        # === Read simulation data ===
-        #df = pd.read_csv(f"log/2/R0=2.7617185266303697")
-        df = pd.read_csv(f"log/{args['simulation']['ID']}/{file}")
-        R0, R1, R1_shift, ind = file.split('_')
-        R0 = float(R0.split('=')[1])
-        R1 = float(R1.split('=')[1])
-        R1_shift = float(R1_shift.split('=')[1])
-        ind = float(ind.split('=')[1])
-        #print(R0, R1, R1_shift)
-
-        # LOG: Deaths
-        #deaths, I, I2 = get_inf_curve(df, args['age_groups'], args['death_rate'])
-        
-        # LOG: Age groups
-        #aggregate_age(df, args['age_groups'], network_size)
-
-        # LOG: County infections
-        network_size, c_charts = aggregate_county(df, args['age_groups'], pop_file)
-
-        ########################
-        #       LOG/LOSS       #
-        ########################
-        #city_data = pd.read_csv("../hun_codes/data/HU_settlement_tempinfo.csv")
-
-        sim_aggregated = np.sum([chart for label,chart in c_charts], axis=0)
-
-        loss,equal_ratio, shift = get_optimal_shift(county_data, c_charts)
-        print(loss, equal_ratio, shift, ind)
-        losses_R0.append((loss, R0, R1, R1_shift, shift, ind))
-
-        agg_charts.append(((R0, R1, R1_shift, ind), equal_ratio*sim_aggregated))
-        param_distribution.append({"R0":R0, "R1":R1, "R1_shift":R1_shift, "loss":loss, "equal_ratio":equal_ratio, "shift":shift, "id":ind})
-
-    loss, R0, R1, R1_shift, shift, ind= min(losses_R0)
+    shift_start = args['loss'].get('shift_start', 154)
+    log = SweepLog(args['simulation']['ID'], county_data, shift_start, args['simulation']['simulated_days'])
+    with Pool(processes=min(args['simulation']["threads"], available_cores()), initializer=init_worker, initargs=(args,)) as pool:
+        if(runs and options.serve):
+            # Simulations by the worker agents, cached runs are scored here
+            if(args['simulation'].get('early_stopping')):
+                print("[main] early stopping is not supported by distributed sweeps, every run is simulated in full")
+            coordinator = serve([job for job in jobs if job[0] == "simulate"], args, authkey)
+            results = itertools.chain(pool.imap_unordered(process, [job for job in jobs if job[0] != "simulate"]),
+                                      receive(coordinator, cache))
+        elif(runs and args['simulation'].get('early_stopping')):
+            results = successive_halving(runs, names, cache, args, pool)
+        else:
+            results = pool.imap_unordered(process, schedule_binary(jobs, cache, args))
+        for key, loss, equal_ratio, shift, sim_aggregated in results:
+            for name in names.get(key, [key]):
+                best = log.add(name, loss, equal_ratio, shift, sim_aggregated)
+                if(key in names):
+                    manifest.add(name, key)
+            print(f"[main] {log.count} runs: loss = {loss:.4f} (shift = {shift}) | best: {best[0]:.4f} [R0 = {best[1]}, R1 = {best[2]}]", flush=True)
+    print('[main] Sweep ended')
+    if(runs and options.serve and coordinator.failed()):
+        print(f"[main] {len(coordinator.failed())} simulations failed on every attempt of the workers (see the coordinator log)")
+    if(log.best is None):
+        print(f"[main] No simulation found in log/{args['simulation']['ID']}")
+        exit(1)
+
+    design = manifest.design
+    loss, R0, R1, R1_shift, shift, ind = log.close(
+        {"design": {k: design[k] for k in ("distribution", "seed", "dimensions")}} if design else None)
     print(f"Minimal loss: {loss} [R0 = {R0}]")
-
-    # Log for all sims
-    g_truth = county_data["Összesen"].to_numpy()[154-shift:154-shift+args['simulation']['simulated_days']]
-    d_truth = {}
-    df = pd.DataFrame(dict([("Ground truth",g_truth)]+ [(get_str(params),data) for params,data in sorted(agg_charts)]))
-    df.to_csv(f"log/helper/{args['simulation']['ID']}_agg.csv")
-
-    df = pd.DataFrame(param_distribution)
-    df.to_csv(f"log/helper/{args['simulation']['ID']}_distribution.csv")
+    mean_loss, point = log.best_point()
+    print(f"Minimal mean loss over the replicates: {mean_loss} [" + ", ".join(f"{k} = {v}" for k, v in point.items()) + "]")
 
     #print(county_data[154:][["Budapest", "Dátum"]])
     # TODO:
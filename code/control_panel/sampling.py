@@ -0,0 +1,123 @@
+import json
+import hashlib
+import itertools
+import numpy as np
+from scipy.stats import qmc
+
+# Model constants that can be sampled besides R0, R1 and the shift (simulation.parameters):
+# name -> (engine argument, name in the run names)
+model_parameters = {
+    "seasonality": ("--c", "c"),
+    "tau": ("--tau", "tau"),
+    "second_infected_ratio": ("--second_infected_ratio", "ratio2"),
+}
+
+distributions = ["grid", "uniform", "lhs", "sobol"]
+
+def get_dimensions(args):
+    """
+    Description:
+        Sampled parameters of a sweep: R0, R1, the second-wave shift (integer), and the
+        model constants of simulation.parameters, each in [val-std, val+std]
+    Returns:
+        * list of [name, low, high, integer, num, val] (num: values of the grid, a single value is val)
+    """
+    specs = [("R0", args['first_wave']['R0'], False),
+             ("R1", args['second_wave']['R1'], False),
+             ("shift", args['second_wave']['time'], True)]
+    for name, spec in (args['simulation'].get('parameters') or {}).items():
+        if(name not in model_parameters):
+            raise ValueError(f"{name} can not be sampled (see sampling.model_parameters)")
+        specs.append((name, spec, False))
+    return [[name, spec['val']-spec['std'], spec['val']+spec['std'], integer, spec.get('num', 1), spec['val']] for name, spec, integer in specs]
+
+def get_grid(dimensions):
+    # Cartesian product of num values of each parameter (num = 1: its val)
+    axes = [np.linspace(low, high, num, dtype=int if integer else float) if num > 1 else np.array([val], dtype=int if integer else float)
+            for _, low, high, integer, num, val in dimensions]
+    return [[x.item() for x in point] for point in itertools.product(*axes)]
+
+def sample_unit(distribution, d, n, seed, start):
+    """
+    Description:
+        n points of the unit hypercube, following the first start points of the design:
+            * sobol        : the continuation of the scrambled sequence
+            * lhs, uniform : a new batch (its seed depends on start)
+    """
+    if(distribution == "sobol"):
+        engine = qmc.Sobol(d, scramble=True, seed=seed)
+        if(start):
+            engine.fast_forward(start)
+        return engine.random(n)
+    rng = np.random.default_rng([seed, start])
+    if(distribution == "lhs"):
+        return qmc.LatinHypercube(d, seed=rng).random(n)
+    return rng.random((n, d))
+
+def scale(u, dimensions):
+    # Unit hypercube -> parameter values (integer parameters: uniform over low..high)
+    points = []
+    for row in u:
+        point = []
+        for x, (_, low, high, integer, *_) in zip(row, dimensions):
+            point.append(min(int(np.floor(low + x*(high-low+1))), int(high)) if integer else float(low + x*(high-low)))
+        points.append(point)
+    return points
+
+def get_design(args, previous=None):
+    """
+    Description:
+        Parameter points of a sweep (simulation.distribution):
+            * grid    : Cartesian product of the num values of each parameter
+            * uniform : sim_num independent uniform draws
+            * lhs     : Latin hypercube of sim_num points
+            * sobol   : first sim_num points of a scrambled Sobol sequence (best with a power of 2)
+        The points of a previous design with the same distribution, seed and parameters are kept,
+        only the missing points are appended: a sweep is extended without changing its earlier points
+        (which are then found in the run cache). LHS and uniform designs grow by batches.
+    Parameters:
+        * args     : input.yaml
+        * previous : design of the sweep so far (see cache.Manifest)
+    Returns:
+        * design: {"distribution", "seed", "dimensions", "points"}
+    """
+    distribution = args['simulation']['distribution']
+    if(distribution not in distributions):
+        raise ValueError(f"{distribution} parameter distribution not found!")
+    seed = args['simulation'].get('seed', 0)
+    dimensions = get_dimensions(args)
+    if(distribution == "grid"):
+        return {"distribution": distribution, "seed": seed, "dimensions": dimensions, "points": get_grid(dimensions)}
+
+    points = []
+    if(previous is not None and [previous[k] for k in ("distribution", "seed")] == [distribution, seed]
+       and [d[:4] for d in previous["dimensions"]] == [d[:4] for d in dimensions]):
+        points = previous["points"]
+    sim_num = args['simulation']['sim_num']
+    if(sim_num > len(points)):
+        points = points + scale(sample_unit(distribution, len(dimensions), sim_num-len(points), seed, len(points)), dimensions)
+    return {"distribution": distribution, "seed": seed, "dimensions": dimensions, "points": points[:sim_num]}
+
+def point_key(point, digits=10):
+    # Integer key of the (rounded) values of a parameter point
+    text = json.dumps([round(float(x), digits) for x in point])
+    return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+
+def get_seed(base_seed, point, replicate, crn=False):
+    """
+    Description:
+        Seed of a run, derived from the base seed of the sweep:
+            * independent runs: from (parameter values, replicate), so equal points share their runs
+              (and run cache keys) wherever they are in the design
+            * common random numbers (crn): from the replicate only, so every parameter point
+              of a replicate shares the seed and the loss differences between points have lower variance
+    """
+    spawn_key = (replicate,) if crn else (point_key(point), replicate)
+    seed = np.random.SeedSequence(base_seed, spawn_key=spawn_key).generate_state(1)[0]
+    return int(seed & 0x7fffffff)
+
+def get_runs(points, replicates=1, base_seed=0, crn=False):
+    # Runs of a design: (index of the point, point, replicate, seed)
+    for ind, point in enumerate(points):
+        for replicate in range(replicates):
+            yield ind, point, replicate, get_seed(base_seed, point, replicate, crn)
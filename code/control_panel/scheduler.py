@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import traceback
+from collections import deque
+
+def available_cores():
+    # Cores this process may run on (cgroup/affinity aware where possible)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+class Job:
+    """
+    Description:
+        One engine invocation, and its outcome once scheduled:
+            * status    : "ok", "failed" (non-zero exit status) or "timeout"
+            * returncode, wall_time (of the last attempt), attempts
+            * tail      : last lines of the output (the rest, like progress output, is discarded)
+            * error     : traceback of the callback (see run_jobs), None if it succeeded
+    Parameters:
+        * cmd  : command line (list)
+        * name : identifier of the job
+        * data : anything the caller needs back in the callback
+    """
+    def __init__(self, cmd, name=None, data=None):
+        self.cmd = [str(c) for c in cmd]
+        self.name = name if name is not None else " ".join(self.cmd)
+        self.data = data
+        self.status = None
+        self.returncode = None
+        self.wall_time = None
+        self.attempts = 0
+        self.tail = ""
+        self.error = None
+
+    def record(self):
+        return {"name": self.name, "status": self.status, "returncode": self.returncode,
+                "wall_time": self.wall_time, "attempts": self.attempts, "error": self.error}
+
+async def drain(stream, tail, tail_bytes):
+    # Reads the output as it comes (so the pipe never fills up), keeps only its end
+    size = 0
+    while True:
+        block = await stream.read(1 << 16)
+        if not block:
+            break
+        tail.append(block)
+        size += len(block)
+        while size - len(tail[0]) >= tail_bytes:
+            size -= len(tail.popleft())
+
+async def run_job(job, semaphore, timeout, retries, tail_bytes, tail_lines):
+    async with semaphore:
+        while True:
+            job.attempts += 1
+            tail = deque()
+            start = time.time()
+            try:
+                proc = await asyncio.create_subprocess_exec(*job.cmd, stdin=asyncio.subprocess.DEVNULL,
+                                                            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            except OSError as e:
+                # the engine could not be started (e.g. missing binary): retrying does not help
+                job.status, job.returncode, job.wall_time, job.tail = "failed", None, time.time() - start, str(e)
+                return job
+            try:
+                await asyncio.wait_for(asyncio.gather(drain(proc.stdout, tail, tail_bytes), proc.wait()), timeout)
+                job.status = "ok" if proc.returncode == 0 else "failed"
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                job.status = "timeout"
+            job.returncode = proc.returncode
+            job.wall_time = time.time() - start
+            output = b"".join(tail).decode(errors="replace").replace("\r", "\n")
+            job.tail = "\n".join([line for line in output.splitlines() if line.strip()][-tail_lines:])
+            if job.status == "ok" or job.attempts > retries:
+                return job
+
+async def schedule(jobs, max_jobs, timeout, retries, on_done, tail_bytes, tail_lines):
+    semaphore = asyncio.Semaphore(max_jobs)
+    tasks = [asyncio.ensure_future(run_job(job, semaphore, timeout, retries, tail_bytes, tail_lines)) for job in jobs]
+    for task in asyncio.as_completed(tasks):
+        job = await task
+        if on_done is not None:
+            on_done(job)
+    return jobs
+
+def run_jobs(jobs, max_jobs=None, timeout=None, retries=0, on_done=None, status_file=None, run_id=None, tail_bytes=4096, tail_lines=10):
+    """
+    Description:
+        Runs engine invocations as asyncio subprocesses (no worker process per job):
+            * at most max_jobs at once (default: available cores)
+            * the output is read continuously and discarded, only its tail is kept
+            * a job is killed after timeout seconds, and failed/timed out jobs are retried
+    Parameters:
+        * jobs        : list of Job
+        * on_done     : called with each finished Job, in the order of completion. An exception of the
+                        callback is recorded in job.error and the other jobs go on
+        * status_file : json lines file receiving the status record of each finished job
+        * run_id      : tag of the records of this run in the status file (appended to by every run)
+    Returns:
+        * the jobs, with their outcome (check job.error)
+    """
+    max_jobs = max_jobs if max_jobs else available_cores()
+
+    def done(job):
+        if on_done is not None:
+            try:
+                on_done(job)
+            except Exception:
+                job.error = traceback.format_exc()
+        if status_file is not None:
+            with open(status_file, "a") as f:
+                f.write(json.dumps(dict(job.record(), run=run_id)) + "\n")
+        if job.status != "ok":
+            print(f"\n[scheduler] {job.name}: {job.status} (exit status {job.returncode}, "
+                  f"{job.attempts} attempts)\n{job.tail}", file=sys.stderr)
+        if job.error is not None:
+            print(f"\n[scheduler] {job.name}: callback failed\n{job.error}", file=sys.stderr)
+
+    return asyncio.run(schedule(jobs, max_jobs, timeout, retries, done, tail_bytes, tail_lines))
@@ -0,0 +1,74 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Row groups: the units skipped by the filters of the readers
+runs_per_group = 64       # curves file: runs per row group
+rows_per_group = 1024     # runs file: rows per row group (sorted by loss)
+
+def runs_file(prefix):
+    return f"{prefix}_runs.parquet"
+
+def curves_file(prefix):
+    return f"{prefix}_curves.parquet"
+
+def write_store(prefix, runs, curves, metadata=None):
+    """
+    Description:
+        Columnar (parquet, compressed) results of a sweep:
+            * {prefix}_runs.parquet   : one row per run (run id, name, parameters, loss, ...), sorted by loss
+            * {prefix}_curves.parquet : long (run, day, value) table of the curves, sorted by run
+        The row group statistics let the readers skip what a filter excludes (loss, parameter or
+        run filters), and only the requested columns are decompressed.
+    Parameters:
+        * prefix   : e.g. log/helper/{ID}
+        * runs     : DataFrame of the runs, with a "run" id column
+        * curves   : (runs, days) array, row i is the curve of the run of id i
+        * metadata : json-serializable sweep metadata (ground truth, parameters, ...)
+    """
+    meta = {b"sweep": json.dumps(metadata or {}).encode()}
+    table = pa.Table.from_pandas(runs.sort_values("loss", kind="stable"), preserve_index=False)
+    pq.write_table(table.replace_schema_metadata({**(table.schema.metadata or {}), **meta}), runs_file(prefix),
+                   row_group_size=rows_per_group, compression="zstd")
+
+    curves = np.asarray(curves, dtype=np.float32)
+    n, T = curves.shape if curves.size else (0, 0)
+    table = pa.table({
+        "run": pa.array(np.repeat(np.arange(n, dtype=np.int32), T)),
+        "day": pa.array(np.tile(np.arange(T, dtype=np.int16), n)),
+        "value": pa.array(curves.ravel()),
+    }).replace_schema_metadata(meta)
+    pq.write_table(table, curves_file(prefix), row_group_size=max(1, runs_per_group*T), compression="zstd")
+
+def read_metadata(prefix):
+    return json.loads(pq.read_schema(runs_file(prefix)).metadata[b"sweep"])
+
+def read_runs(prefix, columns=None, filters=None):
+    """
+    Description:
+        Runs of a sweep (sorted by loss), only the requested columns and the rows of the filters, e.g.
+            read_runs(prefix, ["run", "R0", "loss"], [("loss", "<", 600), ("R0", ">", 2.2)])
+    """
+    return pq.read_table(runs_file(prefix), columns=columns, filters=filters).to_pandas()
+
+def read_curves(prefix, runs, days=None):
+    """
+    Description:
+        Curves of some runs of a sweep: only the row groups of these runs are read
+    Parameters:
+        * runs : run ids
+        * days : optional (start, stop) of the days
+    Returns:
+        * DataFrame of days x runs
+    """
+    filters = [("run", "in", [int(r) for r in runs])]
+    if days is not None:
+        filters += [("day", ">=", days[0]), ("day", "<", days[1])]
+    df = pq.read_table(curves_file(prefix), filters=filters).to_pandas() if len(runs) else pd.DataFrame(columns=["run", "day", "value"])
+    return df.pivot(index="day", columns="run", values="value").reindex(columns=[int(r) for r in runs])
+
+def has_store(prefix):
+    return os.path.exists(runs_file(prefix)) and os.path.exists(curves_file(prefix))
@@ -0,0 +1,32 @@
+import numpy as np
+
+from cache import RunCache
+from trajectory import read_trajectory, write_trajectory
+
+
+def test_run_is_copied_between_caches(tmp_path):
+    worker, coordinator = RunCache(tmp_path / "worker", "python"), RunCache(tmp_path / "coordinator", "python")
+    key = "ab" + "0" * 62
+    traj = np.arange(2 * 3 * 6 * 8, dtype=float).reshape(2, 3, 6, 8)
+    tmp = worker.tmp_path(key)
+    write_trajectory(tmp, traj, R0=2.0, seed=3)
+    worker.commit(tmp, key)
+
+    assert coordinator.get(key) is None
+    coordinator.unpack(key, *worker.pack(key))
+    copied, meta = read_trajectory(coordinator.get(key))
+    assert np.array_equal(copied, traj) and meta["params"]["R0"] == 2.0
+    assert worker.pack("cd" + "0" * 62) is None
+
+
+def test_key_depends_on_the_run_only(tmp_path):
+    config = tmp_path / "net"
+    config.mkdir()
+    (config / "config.json").write_text("{}")
+    cache = RunCache(tmp_path / "cache", "python")
+    args = {"--R0": 2.5, "--seed": 1, "--maxT": 10, "--out": "a"}
+    key = cache.key(str(config), args)
+    assert cache.key(str(config), dict(reversed(list(args.items())), **{"--out": "b"})) == key
+    assert cache.key(str(config), dict(args, **{"--seed": 2})) != key
+    (config / "config.json").write_text('{"K": "8"}')
+    assert cache.key(str(config), args) != key
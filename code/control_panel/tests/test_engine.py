@@ -0,0 +1,45 @@
+import os
+import subprocess
+
+import numpy as np
+import pytest
+
+from engine import load_network, simulate, save_state, load_state
+from trajectory import read_trajectory
+
+code_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+config = os.path.join(code_dir, "input", "santiago")
+binary = os.path.join(code_dir, "bin", "main")
+
+
+def test_python_engine_is_seeded():
+    network = load_network(config)
+    a = simulate(network, R0=2.5, maxT=12, second_wave=4, seed=3)
+    b = simulate(network, R0=2.5, maxT=12, second_wave=4, seed=3)
+    c = simulate(network, R0=2.5, maxT=12, second_wave=4, seed=4)
+    assert np.array_equal(a, b) and not np.array_equal(a, c)
+
+
+def test_python_engine_continues_from_saved_state(tmp_path):
+    network = load_network(config)
+    full = simulate(network, R0=2.5, maxT=12, second_wave=4, seed=3)
+    first, state = simulate(network, R0=2.5, maxT=6, second_wave=4, seed=3, return_state=True)
+    save_state(tmp_path / "state", state)
+    rest = simulate(network, R0=2.5, maxT=12, second_wave=4, seed=3, state=load_state(tmp_path / "state"))
+    assert np.array_equal(np.concatenate([first, rest]), full)
+
+
+def run_binary(out, maxT, seed=3, *extra):
+    subprocess.run([binary, "--config", config, "--out", str(out), "--maxT", str(maxT), "--R0", "2.5",
+                    "--second_wave", "4", "--seed", str(seed), "--format", "npy", *map(str, extra)],
+                   check=True, stdout=subprocess.DEVNULL)
+    return read_trajectory(str(out), mmap=False)[0]
+
+
+@pytest.mark.skipif(not os.path.exists(binary), reason="../bin/main is not built (see bin/build.sh)")
+def test_binary_is_seeded_and_continues_bit_identical(tmp_path):
+    full = run_binary(tmp_path / "full.npy", 12)
+    assert np.array_equal(run_binary(tmp_path / "again.npy", 12), full)
+    first = run_binary(tmp_path / "first.npy", 6, 3, "--save_state", tmp_path / "state")
+    rest = run_binary(tmp_path / "rest.npy", 12, 3, "--load_state", tmp_path / "state")
+    assert np.array_equal(np.concatenate([first, rest]), full)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from losses import get_ground_truth, get_shift_losses, get_optimal_shift
+
+
+def baseline_loss(county_data, c_charts, shift, start, days, global_rate):
+    # Loop of the original runner.get_optimal_shift (losses.get_county_loss, get_global_loss)
+    shifted = county_data.iloc[start-shift:start+days-shift]
+    sim_aggregated = np.sum([chart for _, chart in c_charts], axis=0)
+    equal_ratio = np.sum(shifted["Összesen"])/np.sum(sim_aggregated)
+    county = np.mean([np.mean(np.abs(shifted["Budapest" if c == "főváros" else c].to_numpy()-equal_ratio*chart))
+                      for c, chart in c_charts if ("Budapest" if c == "főváros" else c) in shifted.columns])
+    total = np.mean(np.abs(shifted["Összesen"].to_numpy()-equal_ratio*sim_aggregated))
+    return (1-global_rate)*county + global_rate*total, equal_ratio
+
+def data(runs=3, days=20, seed=0):
+    rng = np.random.default_rng(seed)
+    counties = ["főváros", "Pest", "Somogy", "Atlantis"]
+    county_data = pd.DataFrame(rng.integers(0, 100, (120, 3)).astype(float), columns=["Budapest", "Pest", "Somogy"])
+    county_data["Összesen"] = county_data.sum(axis=1) + 7
+    return county_data, counties, rng.random((runs, days, len(counties))) * 50
+
+
+def test_shift_losses_match_baseline_loop():
+    county_data, counties, sims = data()
+    shifts, start = np.arange(30), 60
+    g_counties, g_total, found = get_ground_truth(county_data, counties)
+    losses, ratios = get_shift_losses(g_counties, g_total, found, sims, shifts, start, 0.3)
+    for run, sim in enumerate(sims):
+        c_charts = list(zip(counties, sim.T))
+        for shift in shifts:
+            loss, ratio = baseline_loss(county_data, c_charts, shift, start, sim.shape[0], 0.3)
+            assert np.isclose(losses[run, shift], loss) and np.isclose(ratios[run, shift], ratio)
+
+
+def test_batches_and_chunks_give_the_same_losses():
+    county_data, counties, sims = data(runs=5)
+    truth = get_ground_truth(county_data, counties)
+    shifts = np.arange(30)
+    batch = get_shift_losses(*truth, sims, shifts, 60, 0.5)
+    chunked = get_shift_losses(*truth, sims, shifts, 60, 0.5, max_elements=100)
+    assert np.array_equal(batch[0], chunked[0])
+    loss, ratio, shift = get_optimal_shift(*truth, sims, shifts, 60, 0.5)
+    for run, sim in enumerate(sims):
+        single = get_optimal_shift(*truth, sim, shifts, 60, 0.5)
+        assert np.isclose(single[0], loss[run]) and single[2] == shift[run]
+        assert np.isclose(loss[run], batch[0][run].min())
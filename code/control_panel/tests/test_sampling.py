@@ -0,0 +1,46 @@
+from cache import RunCache
+from sampling import get_design, get_runs, get_seed
+
+def grid_args(num=3):
+    return {
+        "first_wave": {"R0": {"val": 2.2, "std": 0.1, "num": num}},
+        "second_wave": {"R1": {"val": 1.5, "std": 0.0, "num": 2}, "time": {"val": 10, "std": 0, "num": 1}},
+        "simulation": {"distribution": "grid", "sim_num": 1, "parameters": {"tau": {"val": 3, "std": 1}}},
+    }
+
+def run_keys(points, tmp_path, replicates=1, crn=False):
+    # Cache keys of the runs of a design, built like runner.py
+    config = tmp_path / "config"
+    config.mkdir(exist_ok=True)
+    (config / "network.json").write_text("{}")
+    cache = RunCache(str(tmp_path / "cache"), engine="python")
+    keys = []
+    for _, (R0, R1, shift, tau), _, seed in get_runs(points, replicates, 0, crn):
+        keys.append(cache.key(str(config), {"--R0": R0, "--R1": R1, "--second_wave": shift, "--tau": tau,
+                                            "--maxT": 100, "--c": 0.0, "--seed": seed}))
+    return keys
+
+def test_equal_points_share_seed():
+    assert get_seed(0, [2.2, 1.5, 10], 0) == get_seed(0, [2.2, 1.5, 10.0], 0)
+    assert get_seed(0, [2.2, 1.5, 10], 0) != get_seed(0, [2.2, 1.5, 10], 1)
+    assert get_seed(0, [2.2, 1.5, 10], 0) != get_seed(0, [2.3, 1.5, 10], 0)
+    assert get_seed(0, [2.2, 1.5, 10], 0) != get_seed(1, [2.2, 1.5, 10], 0)
+
+def test_crn_shares_seed_between_points():
+    assert get_seed(0, [2.2, 1.5, 10], 1, crn=True) == get_seed(0, [2.3, 1.4, 12], 1, crn=True)
+
+def test_one_point_axis_is_centered():
+    points = get_design(grid_args())["points"]
+    assert {p[2] for p in points} == {10} and {p[3] for p in points} == {3.0}
+
+def test_equal_points_share_cache_key(tmp_path):
+    # R1 has std 0: its 2 grid values are equal, every point appears twice
+    points = get_design(grid_args())["points"]
+    keys = run_keys(points, tmp_path)
+    assert len(points) == 6 and len(set(keys)) == 3
+
+def test_cache_keys_do_not_depend_on_order(tmp_path):
+    points = get_design(grid_args())["points"]
+    keys = run_keys(points, tmp_path, replicates=2)
+    extended = run_keys(points[::-1] + [[2.5, 1.5, 10, 3.0]], tmp_path, replicates=2)
+    assert set(keys) <= set(extended)
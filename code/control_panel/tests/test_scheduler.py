@@ -0,0 +1,28 @@
+import sys
+import json
+
+from scheduler import Job, run_jobs
+
+
+def test_callback_errors_are_recorded(tmp_path):
+    jobs = [Job([sys.executable, "-c", f"print({i})"], name=str(i)) for i in range(4)]
+    done = []
+    def on_done(job):
+        if job.name == "1":
+            raise ValueError("cannot store")
+        done.append(job.name)
+
+    status_file = tmp_path / "jobs.jsonl"
+    run_jobs(jobs, max_jobs=2, on_done=on_done, status_file=status_file, run_id="a")
+    run_jobs(jobs[:1], on_done=None, status_file=status_file, run_id="b")
+
+    assert sorted(done) == ["0", "2", "3"]
+    assert all(job.status == "ok" for job in jobs)
+    assert "cannot store" in jobs[1].error and jobs[0].error is None
+    records = [json.loads(line) for line in open(status_file)]
+    assert [r["run"] for r in records].count("a") == 4 and records[-1]["run"] == "b"
+
+
+def test_missing_engine_fails_the_job():
+    job, = run_jobs([Job(["/nonexistent/main"])], retries=2)
+    assert job.status == "failed" and job.attempts == 1
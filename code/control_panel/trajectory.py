@@ -0,0 +1,111 @@
+import os
+import json
+import numpy as np
+
+# Compartments of a trajectory, in the order of main.cpp
+compartments = ["I", "I2", "R"]
+
+# Days per compressed chunk (see pack_trajectory)
+chunk_days = 30
+
+NPY_MAGIC = b"\x93NUMPY"
+ZIP_MAGIC = b"PK\x03\x04"
+
+def meta_file(path):
+    # Metadata sidecar of a .npy trajectory
+    return path + ".json"
+
+def is_meta_file(path):
+    return path.endswith(".json")
+
+def get_meta(traj, **params):
+    T, Npop, K, C = traj.shape
+    return {"Npop": Npop, "K": K, "T": T, "compartments": compartments[:C], "dtype": str(traj.dtype), "params": params}
+
+def write_trajectory(path, traj, **params):
+    """
+    Description:
+        Writes a (T, Npop, K, compartment) trajectory of integer counts
+            * path.npz : compressed, chunked by day (see pack_trajectory)
+            * otherwise: raw .npy (the format of main.cpp --format npy), metadata in path.json
+    Parameters:
+        * path   : output file
+        * traj   : trajectory (see engine.simulate)
+        * params : simulation parameters, stored in the metadata
+    """
+    traj = np.asarray(traj, dtype=np.int32)
+    meta = get_meta(traj, **params)
+    if path.endswith(".npz"):
+        write_chunks(path, traj, meta)
+        return
+
+    with open(path, "wb") as f:
+        np.save(f, traj)
+    with open(meta_file(path), "w") as f:
+        f.write(json.dumps(meta))
+
+def write_chunks(path, traj, meta, days=chunk_days):
+    chunks = {f"days_{t:06d}": traj[t:t+days] for t in range(0, len(traj), days)}
+    meta = dict(meta, chunk_days=days)
+    with open(path, "wb") as f:
+        np.savez_compressed(f, meta=np.array(json.dumps(meta)), **chunks)
+
+def pack_trajectory(path, out=None, days=chunk_days):
+    """
+    Description:
+        Compresses a trajectory (.npy or csv) into a day-chunked .npz, for storing sweeps
+    Returns:
+        * the name of the packed file
+    """
+    out = out if out is not None else os.path.splitext(path)[0] + ".npz"
+    traj, meta = read_trajectory(path)
+    write_chunks(out, np.asarray(traj), meta, days)
+    return out
+
+def read_trajectory(path, mmap=True, days=None):
+    """
+    Description:
+        Reads a trajectory as a (T, Npop, K, compartment) array, whichever format it was written in:
+            * .npy (main.cpp --format npy, write_trajectory): memory-mapped, nothing is parsed
+            * chunked .npz (pack_trajectory)                 : only the chunks of the requested days are decompressed
+            * csv (main.cpp default output)                  : parsed once, the columns are reshaped
+    Parameters:
+        * path : trajectory file
+        * mmap : memory-map .npy files
+        * days : optional slice of days
+    Returns:
+        * (trajectory, metadata)
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(NPY_MAGIC))
+
+    if magic.startswith(NPY_MAGIC):
+        traj = np.load(path, mmap_mode="r" if mmap else None)
+        meta = get_meta(traj)
+        if os.path.exists(meta_file(path)):
+            with open(meta_file(path)) as f:
+                meta.update(json.load(f))
+    elif magic.startswith(ZIP_MAGIC):
+        return read_chunks(path, days)
+    else:
+        traj = read_csv(path)
+        meta = get_meta(traj)
+    return (traj if days is None else traj[days]), meta
+
+def read_chunks(path, days=None):
+    with np.load(path) as data:
+        meta = json.loads(str(data["meta"]))
+        T, size = meta["T"], meta["chunk_days"]
+        start, stop, step = (days if days is not None else slice(None)).indices(T)
+        first = start - start % size
+        chunks = [data[f"days_{t:06d}"] for t in range(first, max(stop, first), size)]
+    traj = np.concatenate(chunks) if chunks else np.zeros((0, meta["Npop"], meta["K"], len(meta["compartments"])), dtype=np.int32)
+    return traj[start-first:stop-first:step], meta
+
+def read_csv(path):
+    # Columns are I_i_k,I2_i_k,R_i_k for each city i and age k (and an empty last one)
+    import pandas as pd
+    df = pd.read_csv(path, sep=',')
+    df = df.loc[:, [c for c in df.columns if not c.startswith("Unnamed")]]
+    city, K = df.columns[-1].split("_")[1:]
+    return df.to_numpy(dtype=np.int64).reshape(len(df), int(city)+1, int(K)+1, len(compartments))
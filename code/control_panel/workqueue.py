@@ -0,0 +1,188 @@
+import time
+import traceback
+import queue
+import threading
+from collections import deque
+from multiprocessing.connection import Listener, Client
+
+# Messages (pickled tuples, see multiprocessing.connection):
+#   worker      -> coordinator : ("get",), ("result", id, result), ("failed", id), ("heartbeat",)
+#   coordinator -> worker      : ("hello", data, heartbeat), ("task", id, task), ("wait", seconds), ("done",)
+
+def parse_address(address):
+    # "host:port" -> (host, port)
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+class Coordinator:
+    """
+    Description:
+        TCP work queue of a sweep: worker agents (see run_worker) connect from any machine,
+        pull tasks one by one and push back their results. The tasks of a worker that
+        disconnects, or is silent for 3 heartbeats, are queued again.
+        Iterating over the coordinator yields the results as they arrive, until every task is done.
+    Parameters:
+        * tasks     : list of picklable tasks
+        * address   : (host, port) to listen on
+        * authkey   : shared secret of the workers (non-empty bytes), the messages are pickled: trusted networks only
+        * hello     : data sent to each worker when it connects (e.g. the args of the sweep)
+        * heartbeat : seconds between the heartbeats of the workers
+        * retries   : a failed task is queued again this many times, then reported and dropped
+    """
+    def __init__(self, tasks, address, authkey, hello=None, heartbeat=10, retries=3):
+        if not authkey:
+            raise ValueError("an empty authkey disables the authentication of the workers")
+        self.tasks = list(tasks)
+        self.pending = deque(range(len(self.tasks)))
+        self.running = {}  # task id -> worker
+        self.failures = {}  # task id -> failed attempts
+        self.retries = retries
+        self.done = set()
+        self.results = queue.Queue()
+        self.hello = hello
+        self.heartbeat = heartbeat
+        self.lock = threading.Lock()
+        self.listener = Listener(address, authkey=authkey)
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        worker = 0
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return  # closed
+            except Exception:
+                continue  # failed handshake (wrong authkey)
+            worker += 1
+            threading.Thread(target=self.serve, args=(conn, worker), daemon=True).start()
+
+    def finished(self):
+        return len(self.done) == len(self.tasks)
+
+    def complete(self, task, result):
+        with self.lock:
+            if task in self.done:
+                return  # result of a task queued again
+            self.done.add(task)
+            self.running.pop(task, None)
+            if task in self.pending:
+                self.pending.remove(task)
+        self.results.put(result)
+
+    def fail(self, task, worker):
+        # Failed task: queued again (for another worker if possible), dropped after the retries
+        with self.lock:
+            if task in self.done:
+                return
+            self.running.pop(task, None)
+            self.failures[task] = self.failures.get(task, 0) + 1
+            if self.failures[task] <= self.retries:
+                self.pending.append(task)
+                return
+        print(f"[coordinator] task {task} failed {self.failures[task]} times (last on worker {worker}), dropped: {self.tasks[task]}", flush=True)
+        self.complete(task, None)
+
+    def next_task(self, worker):
+        with self.lock:
+            if self.pending:
+                task = self.pending.popleft()
+                self.running[task] = worker
+                return ("task", task, self.tasks[task])
+            if self.finished():
+                return ("done",)
+            return ("wait", self.heartbeat)
+
+    def serve(self, conn, worker):
+        try:
+            conn.send(("hello", self.hello, self.heartbeat))
+            while True:
+                if not conn.poll(3*self.heartbeat):
+                    break  # lost worker
+                message = conn.recv()
+                if message[0] == "get":
+                    reply = self.next_task(worker)
+                    conn.send(reply)
+                    if reply[0] == "done":
+                        break
+                elif message[0] == "result":
+                    self.complete(message[1], message[2])
+                elif message[0] == "failed":
+                    self.fail(message[1], worker)
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            with self.lock:
+                lost = [task for task, w in self.running.items() if w == worker]
+                for task in lost:
+                    del self.running[task]
+                    self.pending.appendleft(task)
+            if lost:
+                print(f"[coordinator] worker {worker} lost, {len(lost)} tasks queued again", flush=True)
+
+    def failed(self):
+        # Tasks dropped after their retries
+        return [task for task, n in self.failures.items() if n > self.retries]
+
+    def __iter__(self):
+        while True:
+            with self.lock:
+                if self.finished() and self.results.empty():
+                    break
+            result = self.results.get()
+            if result is not None:
+                yield result
+        self.listener.close()
+
+def run_worker(address, authkey, setup, handle):
+    """
+    Description:
+        Worker agent: pulls the tasks of a Coordinator, until there is none left
+    Parameters:
+        * address : (host, port) of the coordinator
+        * authkey : shared secret of the coordinator (non-empty bytes)
+        * setup   : called once with the hello data of the coordinator
+        * handle  : task -> result (None: the task failed)
+    """
+    if not authkey:
+        raise ValueError("an empty authkey disables the authentication of the coordinator")
+    conn = Client(address, authkey=authkey)
+    lock = threading.Lock()
+    _, hello, heartbeat = conn.recv()
+    setup(hello)
+
+    # Heartbeats while a task runs
+    stop = threading.Event()
+    def beat():
+        while not stop.wait(heartbeat):
+            try:
+                with lock:
+                    conn.send(("heartbeat",))
+            except OSError:
+                return
+    threading.Thread(target=beat, daemon=True).start()
+
+    try:
+        while True:
+            with lock:
+                conn.send(("get",))
+            message = conn.recv()
+            if message[0] == "done":
+                break
+            if message[0] == "wait":
+                time.sleep(message[1])
+                continue
+            _, task, data = message
+            try:
+                result = handle(data)
+            except Exception:
+                traceback.print_exc()
+                result = None
+            with lock:
+                conn.send(("result", task, result) if result is not None else ("failed", task))
+    except (EOFError, OSError):
+        pass  # the coordinator is gone
+    finally:
+        stop.set()
+        conn.close()
@@ -1,6 +1,10 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "control_panel"))
+from trajectory import read_trajectory
 
 K=8
 death_ratio = np.array([0.00000000e+00, 3.36964689e-06, 2.19595034e-05, 4.49107573e-05,
@@ -9,21 +13,15 @@ all_death = pd.read_csv("hun_codes/data/orszagos_halott.csv", sep=',')[:755]
 death_orig = np.array(all_death[181:181+180]["Hétnapos mozgóátlag"])
 
 def get_inf_curve(filename, death = None, K= 8):
-    df = pd.read_csv(filename, sep=',')
-    inf_cols = [c for c in df.columns if c[0:2]=='I_']
-    Is = df.filter(inf_cols, axis=1)
+    traj, _ = read_trajectory(filename)
+    Is = traj[:,:,:,0]
     
-    I = np.zeros((len(Is), K, len(Is.columns)//K))
-    for c in Is.columns:
-        _,city,age = c.split("_")
-        I[:,int(age), int(city)] = Is.loc[:, c]
-    
-    I = np.sum(I, axis=2)
+    I = np.sum(Is, axis=1)
     print(I)
     if type(death) != None:
-        return np.sum(I*death, axis=1), Is.sum(axis=1)
+        return np.sum(I*death, axis=1), Is.sum(axis=(1,2))
     else:
-        return Is.sum(axis=1)
+        return Is.sum(axis=(1,2))
 
 def fit(x,y):
     min_ind = 0
@@ -1,22 +1,22 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "control_panel"))
+from trajectory import read_trajectory
 
 def get_inf_curve(filename, death = None, K= 8):
-    df = pd.read_csv(filename, sep=',')
-    inf_cols = [c for c in df.columns if c[0]=='I']
-    Is = df.filter(inf_cols, axis=1)
+    traj, meta = read_trajectory(filename, days=slice(0, 150))
+    # Both waves (I and I2) are infected: the death curve sums them, like the total curve
+    inf_cols = [i for i,c in enumerate(meta["compartments"]) if c[0]=='I']
+    Is = traj[:,:,:,inf_cols].sum(axis=3)
     
-    I = np.zeros((150, K, len(Is.columns)//K))
-    for c in Is.columns:
-        _,city,age = c.split("_")
-        I[:,int(age), int(city)] = Is.loc[:, c]
-    
-    I = np.sum(I, axis=2)
+    I = np.sum(Is, axis=1)
     if type(death) != None:
-        return np.sum(I*death, axis=1), Is.sum(axis=1)
+        return np.sum(I*death, axis=1), Is.sum(axis=(1,2))
     else:
-        return Is.sum(axis=1)
+        return Is.sum(axis=(1,2))
 
 def fit(x,y):
     min_ind = 0
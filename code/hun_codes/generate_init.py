@@ -5,16 +5,10 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import itertools
 from scipy import linalg
+import scipy.sparse as sp
+from scipy.sparse.linalg import eigs
 
 # === DATA ===
-sett_types = pd.read_csv("../../data/hun/HU_places_admin_pop_ZIP_latlon.csv",
-           sep=',',
-           header=0)
-KSH = pd.read_csv("../../data/hun/KSHCommuting_c1ID_c1name_c2ID_c2name_comm_school_work_DIR.csv",
-           sep=',', header=0)
-#KSH = pd.read_csv("../../data/hun/KSHCommuting_c1ID_c1name_c2ID_c2name_comm_school_work_UNDIR.csv",
-#           sep=',', header=0)
-
 korfa_teltip1 = {
     "főváros": [210640, 81626, 246127, 313540, 213367, 225379, 216828, 221533, 1729040],
     "fővárosi kerület": [210640, 81626, 246127, 313540, 213367, 225379, 216828, 221533, 1729040],
@@ -134,32 +128,46 @@ def get_eigen_mtx(mtx, district_ind, pop, out):
         * district_ind : district dictionary, containing the cities in the district
         * pop          : population of each city
     """
-    A = np.array([mtx[:,j]*pop[j] for j in range(len(mtx))])
-    #phi = np.linalg.eigvals(A)
-    eigvals, eigenVectors = np.linalg.eig(A)
+    # A[j,i] = mtx[i,j]*pop[j], only the two leading eigenpairs are needed
+    A = sp.csr_matrix(mtx.multiply(pop[None,:]).T)
+    eigvals, eigenVectors = eigs(A, k=2, which="LM")
+    order = np.argsort(-np.abs(eigvals))
+    eigvals, eigenVectors = eigvals[order], eigenVectors[:,order]
     phi = np.real(eigenVectors[:,0])
     phi = phi/np.sum(phi)
     print("Largest eigenvalue:", eigvals[0], "gap %", 100*eigvals[1]/eigvals[0])
-    print(sorted(eigvals, reverse=True))
     #print(list(phi))
     with open(f"../input/{out}/{th}.npy", "wb")as file:
         np.save(file, np.array(phi))
     
     
-    mtx_d = np.zeros((len(district_ind), len(district_ind)))
-    for l,k in itertools.product(district_ind.keys(), district_ind.keys()):
-        up = 0
-        for i,j in itertools.product(district_ind[l], district_ind[k]):
-            up +=  mtx[i,j]*phi[j]
-            #up +=  mtx[i,j]*phi[j]*pop[i]*pop[j]
-        
-        down = sum([phi[j]*pop[j] for j in district_ind[j]])
-        mk = sum([pop[i] for i in district_ind[k]])
-        ml = sum([pop[i] for i in district_ind[l]])
-        
-        if(down < 1e-12): mtx_d[l,k] = 0.0
-        else: mtx_d[l,k] = ml*up/down
+    return aggregate_eigen_mtx(mtx, district_ind, pop, phi)
+
+def aggregate_eigen_mtx(mtx, district_ind, pop, phi):
+    """
+    Description:
+        Aggregates the city commuting mtx into districts, weighted by the leading eigenvector:
+            mtx_d[l,k] = pop(l) * sum_{i in l, j in k} mtx[i,j]*phi[j] / sum_{j in k} phi[j]*pop[j]
+        The denominator is a sum over the cities of district k (the loop of the original version
+        summed over district_ind[j], j being the last city of k, see get_eigen_mtx2)
+    Parameters:
+        * mtx          : commutation mtx between cities (scipy.sparse)
+        * district_ind : district dictionary, containing the cities in the district
+        * pop          : population of each city
+        * phi          : leading eigenvector (normalized to sum 1)
+    """
+    # Membership mtx: M[l,i] = times city i is listed in district l
+    members = [(l,i) for l in district_ind for i in district_ind[l]]
+    M = sp.csr_matrix((np.ones(len(members)), ([l for l,_ in members], [i for _,i in members])),
+                      shape=(len(district_ind), mtx.shape[0]))
+    # up[l,k] = sum of mtx[i,j]*phi[j] over the cities i of l and j of k, only the links are visited
+    up = (M @ sp.csr_matrix(mtx.multiply(phi[None,:])) @ M.T).toarray()
+    down = M @ (phi*pop)
+    ml = M @ pop
     
+    mtx_d = np.zeros((len(district_ind), len(district_ind)))
+    nonzero = down >= 1e-12
+    mtx_d[:,nonzero] = ml[:,None]*up[:,nonzero]/down[None,nonzero]
     return mtx_d
 
 def get_eigen_mtx2(mtx, district_ind, pop, out):
@@ -198,6 +206,31 @@ def get_eigen_mtx2(mtx, district_ind, pop, out):
     return mtx_d
 
 # === Commuting ===
+def write_commuting(mtx, folder):
+    """
+    Description:
+        Writes the commuting network in compressed sparse row form (commuting_KSH.npz),
+        and its nonzero edges as json (commuting_KSH.json, read by the Parser of the C++ code).
+        The json is streamed edge by edge, missing edges have zero weight.
+    Parameters:
+        * mtx    : commutation mtx (dense or scipy.sparse), the diagonal is dropped
+        * folder : destination network folder
+    """
+    mtx = sp.csr_matrix(mtx)
+    mtx.setdiag(0)
+    mtx.eliminate_zeros()
+    mtx.sort_indices()
+    sp.save_npz(f"{folder}/commuting_KSH.npz", mtx)
+
+    with open(f"{folder}/commuting_KSH.json", "w") as f:
+        f.write('{"N": %d, "network": [' % mtx.shape[0])
+        sep = ""
+        for i in range(mtx.shape[0]):
+            for j,w in zip(mtx.indices[mtx.indptr[i]:mtx.indptr[i+1]], mtx.data[mtx.indptr[i]:mtx.indptr[i+1]]):
+                f.write(sep + json.dumps({"from":i, "to":int(j), "weight":float(w)}))
+                sep = ", "
+        f.write("]}")
+
 def create_commuting(cities, place_id_dict, big_cities, district_pops, district_id_dict, out):
     N = len(cities)
     M = len(district_id_dict)
@@ -206,40 +239,31 @@ def create_commuting(cities, place_id_dict, big_cities, district_pops, district_
 
     get_district = big_cities.set_index('place').to_dict()["admin municip"]
 
-    mtx = np.zeros((N,N))
+    # Only the existing links are collected (duplicates are summed by the csr conversion)
+    rows, cols, weights = [], [], []
     mtx_dist = np.zeros((M,M))
     for _,row in KSH.iterrows():
         weight = row["CommutersAll"]
         orig,dest = row["origName"], row["destName"]
         if((orig in cities) and (dest in cities)):
-            mtx[place_id_dict[orig], place_id_dict[dest]] += weight/pop_dict[orig]
-            mtx[place_id_dict[dest], place_id_dict[orig]] += weight/pop_dict[dest]
+            rows += [place_id_dict[orig], place_id_dict[dest]]
+            cols += [place_id_dict[dest], place_id_dict[orig]]
+            weights += [weight/pop_dict[orig], weight/pop_dict[dest]]
             a = district_id_dict[get_district[orig]]
             b = district_id_dict[get_district[dest]]
             mtx_dist[a,b] += weight
             mtx_dist[b,a] += weight
     
+    mtx = sp.csr_matrix((weights, (rows, cols)), shape=(N,N))
     for d,ind in district_id_dict.items():
         mtx_dist[ind]/= district_pops[d]["N"]
     
-    # === CITY COMMUTATION ===
-    network = [{"from":i, "to":j, "weight":mtx[i,j]} for i,j in itertools.product(range(N), range(N)) if i!= j]
-    commuting = {
-        "N":N,
-        "network":network
-    }
-
     # === DISTRICT COMMUTATION ===
     print("Districts: ",M)
-    network_dist = [{"from":i, "to":j, "weight":mtx_dist[i,j]} for i,j in itertools.product(range(M), range(M)) if i!= j]
-    commuting_dist = {
-        "N":M,
-        "network":network_dist
-    }
 
     # === EIGEN DISTRICT COMMUTATION ===
     district_ind = {i:[] for i in range(len(mtx_dist))}
-    pop = np.zeros(len(mtx))
+    pop = np.zeros(N)
     for city in cities:
         pop[place_id_dict[city]] = pop_dict[city]
         
@@ -254,20 +278,12 @@ def create_commuting(cities, place_id_dict, big_cities, district_pops, district_
         np.save(file, np.array(city_names))
     
     mtx_eigen = get_eigen_mtx(mtx, district_ind, pop, out)
-    network_eigen = [{"from":i, "to":j, "weight":mtx_eigen[i,j]} for i,j in itertools.product(range(M), range(M)) if i!= j]
-    network_eigen_symm = [{"from":i, "to":j, "weight":(mtx_eigen[i,j]+mtx_eigen[j,i])/2} for i,j in itertools.product(range(M), range(M)) if i!= j]
 
-    with open(f"../input/{out}/commuting_KSH.json", "w") as f:
-        f.write(json.dumps(commuting))
-    
-    with open(f"../input/{out}/district/commuting_KSH.json", "w") as f:
-        f.write(json.dumps(commuting_dist))
-    
-    with open(f"../input/{out}/district_eigen/commuting_KSH.json", "w") as f:
-        f.write(json.dumps({"N":M, "network":network_eigen}))
-
-    #with open(f"../input/{out}/district_eigen_symm/commuting_KSH.json", "w") as f:
-    #    f.write(json.dumps({"N":M, "network":network_eigen_symm}))
+    # === CITY COMMUTATION ===
+    write_commuting(mtx, f"../input/{out}")
+    write_commuting(mtx_dist, f"../input/{out}/district")
+    write_commuting(mtx_eigen, f"../input/{out}/district_eigen")
+    #write_commuting((mtx_eigen+mtx_eigen.T)/2, f"../input/{out}/district_eigen_symm")
 
 # === Create contats_home and contacts other ===
 import itertools
@@ -319,6 +335,7 @@ def create_new_contact_mtx(out):
 def create_config(N, K, out):
     d = {
         "commuting_file": "commuting_KSH.json",
+        "commuting_file_sparse": "commuting_KSH.npz",
         "populations_file": "populations_KSH.json",
         "contacts_file_home": "contacts_home.json",
         "contacts_file_other": "contacts_other.json",
@@ -334,27 +351,36 @@ def create_config(N, K, out):
     with open(f"../input/{out}/district_eigen/config.json", "w") as f:
         f.write(json.dumps(d, indent=4))
 # === MAIN ===
-th = 10000
-dest_folder = f"hun_{th}"
-if(not os.path.exists(f"../input/{dest_folder}/district")):
-    os.makedirs(f"../input/{dest_folder}/district")
-if(not os.path.exists(f"../input/{dest_folder}/district_eigen")):
-    os.makedirs(f"../input/{dest_folder}/district_eigen")
-
-np.random.seed(1)
-# Creates nodes with SEIR states, with given infection distribution
-population, place_id_dict, big_cities, district_pops, district_id_dict = create_population_dict(
-    sett_types, population_th=th,
-    num_I = 10000,
-    num_L=int(10000*(4/2.5)),
-    Ks = [4,5],
-    budapest = False,
-    out=dest_folder)
-
-cities = set(place_id_dict.keys())
-print(f"Number of cities: {len(cities)}")
-print(f'Number of age groups {len(population["populations"][1]["age"])}')
-
-create_commuting(cities, place_id_dict, big_cities, district_pops, district_id_dict, out=dest_folder)
-create_new_contact_mtx(out=dest_folder)
-create_config(N=(len(cities), len(district_id_dict)), K=8, out=dest_folder)
+if __name__ == "__main__":
+    sett_types = pd.read_csv("../../data/hun/HU_places_admin_pop_ZIP_latlon.csv",
+               sep=',',
+               header=0)
+    KSH = pd.read_csv("../../data/hun/KSHCommuting_c1ID_c1name_c2ID_c2name_comm_school_work_DIR.csv",
+               sep=',', header=0)
+    #KSH = pd.read_csv("../../data/hun/KSHCommuting_c1ID_c1name_c2ID_c2name_comm_school_work_UNDIR.csv",
+    #           sep=',', header=0)
+
+    th = 10000
+    dest_folder = f"hun_{th}"
+    if(not os.path.exists(f"../input/{dest_folder}/district")):
+        os.makedirs(f"../input/{dest_folder}/district")
+    if(not os.path.exists(f"../input/{dest_folder}/district_eigen")):
+        os.makedirs(f"../input/{dest_folder}/district_eigen")
+
+    np.random.seed(1)
+    # Creates nodes with SEIR states, with given infection distribution
+    population, place_id_dict, big_cities, district_pops, district_id_dict = create_population_dict(
+        sett_types, population_th=th,
+        num_I = 10000,
+        num_L=int(10000*(4/2.5)),
+        Ks = [4,5],
+        budapest = False,
+        out=dest_folder)
+
+    cities = set(place_id_dict.keys())
+    print(f"Number of cities: {len(cities)}")
+    print(f'Number of age groups {len(population["populations"][1]["age"])}')
+
+    create_commuting(cities, place_id_dict, big_cities, district_pops, district_id_dict, out=dest_folder)
+    create_new_contact_mtx(out=dest_folder)
+    create_config(N=(len(cities), len(district_id_dict)), K=8, out=dest_folder)
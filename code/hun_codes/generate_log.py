@@ -1,40 +1,33 @@
 import numpy as np
 import pandas as pd
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "control_panel"))
+from trajectory import read_trajectory
 
 death_ratio = np.array([0.00000000e+00, 3.36964689e-06, 2.19595034e-05, 4.49107573e-05,
                1.88422215e-04, 4.99762978e-04, 1.89895681e-03, 7.40632275e-03])
 
 def get_inf_curve(filename, death = None, K= 8):
-    df = pd.read_csv(filename, sep=',')
-    inf_cols = [c for c in df.columns if c[0:2]=='I_']
-    inf_cols2 = [c for c in df.columns if c[0:2]=='I2']
-    Is = df.filter(inf_cols, axis=1)
-    Is2 = df.filter(inf_cols2, axis=1)
+    traj, _ = read_trajectory(filename)
+    Is = traj[:,:,:,0]
+    Is2 = traj[:,:,:,1]
     
-    I = np.zeros((len(Is), K, len(Is.columns)//K))
-    for c in Is.columns:
-        _,city,age = c.split("_")
-        I[:,int(age), int(city)] = Is.loc[:, c]
-    I2 = np.zeros((len(Is2), K, len(Is2.columns)//K))
-    for c in Is2.columns:
-        _,city,age = c.split("_")
-        I2[:,int(age), int(city)] = Is2.loc[:, c]
-    
-    I = np.sum(I, axis=2)
-    I2 = np.sum(I2, axis=2)
+    I = np.sum(Is, axis=1)
+    I2 = np.sum(Is2, axis=1)
     if type(death) != None:
-        return np.sum(I*death, axis=1)+np.sum(I2*death, axis=1), Is.sum(axis=1), Is2.sum(axis=1)
+        return np.sum(I*death, axis=1)+np.sum(I2*death, axis=1), Is.sum(axis=(1,2)), Is2.sum(axis=(1,2))
     else:
-        return Is.sum(axis=1), Is2.sum(axis=1)
+        return Is.sum(axis=(1,2)), Is2.sum(axis=(1,2))
 
 th = 10000
 i = 6
 city = f"KSH2_{th}/base"
 district = f"KSH2_{th}/district"
 district_eigen = f"KSH2_{th}/district_eigen"
-death, Is, Is2 = get_inf_curve(f"../output/{city}/{i}.txt", death = death_ratio*10)
-death_d, Is_d, Is2_d = get_inf_curve(f"../output/{district}/{i}.txt", death = death_ratio*10)
-death_d2, Is_d2, Is2_d2 = get_inf_curve(f"../output/{district_eigen}/{i}.txt", death = death_ratio*10)
+death, Is, Is2 = get_inf_curve(f"../output/{city}/{i}.npy", death = death_ratio*10)
+death_d, Is_d, Is2_d = get_inf_curve(f"../output/{district}/{i}.npy", death = death_ratio*10)
+death_d2, Is_d2, Is2_d2 = get_inf_curve(f"../output/{district_eigen}/{i}.npy", death = death_ratio*10)
 
 print(len(death))
 
@@ -1,55 +1,42 @@
 import os
+import sys
 import copy
 import numpy as np
 import pandas as pd
-import multiprocessing
 import matplotlib.pyplot as plt
-from subprocess import Popen, STDOUT, PIPE
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "control_panel"))
+from scheduler import Job, run_jobs
 
-def run(args, job_count, lock):
-    # Run
+def get_command(args):
     str_args = [str(item) for pair in args.items() for item in pair]
     #print(" ".join([ "../bin/main"]+str_args))
-    p = Popen([ "../bin/main"] + str_args,
-          stdout=PIPE, stdin=PIPE, stderr=STDOUT, bufsize=1, universal_newlines=True)
-
-    out,err = p.communicate()
-    #print(out)
-    
-    # Alert master, if ready
-    with lock:
-        job_count[0]+=1
-        print('\r {}/{}'.format(job_count[0], job_count[1]), end='', flush=True)
-
-    return 0
+    return [ "../bin/main"] + str_args
 
 def measure(meas_name, arg_name, arg_space):
-    # Init pool
-    pool = multiprocessing.Pool(processes=min(global_args["procnum"], len(arg_space)))
-    manager = multiprocessing.Manager()
-    lock = manager.Lock()
-    job_count = manager.Array("i", [0,len(arg_space)])
-    
     os.makedirs(f"../output/{meas_name}", exist_ok=True)
     
-    # Run async
+    # Engine runs, scheduled asynchronously
     sims = {}
+    jobs = []
     for i,x in enumerate(arg_space):
         if type(x)==str:
             pass
         else:
             x = np.round_(x, decimals=4)
         args = copy.copy(base_args)
-        args["--out"]=f"../output/{meas_name}/{i}.txt"
+        args["--out"]=f"../output/{meas_name}/{i}.npy"
         args[arg_name]=f"{x}"
-        sims[(x,args["--out"])] = pool.apply_async(run, args =(args, job_count, lock))
-    
-    # Collect async
-    for k,v in sims.items():
-        v.get()
+        jobs.append(Job(get_command(args), name=args["--out"]))
+        sims[(x,args["--out"])] = jobs[-1]
     
-    pool.close()
-    pool.join()
+    # Alert master, if ready
+    job_count = [0, len(jobs)]
+    def done(job):
+        job_count[0]+=1
+        print('\r {}/{}'.format(job_count[0], job_count[1]), end='', flush=True)
+
+    run_jobs(jobs, max_jobs=global_args["procnum"], timeout=global_args["timeout"], retries=global_args["retries"],
+             on_done=done, status_file=f"../output/{meas_name}/jobs.jsonl")
     
     return sims.keys()
 
@@ -60,10 +47,13 @@ base_args = {
     "--second_ratio":2.5,
     "--second_wave":100,
     "--c":0.25,
+    "--format":"npy",
 }
 
 global_args = {
-    "procnum": 20,
+    "procnum": None, # None: available cores
+    "timeout": None,
+    "retries": 1,
 }
 
 #sims_F = measure("second_wave/second_T1:80_R0:2.0", "--second_ratio", [3.0, 3.5, 4.0])
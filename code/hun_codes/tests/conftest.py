@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The hun_codes modules are scripts of the parent folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
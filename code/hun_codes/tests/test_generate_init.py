@@ -0,0 +1,52 @@
+import itertools
+
+import numpy as np
+import scipy.sparse as sp
+
+from generate_init import aggregate_eigen_mtx
+
+
+def baseline_eigen_mtx(mtx, district_ind, pop, phi):
+    # Loop of the original get_eigen_mtx (down summed over district_ind[j], j: last city of k)
+    mtx_d = np.zeros((len(district_ind), len(district_ind)))
+    for l,k in itertools.product(district_ind.keys(), district_ind.keys()):
+        up = 0
+        for i,j in itertools.product(district_ind[l], district_ind[k]):
+            up += mtx[i,j]*phi[j]
+        down = sum([phi[j]*pop[j] for j in district_ind[j]])
+        ml = sum([pop[i] for i in district_ind[l]])
+        mtx_d[l,k] = 0.0 if down < 1e-12 else ml*up/down
+    return mtx_d
+
+def fixed_eigen_mtx(mtx, district_ind, pop, phi):
+    # Same loop, down summed over the cities of district k
+    mtx_d = np.zeros((len(district_ind), len(district_ind)))
+    for l,k in itertools.product(district_ind.keys(), district_ind.keys()):
+        up = sum(mtx[i,j]*phi[j] for i,j in itertools.product(district_ind[l], district_ind[k]))
+        down = sum(phi[j]*pop[j] for j in district_ind[k])
+        ml = sum(pop[i] for i in district_ind[l])
+        mtx_d[l,k] = 0.0 if down < 1e-12 else ml*up/down
+    return mtx_d
+
+def small_network(n=6, seed=0):
+    rng = np.random.default_rng(seed)
+    mtx = rng.random((n, n)) * (rng.random((n, n)) < 0.6)
+    pop = rng.integers(100, 1000, n).astype(float)
+    phi = rng.random(n)
+    return mtx, pop, phi/phi.sum()
+
+
+def test_one_city_districts_match_baseline():
+    mtx, pop, phi = small_network()
+    district_ind = {l: [l] for l in range(len(pop))}
+    new = aggregate_eigen_mtx(sp.csr_matrix(mtx), district_ind, pop, phi)
+    assert np.allclose(new, baseline_eigen_mtx(mtx, district_ind, pop, phi))
+
+
+def test_districts_normalize_by_their_own_cities():
+    mtx, pop, phi = small_network()
+    district_ind = {0: [3, 4, 1], 1: [5, 0], 2: [2]}
+    new = aggregate_eigen_mtx(sp.csr_matrix(mtx), district_ind, pop, phi)
+    assert np.allclose(new, fixed_eigen_mtx(mtx, district_ind, pop, phi))
+    # behaviour change: the baseline divided by the weight of the district keyed by the last city of k
+    assert not np.allclose(new, baseline_eigen_mtx(mtx, district_ind, pop, phi))
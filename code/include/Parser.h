@@ -9,12 +9,27 @@
 #include <vector>
 #include <string>
 #include <fstream>
+#include <map>
 #include "json.hpp"
+#include "npz.h"
 
 using namespace std;
 //using json = nlohmann::json;
 
 
+/**
+ * Sparse commuting network, sigma_ij = commuters from i to j (only the nonzero links are stored)
+ */
+struct Commuting
+{
+    vector<vector<pair<int, double>>> out;   // out[i] : (j, sigma_ij), sorted by j
+    vector<vector<pair<int, double>>> in;    // in[j]  : (i, sigma_ij), sorted by i
+
+    Commuting(size_t N = 0) : out(N), in(N) {}
+    size_t size() const { return out.size(); }
+};
+
+
 /**
  * Parser Class
  */
@@ -44,17 +59,39 @@ class Parser
 
 
     /**
-     * Parse commuting networks
+     * Parse commuting networks: the sparse file (commuting_file_sparse, csr .npz written by generate_init)
+     * if it exists, the json edge list (commuting_file) otherwise
      */
-    vector<vector<double>> parse_commuting()
+    Commuting parse_commuting()
     {
-        string commuting_file = jf["commuting_file"];
-        ifstream ifs(folder + commuting_file);
-        nlohmann::json jf_commuting = nlohmann::json::parse(ifs);
-        int N = jf_commuting["N"];
-        vector<vector<double>> sigmas(N, vector<double>(N, 0.0));
-        for (auto& el : jf_commuting["network"].items())
-            sigmas[int(el.value()["from"])][int(el.value()["to"])] = double(el.value()["weight"]);
+        int N = parse_Npop();
+        vector<map<int, double>> links(N);
+        string sparse_file = jf.value("commuting_file_sparse", "");
+        if (sparse_file != "" && ifstream(folder + sparse_file).good())
+        {
+            map<string, NpyArray> csr = npz::load(folder + sparse_file);
+            vector<double>& indptr = csr["indptr"].data;
+            for (int i = 0; i + 1 < (int)indptr.size(); i++)
+                for (size_t e = size_t(indptr[i]); e < size_t(indptr[i+1]); e++)
+                    links[i][int(csr["indices"].data[e])] = csr["data"].data[e];
+        }
+        else
+        {
+            string commuting_file = jf["commuting_file"];
+            ifstream ifs(folder + commuting_file);
+            nlohmann::json jf_commuting = nlohmann::json::parse(ifs);
+            links.resize(int(jf_commuting["N"]));
+            for (auto& el : jf_commuting["network"].items())
+                links[int(el.value()["from"])][int(el.value()["to"])] = double(el.value()["weight"]);
+        }
+
+        Commuting sigmas(links.size());
+        for (int i = 0; i < (int)links.size(); i++)
+            for (auto& link : links[i])
+                if (link.second != 0.0){
+                    sigmas.out[i].push_back(link);
+                    sigmas.in[link.first].push_back(make_pair(i, link.second));
+                }
         return sigmas;
     }
 
@@ -0,0 +1,169 @@
+//
+// Reader of the .npz archives written by numpy (np.savez, np.savez_compressed, scipy.sparse.save_npz)
+//
+
+#ifndef SIMPLE_NPZ_H
+#define SIMPLE_NPZ_H
+
+#include <cstdint>
+#include <cstring>
+#include <fstream>
+#include <map>
+#include <sstream>
+#include <stdexcept>
+#include <string>
+#include <vector>
+#include <zlib.h>
+
+using namespace std;
+
+
+/**
+ * Numeric array of an archive, converted to double (integer arrays are exact up to 2^53)
+ */
+struct NpyArray
+{
+    vector<size_t> shape;
+    vector<double> data;
+};
+
+
+namespace npz
+{
+    inline uint32_t read_u32(const string& s, size_t pos)
+    {
+        const unsigned char* p = (const unsigned char*)s.data() + pos;
+        return uint32_t(p[0]) | uint32_t(p[1]) << 8 | uint32_t(p[2]) << 16 | uint32_t(p[3]) << 24;
+    }
+
+    inline uint16_t read_u16(const string& s, size_t pos)
+    {
+        const unsigned char* p = (const unsigned char*)s.data() + pos;
+        return uint16_t(p[0]) | uint16_t(p[1]) << 8;
+    }
+
+    /**
+     * Raw deflate stream of a zip entry
+     */
+    inline string inflate_raw(const string& in, size_t size)
+    {
+        string out(size, '\0');
+        z_stream zs;
+        memset(&zs, 0, sizeof(zs));
+        if (inflateInit2(&zs, -MAX_WBITS) != Z_OK)
+            throw runtime_error("npz: inflateInit2 failed");
+        zs.next_in = (Bytef*)in.data();
+        zs.avail_in = in.size();
+        zs.next_out = (Bytef*)&out[0];
+        zs.avail_out = size;
+        int ret = inflate(&zs, Z_FINISH);
+        inflateEnd(&zs);
+        if (ret != Z_STREAM_END)
+            throw runtime_error("npz: corrupted entry");
+        return out;
+    }
+
+    /**
+     * Value of a key of the header dict of a .npy file, e.g. 'descr': '<f8'
+     */
+    inline string header_value(const string& header, const string& key)
+    {
+        size_t pos = header.find("'" + key + "'");
+        if (pos == string::npos)
+            throw runtime_error("npz: missing " + key);
+        pos = header.find(':', pos) + 1;
+        while (header[pos] == ' ') pos++;
+        char close = header[pos] == '(' ? ')' : header[pos] == '\'' ? '\'' : ',';
+        size_t end = header.find(close, pos + 1);
+        return header.substr(pos + (close == '\'' ? 1 : 0), end - pos - (close == '\'' ? 1 : -1));
+    }
+
+    template <typename T>
+    void convert(const char* p, size_t n, vector<double>& data)
+    {
+        data.resize(n);
+        for (size_t i = 0; i < n; i++){
+            T v;
+            memcpy(&v, p + i * sizeof(T), sizeof(T));
+            data[i] = double(v);
+        }
+    }
+
+    /**
+     * Parse a .npy file (little endian int32/int64/float64, C order)
+     */
+    inline NpyArray parse_npy(const string& s)
+    {
+        if (s.compare(0, 6, "\x93NUMPY") != 0)
+            throw runtime_error("npz: not a .npy entry");
+        size_t header_len = s[6] == 1 ? read_u16(s, 8) : read_u32(s, 8);
+        size_t offset = s[6] == 1 ? 10 : 12;
+        string header = s.substr(offset, header_len);
+        if (header_value(header, "fortran_order").find("True") != string::npos)
+            throw runtime_error("npz: fortran order is not supported");
+
+        NpyArray arr;
+        size_t n = 1;
+        stringstream shape(header_value(header, "shape").substr(1));
+        string dim;
+        while (getline(shape, dim, ','))
+            if (dim.find_first_of("0123456789") != string::npos){
+                arr.shape.push_back(stoull(dim));
+                n *= arr.shape.back();
+            }
+
+        string descr = header_value(header, "descr");
+        const char* p = s.data() + offset + header_len;
+        if (descr == "<f8") convert<double>(p, n, arr.data);
+        else if (descr == "<i8") convert<int64_t>(p, n, arr.data);
+        else if (descr == "<i4") convert<int32_t>(p, n, arr.data);
+        else if (descr[1] == 'U' || descr[1] == 'S') arr.data.clear();   // strings (e.g. the sparse format) are skipped
+        else throw runtime_error("npz: unsupported dtype " + descr);
+        return arr;
+    }
+
+    /**
+     * Read the numeric arrays of an archive, by name (without the .npy suffix)
+     */
+    inline map<string, NpyArray> load(const string& file)
+    {
+        ifstream ifs(file, ios::binary);
+        if (!ifs)
+            throw runtime_error("npz: cannot open " + file);
+        string s((istreambuf_iterator<char>(ifs)), istreambuf_iterator<char>());
+
+        // end of central directory record
+        size_t eocd = s.size() < 22 ? string::npos : s.size() - 22;
+        while (eocd != string::npos && read_u32(s, eocd) != 0x06054b50)
+            eocd = eocd == 0 ? string::npos : eocd - 1;
+        if (eocd == string::npos)
+            throw runtime_error("npz: not a zip archive " + file);
+
+        map<string, NpyArray> arrays;
+        size_t entries = read_u16(s, eocd + 10);
+        size_t pos = read_u32(s, eocd + 16);
+        for (size_t e = 0; e < entries; e++){
+            uint16_t method = read_u16(s, pos + 10);
+            size_t comp_size = read_u32(s, pos + 20);
+            size_t size = read_u32(s, pos + 24);
+            size_t name_len = read_u16(s, pos + 28);
+            size_t next = pos + 46 + name_len + read_u16(s, pos + 30) + read_u16(s, pos + 32);
+            string name = s.substr(pos + 46, name_len);
+            size_t local = read_u32(s, pos + 42);
+            pos = next;
+
+            size_t start = local + 30 + read_u16(s, local + 26) + read_u16(s, local + 28);
+            string entry;
+            if (method == 0) entry = s.substr(start, size);
+            else if (method == 8) entry = inflate_raw(s.substr(start, comp_size), size);
+            else throw runtime_error("npz: unsupported compression of " + name);
+
+            if (name.size() > 4 && name.compare(name.size() - 4, 4, ".npy") == 0)
+                name = name.substr(0, name.size() - 4);
+            arrays[name] = parse_npy(entry);
+        }
+        return arrays;
+    }
+}
+
+#endif //SIMPLE_NPZ_H
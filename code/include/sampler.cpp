@@ -7,6 +7,27 @@ random_device device;
 mt19937 g(0);
 //mt19937 g(device());
 
+/**
+ * Seed the generator (same seed, same random stream)
+ */
+void set_seed(unsigned int seed)
+{
+    g.seed(seed);
+}
+
+/**
+ * Save/restore the state of the generator (to continue a run, see --save_state)
+ */
+void save_rng(ostream& out)
+{
+    out << g;
+}
+
+void load_rng(istream& in)
+{
+    in >> g;
+}
+
 /**
  * Binomial distribution sampler
  */
@@ -5,8 +5,12 @@
 #ifndef SIMPLE_SAMPLER_H
 #define SIMPLE_SAMPLER_H
 #include <random>
+#include <iostream>
 using namespace std;
 
+void set_seed(unsigned int seed);
+void save_rng(ostream& out);
+void load_rng(istream& in);
 double binomial(int n, double p);
 double rnd();
 
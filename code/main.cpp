@@ -1,6 +1,8 @@
 #include <iostream>
 #include <vector>
 #include <cstdlib>
+#include <cstdint>
+#include <fstream>
 #include "include/sampler.h"
 #include "include/Parser.h"
 #include <math.h>
@@ -20,6 +22,11 @@ struct Args{
     unsigned int maxT = 175;
     double c = 0.0;
     int second_wave = -1;
+    double tau = 3.0;
+    double second_infected_ratio = 0.01;
+    std::string format = "csv";
+    std::string load_state = "";
+    std::string save_state = "";
 };
 
 void read_args(int argc, char* argv[], Args& args){
@@ -40,6 +47,11 @@ void read_args(int argc, char* argv[], Args& args){
         else if(act_param=="--maxT") args.maxT = std::stoi(argv[++i]);
         else if(act_param=="--c") args.c = std::stod(argv[++i]);
         else if(act_param=="--second_wave") args.second_wave = std::stoi(argv[++i]);
+        else if(act_param=="--tau") args.tau = std::stod(argv[++i]);
+        else if(act_param=="--second_infected_ratio") args.second_infected_ratio = std::stod(argv[++i]);
+        else if(act_param=="--format") args.format = argv[++i];
+        else if(act_param=="--load_state") args.load_state = argv[++i];
+        else if(act_param=="--save_state") args.save_state = argv[++i];
         //else if(act_param=="--verbose"){ args.verbose=true;++i;}
     }
 }
@@ -86,11 +98,11 @@ vector<vector<double>> sumMat(vector<vector<double>> C1, vector<vector<double>>
 /**
  * Get sigma_i for population i
  */
-double get_sigma(int j, vector<vector<double>> &sigmas)
+double get_sigma(int j, Commuting &sigmas)
 {
     double sigma = 0.0;
-    for (int i = 0; i < sigmas[j].size(); i++)
-        sigma += sigmas[j][i];
+    for (auto& link : sigmas.out[j])
+        sigma += link.second;
     return sigma;
 }
 
@@ -98,29 +110,33 @@ double get_sigma(int j, vector<vector<double>> &sigmas)
 /**
  * Get effective N for a specific age group
  */
-double get_Nk_eff(int pop_idx, int age_idx, double tau, vector<vector<double>> &Nk, vector<vector<double>> &sigmas, vector<double> &sigmas_j)
+double get_Nk_eff(int pop_idx, int age_idx, double tau, vector<vector<double>> &Nk, Commuting &sigmas, vector<double> &sigmas_j)
 {
     double Neff = Nk[pop_idx][age_idx] / (1 + sigmas_j[pop_idx] / tau);
-    for (int i = 0; i < Nk.size(); i++)
-        Neff += Nk[i][age_idx] / (1 + sigmas_j[i] / tau) * sigmas[i][pop_idx] / tau;
+    for (auto& link : sigmas.in[pop_idx])
+        Neff += Nk[link.first][age_idx] / (1 + sigmas_j[link.first] / tau) * link.second / tau;
     return Neff;
 }
 
 
 /**
- * Get single lambda
+ * Get single lambda (the commuters to pop_idx are visited in increasing order of their population,
+ * the population itself at its place: same sum as over all populations)
  */
-double get_lambda(int pop_idx, int age_idx, double tau, double beta, vector<vector<double>> &Nk_eff, vector<vector<double>> &I, vector<vector<double>> &C, vector<vector<double>> &sigmas, vector<double> &sigmas_j)
+double get_lambda(int pop_idx, int age_idx, double tau, double beta, vector<vector<double>> &Nk_eff, vector<vector<double>> &I, vector<vector<double>> &C, Commuting &sigmas, vector<double> &sigmas_j)
 {
     double lambda = 0.0;
-    for (int i = 0; i < I.size(); i++){
-        if (i == pop_idx)
-            for (int k = 0; k < I[0].size(); k++)
-                lambda += (C[age_idx][k] / Nk_eff[pop_idx][k]) * (I[pop_idx][k] / (1 + sigmas_j[pop_idx] / tau));
-        else
+    vector<pair<int, double>>& in = sigmas.in[pop_idx];
+    size_t e = 0;
+    for (; e < in.size() && in[e].first < pop_idx; e++)
+        for (int k = 0; k < I[0].size(); k++)
+            lambda += (C[age_idx][k] / Nk_eff[pop_idx][k]) * (I[in[e].first][k] / (1 + sigmas_j[in[e].first] / tau)) * (in[e].second / tau);
+    for (int k = 0; k < I[0].size(); k++)
+        lambda += (C[age_idx][k] / Nk_eff[pop_idx][k]) * (I[pop_idx][k] / (1 + sigmas_j[pop_idx] / tau));
+    for (; e < in.size(); e++)
+        if (in[e].first != pop_idx)
             for (int k = 0; k < I[0].size(); k++)
-                lambda += (C[age_idx][k] / Nk_eff[pop_idx][k]) * (I[i][k] / (1 + sigmas_j[i] / tau)) * (sigmas[i][pop_idx] / tau);
-    }
+                lambda += (C[age_idx][k] / Nk_eff[pop_idx][k]) * (I[in[e].first][k] / (1 + sigmas_j[in[e].first] / tau)) * (in[e].second / tau);
     lambda = lambda * beta;
     return lambda;
 }
@@ -129,16 +145,16 @@ double get_lambda(int pop_idx, int age_idx, double tau, double beta, vector<vect
 /**
  * Get total lambda
  */
-double get_lambda_tot(int pop_idx, int age_idx, double tau, double beta, vector<vector<double>> &Nk_eff, vector<vector<double>> &I, vector<vector<vector<double>>> &C, vector<vector<double>> &sigmas, vector<double> &sigmas_j)
+double get_lambda_tot(int pop_idx, int age_idx, double tau, double beta, vector<vector<double>> &Nk_eff, vector<vector<double>> &I, vector<vector<vector<double>>> &C, Commuting &sigmas, vector<double> &sigmas_j)
 {
     double lambda_tot = 0.0;
     double lambda_ji = 0.0;
     double lambda_jj = get_lambda(pop_idx, age_idx, tau, beta, Nk_eff, I, C[pop_idx], sigmas, sigmas_j);
     lambda_tot += lambda_jj / (1 + sigmas_j[pop_idx] / tau);
 
-    for (int i = 0; i < I.size(); i++){
-        lambda_ji = get_lambda(i, age_idx, tau, beta, Nk_eff, I, C[i], sigmas, sigmas_j);
-        lambda_tot += lambda_ji / (1 + sigmas_j[pop_idx] / tau) * (sigmas[pop_idx][i] / tau);
+    for (auto& link : sigmas.out[pop_idx]){
+        lambda_ji = get_lambda(link.first, age_idx, tau, beta, Nk_eff, I, C[link.first], sigmas, sigmas_j);
+        lambda_tot += lambda_ji / (1 + sigmas_j[pop_idx] / tau) * (link.second / tau);
     }
     return lambda_tot;
 }
@@ -148,7 +164,7 @@ void update_moving(
     int K,
     int Npop,
     vector<vector<double>>& Nk_eff,
-    vector<vector<double>>& sigmas,
+    Commuting& sigmas,
     vector<double>& sigmas_j,
     vector<vector<vector<double>>>& C,
     vector<vector<double>>& C1,
@@ -180,6 +196,81 @@ void init_second_wave(
     }
 } 
 
+/**
+ * Write the header of a (maxT, Npop, K, 3) int32 .npy file,
+ * the data is then appended day by day
+ */
+void write_npy_header(ofstream& file, unsigned int T, int Npop, int K)
+{
+    std::string header = "{'descr': '<i4', 'fortran_order': False, 'shape': (" +
+        to_string(T) + ", " + to_string(Npop) + ", " + to_string(K) + ", 3), }";
+    // magic (6) + version (2) + header length (2) + header, padded to 64 bytes
+    size_t total = 10 + header.size() + 1;
+    header += std::string((64 - total % 64) % 64, ' ') + "\n";
+    uint16_t len = header.size();
+    file.write("\x93NUMPY\x01\x00", 8);
+    file.write(reinterpret_cast<const char*>(&len), 2);
+    file << header;
+}
+
+
+/**
+ * Write the metadata sidecar of a .npy output (see control_panel/trajectory.py),
+ * T days written from day start
+ */
+void write_npy_meta(Args& args, int Npop, int K, unsigned int T, int start)
+{
+    ofstream metaFile(args.output_file + ".json");
+    metaFile << "{\"Npop\": " << Npop << ", \"K\": " << K << ", \"T\": " << T << ", \"start\": " << start
+             << ", \"compartments\": [\"I\", \"I2\", \"R\"], \"dtype\": \"int32\", \"params\": {"
+             << "\"R0\": " << args.R0 << ", \"R1\": " << args.R1 << ", \"r1\": " << args.r1 << ", \"r2\": " << args.r2
+             << ", \"c\": " << args.c << ", \"second_wave\": " << args.second_wave << ", \"moving_t\": " << args.moving_t
+             << ", \"tau\": " << args.tau << ", \"second_infected_ratio\": " << args.second_infected_ratio
+             << ", \"seed\": " << args.seed << ", \"maxT\": " << args.maxT << "}}";
+}
+
+
+/**
+ * Save the state of a run at day t (compartments and random generator),
+ * the run is continued from it with --load_state
+ */
+void save_state(const std::string& file, int t, const vector<vector<vector<double>>*>& compartments)
+{
+    ofstream stateFile(file);
+    stateFile.precision(17);
+    stateFile << t << "\n";
+    for (auto compartment : compartments){
+        for (auto& row : *compartment)
+            for (double x : row)
+                stateFile << x << " ";
+        stateFile << "\n";
+    }
+    save_rng(stateFile);
+}
+
+
+/**
+ * Load the state saved by save_state
+ * Returns the day of the state
+ */
+int load_state(const std::string& file, const vector<vector<vector<double>>*>& compartments)
+{
+    ifstream stateFile(file);
+    if(!stateFile){
+        std::cerr << "State file not found: " << file << std::endl;
+        exit(1);
+    }
+    int t;
+    stateFile >> t;
+    for (auto compartment : compartments)
+        for (auto& row : *compartment)
+            for (double& x : row)
+                stateFile >> x;
+    load_rng(stateFile);
+    return t;
+}
+
+
 /**
  * Main
  */
@@ -189,7 +280,7 @@ int main(int argc, char *argv[])
     Args args;
     read_args(argc, argv, args);
     Parser parser = Parser(args.config_folder);
-    srand(args.seed);
+    set_seed(args.seed);
 
     // number of comunas, age groups, and simulations per parameters
     int Npop = parser.parse_Npop();
@@ -201,7 +292,7 @@ int main(int argc, char *argv[])
     // parameters
     double mu = 1 / 2.5;
     double eps = 1 / 4.0;
-    double tau = 3.0;
+    double tau = args.tau;
     double R0 = args.R0;
     double R1 = args.R1;
     double beta = get_beta(R0, mu, 16.204308331681283);
@@ -210,7 +301,7 @@ int main(int argc, char *argv[])
 
 
     // commuting
-    vector<vector<double>> sigmas = parser.parse_commuting();
+    Commuting sigmas = parser.parse_commuting();
     vector<double> sigmas_j;
     for (int i = 0; i < Npop; i++)
         sigmas_j.push_back(get_sigma(i, sigmas));
@@ -272,44 +363,63 @@ int main(int argc, char *argv[])
     double newL2 = 0.0;
     double newI2 = 0.0;
 
+    // continue a saved run (the days before its state are not written)
+    int T0 = 243;
+    int t_start = T0;
+    vector<vector<vector<double>>*> state = {&S, &L, &I, &R, &L2, &I2};
+    if(args.load_state != "")
+        t_start = load_state(args.load_state, state);
+    unsigned int days = std::max(0, T0 + (int)args.maxT - t_start);
+
     // write results header
-    ofstream resFile(args.output_file);
-    for (int i = 0; i < Npop; i++){
-        for (int k = 0; k < K; k++){
-            resFile << "I_" << to_string(i) << "_" << to_string(k) << "," ;
-            resFile << "I2_" << to_string(i) << "_" << to_string(k) << "," ;
-            resFile << "R_" << to_string(i) << "_" << to_string(k) << ",";
+    bool npy = args.format == "npy";
+    ofstream resFile(args.output_file, npy ? ios::binary : ios::out);
+    vector<int32_t> row(Npop*K*3);
+    if(npy){
+        write_npy_header(resFile, days, Npop, K);
+        write_npy_meta(args, Npop, K, days, t_start - T0);
+    }
+    else{
+        for (int i = 0; i < Npop; i++){
+            for (int k = 0; k < K; k++){
+                resFile << "I_" << to_string(i) << "_" << to_string(k) << "," ;
+                resFile << "I2_" << to_string(i) << "_" << to_string(k) << "," ;
+                resFile << "R_" << to_string(i) << "_" << to_string(k) << ",";
+            }
         }
+        resFile << "\n";
     }
-    resFile << "\n";
+
+    auto restrict = [&](){
+        C.clear();
+        for (int i = 0; i < Npop; i++)
+            C.push_back(sumMat(scalarProductMat(C1, r2[i], K), scalarProductMat(C2, r2[i], K), K));
+
+        sigmas_j.clear();
+        sigmas = parser.parse_commuting();
+        for (int i = 0; i < Npop; i++)
+            sigmas_j.push_back(get_sigma(i, sigmas));
+
+        for (int i = 0; i < Npop; i++)
+            for (int k = 0; k < K; k++)
+                Nk_eff[i][k] = get_Nk_eff(i, k, tau, Nk, sigmas, sigmas_j);
+    };
+    if (args.moving_t >= 0 && args.moving_t < t_start) // restrictions before the saved state
+        restrict();
 
     std::cout << "Start Simulation" << '\n';
     // simulate
-    int T0 = 243;
     double lambda = 0.0;
-    for (int t = T0; t < T0+args.maxT; t++)
+    for (int t = t_start; t < T0+(int)args.maxT; t++)
     {
         if(t == T0+args.second_wave){
             std::cout<<"Second wave\n";
-            init_second_wave(Npop, K, 0.01, L,L2,I,I2);
+            init_second_wave(Npop, K, args.second_infected_ratio, L,L2,I,I2);
         }
 
         std::cout<<"\r"<<t<<"    "<<std::flush;
-        if (t == args.moving_t){ // restrictions
-            C.clear();
-            for (int i = 0; i < Npop; i++)
-                C.push_back(sumMat(scalarProductMat(C1, r2[i], K), scalarProductMat(C2, r2[i], K), K));
-
-            sigmas.clear();
-            sigmas_j.clear();
-            sigmas = parser.parse_commuting();
-            for (int i = 0; i < Npop; i++)
-                sigmas_j.push_back(get_sigma(i, sigmas));
-
-            for (int i = 0; i < Npop; i++)
-                for (int k = 0; k < K; k++)
-                    Nk_eff[i][k] = get_Nk_eff(i, k, tau, Nk, sigmas, sigmas_j);
-        }
+        if (t == args.moving_t) // restrictions
+            restrict();
 
         double act_beta = beta*seasonality(args.c, t);
         double act_beta2 = t >= T0+args.second_wave ? beta2*seasonality(args.c, t) : act_beta;
@@ -361,15 +471,23 @@ int main(int argc, char *argv[])
 
                 L2[i][k] = L2next[i][k];
                 I2[i][k] = I2next[i][k];
-                resFile << I_new[i][k] << "," << I2_new[i][k] << "," << R[i][k] << ",";
+                if(npy){
+                    row[3*(i*K+k)] = I_new[i][k];
+                    row[3*(i*K+k)+1] = I2_new[i][k];
+                    row[3*(i*K+k)+2] = R[i][k];
+                }
+                else resFile << I_new[i][k] << "," << I2_new[i][k] << "," << R[i][k] << ",";
                 //resFile << I[i][k] << "," << R[i][k] << ",";
 
                 Lall += L2[i][k];
             }
         }
-        resFile << "\n";
+        if(npy) resFile.write(reinterpret_cast<const char*>(row.data()), row.size()*sizeof(int32_t));
+        else resFile << "\n";
         //std::cout<<Lall<<std::endl;
     }
     std::cout << "End of Simulation" << '\n';
+    if(args.save_state != "")
+        save_state(args.save_state, T0+args.maxT, state);
     return 0;
 }
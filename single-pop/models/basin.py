@@ -0,0 +1,125 @@
+# libraries
+import os
+import pickle as pkl
+import numpy as np
+import pandas as pd
+from collections.abc import Mapping
+
+
+# default data folder (independent of the working directory)
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+
+
+# source file and kind of each basin entry
+sources = {
+    "other_loc_restr":    ("restrictions/other_loc.csv",                "table"),
+    "work_restr":         ("restrictions/work.csv",                     "table"),
+    "school_restr":       ("restrictions/school.csv",                   "table"),
+    "home_restr":         ("restrictions/home.csv",                     "table"),
+    "overall_restr":      ("restrictions/overall.csv",                  "table"),
+    "other_loc_contacts": ("contacts-matrix/chile_other_locations.csv", "matrix"),
+    "work_contacts":      ("contacts-matrix/chile_work.csv",            "matrix"),
+    "school_contacts":    ("contacts-matrix/chile_school.csv",          "matrix"),
+    "home_contacts":      ("contacts-matrix/chile_home.csv",            "matrix"),
+    "exposed_ic":         ("initial-conditions/exposed.pkl",            "dict"),
+    "infectious_ic":      ("initial-conditions/infectious.pkl",         "dict"),
+    "Nk":                 ("demographic/pop_5years.csv",                "column"),
+    "epi_data":           ("epidemiological-data/epi_data.csv",         "table"),
+}
+
+
+def read_source(key, path, kind):
+
+    """
+    This function reads one source file and returns it as a dict of plain arrays
+    """
+
+    if kind == "table":
+        df = pd.read_csv(path)
+        arrays = {key + "/__columns__": np.array(df.columns, dtype=str)}
+        for col in df.columns:
+            values = df[col].to_numpy()
+            arrays[key + "/" + col] = values.astype(str) if values.dtype == object else values
+    elif kind == "matrix":
+        arrays = {key: pd.read_csv(path, header=None).values}
+    elif kind == "dict":
+        with open(path, "rb") as file:
+            d = pkl.load(file)
+        arrays = {key + "/__keys__": np.array(list(d.keys()), dtype=str), key: np.array(list(d.values()))}
+    else:
+        arrays = {key: pd.read_csv(path)["total"].values}
+    return arrays
+
+
+def unpack(key, kind, arrays):
+
+    """
+    This function rebuilds a basin entry from its cached arrays
+    """
+
+    if kind == "table":
+        return pd.DataFrame({col: arrays[key + "/" + col] for col in arrays[key + "/__columns__"]})
+    elif kind == "dict":
+        return dict(zip(arrays[key + "/__keys__"].tolist(), arrays[key].tolist()))
+    return arrays[key]
+
+
+class Basin(Mapping):
+
+    """
+    This class gives dict-like, lazy access to the basin data. On first access all
+    the source files are consolidated into a single .npz cache, which is rebuilt
+    only when one of the sources changes
+    """
+
+    def __init__(self, data_dir=data_dir, cache_file=None):
+        self.data_dir   = data_dir
+        self.cache_file = cache_file if cache_file is not None else os.path.join(data_dir, "basin_cache.npz")
+        self.arrays     = None
+        self.values     = {}
+
+    def stamp(self):
+        # identifies the current version of the source files
+        stamps = []
+        for key, (path, kind) in sources.items():
+            st = os.stat(os.path.join(self.data_dir, path))
+            stamps.append("%s:%d:%d" % (path, st.st_mtime_ns, st.st_size))
+        return np.array(stamps, dtype=str)
+
+    def load(self):
+        if self.arrays is not None:
+            return self.arrays
+
+        stamp = self.stamp()
+        if os.path.exists(self.cache_file):
+            with np.load(self.cache_file) as cache:
+                if np.array_equal(cache["__stamp__"], stamp):
+                    self.arrays = dict(cache)
+                    return self.arrays
+
+        # (re)build the cache
+        arrays = {"__stamp__": stamp}
+        for key, (path, kind) in sources.items():
+            arrays.update(read_source(key, os.path.join(self.data_dir, path), kind))
+
+        # write atomically, concurrent processes may be rebuilding it as well
+        tmp_file = "%s.%d.tmp" % (self.cache_file, os.getpid())
+        with open(tmp_file, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(tmp_file, self.cache_file)
+
+        self.arrays = arrays
+        return self.arrays
+
+    def __getitem__(self, key):
+        if key not in self.values:
+            if key not in sources:
+                raise KeyError(key)
+            self.values[key] = unpack(key, sources[key][1], self.load())
+        return self.values[key]
+
+    def __iter__(self):
+        return iter(sources)
+
+    def __len__(self):
+        return len(sources)
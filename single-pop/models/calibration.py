@@ -0,0 +1,272 @@
+# libraries
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from numba import jit
+
+import single_pop_model as spm
+
+
+# restriction schedules that can be selected by the calibration
+schedules = {"TEF": spm.build_contacts_TEF, "GOOGLE": spm.build_contacts_GOOGLE}
+
+
+# default priors: R0 ~ U(R0), Delta ~ U{Delta}, schedule ~ U(schedules)
+default_prior = {"R0": (1.5, 4.0), "Delta": (5, 30), "schedule": list(schedules)}
+
+
+# data shared by the worker processes (filled by init_worker)
+context = {}
+
+
+
+def init_worker(data_dir, schedule_names):
+
+    """
+    This function loads the basin, the contacts schedules and the observed weekly deaths once per process
+    """
+
+    basin_dict = spm.import_basin(data_dir)
+
+    # simulate up to (and including) the last fitted day
+    dates = spm.get_dates(spm.start_date, spm.end_date + timedelta(days=1))
+
+    # observed weekly deaths, and the observed week of each simulated day (-1 if not observed)
+    epi_data = basin_dict["epi_data"].set_index(pd.to_datetime(basin_dict["epi_data"]["fecha"]))
+    weekly   = epi_data[["count"]].resample("W").sum()
+    weekly   = weekly.loc[weekly.index <= spm.end_date]
+    week_of  = {week: w for w, week in enumerate(weekly.index)}
+    day_week = np.array([week_of.get(pd.Timestamp(d + timedelta(days=6 - d.weekday())), -1) for d in dates])
+
+    context["Cs"]                 = [schedules[name](basin_dict, dates).Cs for name in schedule_names]
+    context["rho"]                = [spm.get_spectral_radius(Cs[0]) for Cs in context["Cs"]]
+    context["Nk"]                 = np.asarray(basin_dict["Nk"], dtype=float)
+    context["initial_conditions"] = spm.get_initial_conditions(basin_dict)
+    context["obs"]                = weekly["count"].values.astype(float)
+    context["day_week"]           = day_week
+
+
+
+@jit(nopython=True)
+def simulate_particle(Cs, Nk, initial_conditions, beta, P, lags, day_week, obs, eps_abc, rng, obs_rng):
+
+    """
+    This function simulates one particle from its own random streams (dynamics and observation, see
+    spm.get_rng) and returns its distance to the observed weekly deaths and its simulated days. Deaths 
+    follow the observation model of spm.observe_deaths (P, lags: see spm.get_death_probs). The particle 
+    is dropped as soon as its partial distance exceeds the tolerance (its distance is then inf)
+    """
+
+    T = len(day_week)
+    state   = initial_conditions.copy()
+    deaths  = np.zeros((len(Nk), T))               # daily deaths (complete up to the current day)
+    partial = 0.0                                  # partial squared distance
+    week    = 0.0                                  # deaths of the current observed week
+
+    for t in range(1, T):
+        next_state = spm.step_SEIRD(state, Cs[t - 1], Nk, beta, rng)
+        spm.draw_deaths(deaths, next_state[3] - state[3], P, lags, t, obs_rng)
+        state = next_state
+
+        # end of an observed week: add its contribution to the distance
+        w = day_week[t]
+        if w >= 0:
+            week += np.sum(deaths[:, t])
+        if w >= 0 and (t == T - 1 or day_week[t + 1] != w):
+            partial += (week - obs[w]) ** 2
+            week = 0.0
+
+            # early rejection
+            if partial > eps_abc ** 2:
+                return np.inf, t
+
+    return np.sqrt(partial), T - 1
+
+
+
+def run_batch(R0s, Deltas, schedule_ids, eps_abc, seed, first, shape=None):
+
+    """
+    This function simulates a batch of proposed particles (run by a worker process). Particle 
+    first + i draws from the streams spm.get_rng(seed, first + i): any particle can be replayed alone 
+    with spm.simulate(..., seed=seed, replicate=particle, shape=shape)
+    """
+
+    Nk, obs, day_week = context["Nk"], context["obs"], context["day_week"]
+    particles = np.arange(first, first + len(R0s))
+
+    distances, days = np.full(len(R0s), np.inf), 0
+    for i, particle in enumerate(particles):
+        s = schedule_ids[i]
+        beta = R0s[i] * spm.mu / context["rho"][s]
+        lags, P = spm.get_death_probs(spm.get_delay_pmf(Deltas[i], shape))
+        distances[i], n = simulate_particle(context["Cs"][s], Nk, context["initial_conditions"], beta, P[0], lags,
+                                            day_week, obs, eps_abc, spm.get_rng(seed, particle),
+                                            spm.get_rng(seed, particle, spm.observation))
+        days += n
+
+    accepted = distances <= eps_abc
+    return particles[accepted], R0s[accepted], Deltas[accepted], schedule_ids[accepted], distances[accepted], days
+
+
+
+class Population:
+
+    """
+    This class holds the weighted particles of one ABC-SMC generation
+    """
+
+    def __init__(self, R0s, Deltas, schedule_ids, distances, weights):
+        self.R0s          = np.asarray(R0s, dtype=float)
+        self.Deltas       = np.asarray(Deltas, dtype=int)
+        self.schedule_ids = np.asarray(schedule_ids, dtype=int)
+        self.distances    = np.asarray(distances, dtype=float)
+        self.weights      = np.asarray(weights, dtype=float) / np.sum(weights)
+
+        # perturbation kernel widths (twice the weighted variance), floored so that a collapsed population still moves
+        self.sigma_R0    = max(np.sqrt(2 * np.cov(self.R0s, aweights=self.weights)) if len(self.R0s) > 1 else 0.1, 0.01)
+        self.sigma_Delta = max(np.sqrt(2 * np.cov(self.Deltas, aweights=self.weights)) if len(self.R0s) > 1 else 1.0, 0.5)
+
+    def sample(self, n, prior, p_switch):
+        # resample and perturb particles, keeping only the ones inside the prior support
+        R0s, Deltas, schedule_ids = [], [], []
+        n_schedules = len(prior["schedule"])
+        while sum(len(r) for r in R0s) < n:
+            idx = np.random.choice(len(self.weights), size=n, p=self.weights)
+            R0 = self.R0s[idx] + self.sigma_R0 * np.random.randn(n)
+            Delta = self.Deltas[idx] + np.rint(self.sigma_Delta * np.random.randn(n)).astype(int)
+            schedule_id = self.schedule_ids[idx].copy()
+            if n_schedules > 1:
+                switch = np.random.rand(n) < p_switch
+                schedule_id[switch] = (schedule_id[switch] + np.random.randint(1, n_schedules, switch.sum())) % n_schedules
+            inside = in_prior(prior, R0, Delta)
+            R0s.append(R0[inside])
+            Deltas.append(Delta[inside])
+            schedule_ids.append(schedule_id[inside])
+        return np.concatenate(R0s)[:n], np.concatenate(Deltas)[:n], np.concatenate(schedule_ids)[:n]
+
+    def weight(self, R0s, Deltas, schedule_ids, prior, p_switch):
+        # importance weights: (uniform) prior / sum_j w_j K(theta | theta_j)
+        n_schedules = len(prior["schedule"])
+        k_R0    = np.exp(-0.5 * ((R0s[:, None] - self.R0s[None]) / self.sigma_R0) ** 2)
+        k_Delta = np.exp(-0.5 * ((Deltas[:, None] - self.Deltas[None]) / self.sigma_Delta) ** 2)
+        if n_schedules > 1:
+            k_sched = np.where(schedule_ids[:, None] == self.schedule_ids[None], 1 - p_switch, p_switch / (n_schedules - 1))
+        else:
+            k_sched = 1.0
+        return 1.0 / np.sum(self.weights[None] * k_R0 * k_Delta * k_sched, axis=1)
+
+
+
+def in_prior(prior, R0s, Deltas):
+    return (R0s >= prior["R0"][0]) & (R0s <= prior["R0"][1]) & (Deltas >= prior["Delta"][0]) & (Deltas <= prior["Delta"][1])
+
+
+def sample_prior(prior, n):
+    R0s          = np.random.uniform(prior["R0"][0], prior["R0"][1], n)
+    Deltas       = np.random.randint(prior["Delta"][0], prior["Delta"][1] + 1, n)
+    schedule_ids = np.random.randint(0, len(prior["schedule"]), n)
+    return R0s, Deltas, schedule_ids
+
+
+
+def abc_smc(n_particles=1000, n_generations=5, prior=default_prior, out="abc", workers=os.cpu_count(),
+            batch_size=100, quantile=0.5, p_switch=0.2, seed=0, data_dir=spm.basin.data_dir, shape=None):
+
+    """
+    This function runs ABC-SMC with adaptive tolerance for (R0, Delta, restriction schedule) against
+    the weekly deaths (Delta: mean of a gamma delay of the given shape, or exact delay if shape is None). Proposals are simulated in batches by a process pool, and accepted particles
+    are appended to {out}/generation_{g}.csv as soon as they arrive, with the particle id that replays them (see run_batch)
+    """
+
+    os.makedirs(out, exist_ok=True)
+    np.random.seed(seed)
+    n_particles_proposed = 0
+
+    # build the basin cache once, before the workers load it
+    spm.import_basin(data_dir).load()
+
+    population, eps_abc = None, np.inf
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(data_dir, prior["schedule"])) as pool:
+        for g in range(n_generations):
+            start, n_accepted, n_proposed, n_days = time.time(), 0, 0, 0
+            accepted = []
+            out_file = os.path.join(out, f"generation_{g}.csv")
+            if os.path.exists(out_file):
+                os.remove(out_file)
+
+            # keep every worker busy until enough particles are accepted
+            pending = set()
+            while n_accepted < n_particles:
+                while len(pending) < 2 * workers:
+                    if population is None:
+                        proposals = sample_prior(prior, batch_size)
+                    else:
+                        proposals = population.sample(batch_size, prior, p_switch)
+                    pending.add(pool.submit(run_batch, *proposals, eps_abc, seed, n_particles_proposed, shape))
+                    n_particles_proposed += batch_size
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    particles, R0s, Deltas, schedule_ids, distances, days = future.result()
+                    n_days += days
+                    # batches finished after the generation is complete are discarded (not counted as proposed)
+                    if n_accepted >= n_particles:
+                        continue
+                    n_proposed += batch_size
+                    if len(R0s) == 0:
+                        continue
+                    if population is None:
+                        weights = np.ones(len(R0s))
+                    else:
+                        weights = population.weight(R0s, Deltas, schedule_ids, prior, p_switch)
+
+                    # stream accepted particles to disk
+                    batch = pd.DataFrame({"generation": g, "particle": particles, "R0": R0s, "Delta": Deltas,
+                                          "schedule": np.array(prior["schedule"])[schedule_ids],
+                                          "distance": distances, "weight": weights})
+                    batch.to_csv(out_file, mode="a", header=not os.path.exists(out_file), index=False)
+                    accepted.append((R0s, Deltas, schedule_ids, distances, weights))
+                    n_accepted += len(R0s)
+
+            for future in pending:
+                future.cancel()
+
+            population = Population(*[np.concatenate(a)[:n_particles] for a in zip(*accepted)])
+            print(f"[abc] generation {g}: eps = {eps_abc:.2f}, acceptance = {n_accepted / n_proposed:.3f}, "
+                  f"simulated days = {n_days}, time = {time.time() - start:.1f}s")
+
+            # adaptive tolerance for the next generation
+            eps_abc = np.quantile(population.distances, quantile)
+
+    posterior = pd.DataFrame({"R0": population.R0s, "Delta": population.Deltas,
+                              "schedule": np.array(prior["schedule"])[population.schedule_ids],
+                              "distance": population.distances, "weight": population.weights})
+    posterior.to_csv(os.path.join(out, "posterior.csv"), index=False)
+    return posterior
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ABC-SMC calibration of the single population model.')
+    parser.add_argument('--particles', dest='particles', type=int, default=1000, help='Particles per generation')
+    parser.add_argument('--generations', dest='generations', type=int, default=5, help='Number of generations')
+    parser.add_argument('--workers', dest='workers', type=int, default=os.cpu_count(), help='Number of processes')
+    parser.add_argument('--batch', dest='batch', type=int, default=100, help='Particles simulated per task')
+    parser.add_argument('--quantile', dest='quantile', type=float, default=0.5, help='Quantile of distances used as next tolerance')
+    parser.add_argument('--seed', dest='seed', type=int, default=0, help='Root random seed')
+    parser.add_argument('--out', dest='out', default="abc", help='Output folder')
+    parser.add_argument('--shape', dest='shape', type=float, default=None, help='Shape of the gamma death delay (default: exact delay)')
+    options = parser.parse_args()
+
+    posterior = abc_smc(options.particles, options.generations, out=options.out, workers=options.workers,
+                        batch_size=options.batch, quantile=options.quantile, seed=options.seed, shape=options.shape)
+
+    for name, group in posterior.groupby("schedule"):
+        print(f"{name}: p = {group['weight'].sum():.3f}, "
+              f"R0 = {np.average(group['R0'], weights=group['weight']):.3f}, "
+              f"Delta = {np.average(group['Delta'], weights=group['weight']):.1f}")
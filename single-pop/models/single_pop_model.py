@@ -7,6 +7,8 @@ import uuid
 import pickle as pkl 
 import gzip
 from numba import jit
+import basin
+from basin import Basin
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -17,7 +19,8 @@ nage  = 16
 
 
 # epidemiological parameters
-IFR = [0.00161 / 100, # 0-4  
+IFR = np.array([
+       0.00161 / 100, # 0-4  
        0.00161 / 100, # 5-9
        0.00695 / 100, # 10-14
        0.00695 / 100, # 15-19 
@@ -32,7 +35,7 @@ IFR = [0.00161 / 100, # 0-4
        1.93    / 100, # 60-64
        1.93    / 100, # 65-69 
        4.28    / 100, # 70-74 
-       6.04    / 100] # 75+
+       6.04    / 100])# 75+
 
 
 mu  = 1 / 2.5
@@ -47,36 +50,14 @@ date       = start_date
 
 
 
-def import_basin():
-    
-    basin_dict = dict()
-    
-    # import restriction data
-    basin_dict["other_loc_restr"] = pd.read_csv("../data/restrictions/other_loc.csv")
-    basin_dict["work_restr"]      = pd.read_csv("../data/restrictions/work.csv")
-    basin_dict["school_restr"]    = pd.read_csv("../data/restrictions/school.csv")
-    basin_dict["home_restr"]    = pd.read_csv("../data/restrictions/home.csv")
-    basin_dict["overall_restr"]    = pd.read_csv("../data/restrictions/overall.csv")
-    
-    # import contacts matrices
-    basin_dict["other_loc_contacts"] = pd.read_csv("../data/contacts-matrix/chile_other_locations.csv", header=None).values
-    basin_dict["work_contacts"]      = pd.read_csv("../data/contacts-matrix/chile_work.csv", header=None).values
-    basin_dict["school_contacts"]    = pd.read_csv("../data/contacts-matrix/chile_school.csv", header=None).values
-    basin_dict["home_contacts"]      = pd.read_csv("../data/contacts-matrix/chile_home.csv", header=None).values
-    
-    # import initial conditions
-    with open("../data/initial-conditions/exposed.pkl", "rb") as file:
-        basin_dict["exposed_ic"] = pkl.load(file)
-    with open("../data/initial-conditions/infectious.pkl", "rb") as file:
-        basin_dict["infectious_ic"] = pkl.load(file)
-        
-    # import Nk
-    basin_dict["Nk"] = pd.read_csv("../data/demographic/pop_5years.csv")["total"].values
-    
-    # import epi data
-    basin_dict["epi_data"] = pd.read_csv("../data/epidemiological-data/epi_data.csv")
-    
-    return basin_dict
+def import_basin(data_dir=basin.data_dir):
+
+    """
+    This function returns the (lazily loaded, cached) data on the basin: 
+    restrictions, contacts matrices, initial conditions, Nk and epi data
+    """
+
+    return Basin(data_dir)
 
 
 def update_contacts_TEF(basin_dict, date):
@@ -122,16 +103,15 @@ def update_contacts_GOOGLE(basin_dict, date):
     other_loc_reductions      = basin_dict["other_loc_restr"]
     home_reductions           = basin_dict["home_restr"]
     school_reductions         = basin_dict["school_restr"]
-    school_reductions["date"] = pd.to_datetime(school_reductions["date"])
+    school_dates              = pd.to_datetime(school_reductions["date"])
 
     omega_h = home_reductions.loc[home_reductions.year_week==year_week]["home_red"].values[0]
     omega_w = work_reductions.loc[work_reductions.year_week==year_week]["work_red"].values[0]
     omega_o = other_loc_reductions.loc[other_loc_reductions.year_week==year_week]["oth_red"].values[0]
-    omega_s = (3 - school_reductions.loc[school_reductions.date==date]["C1_School closing"].values[0]) / 3
+    omega_s = (3 - school_reductions.loc[school_dates==date]["C1_School closing"].values[0]) / 3
     
     overall_reductions = basin_dict["overall_restr"]
-    overall_reductions["date"] = pd.to_datetime(overall_reductions["date"])
-    omega = overall_reductions.loc[overall_reductions["date"]==date].values[0][1]
+    omega = overall_reductions.loc[pd.to_datetime(overall_reductions["date"])==date].values[0][1]
    
     # contacts matrix with reductions
     C = (omega_h * home) + (omega_s * school) + (omega_w * work) + (omega_o * other_loc)
@@ -139,98 +119,514 @@ def update_contacts_GOOGLE(basin_dict, date):
     return C
 
 
+class ContactSchedule:
+
+    """
+    This class holds the contacts matrices of every day of a period as a dense 
+    (T, nage, nage) array, together with a date -> row index
+    """
+
+    def __init__(self, dates, Cs):
+        self.dates = list(dates)
+        self.Cs    = np.asarray(Cs, dtype=float)
+        self.index = {date: t for t, date in enumerate(self.dates)}
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, t):
+        # lookup by day offset
+        return self.Cs[t]
+
+    def at(self, date):
+        # lookup by date
+        return self.Cs[self.index[date]]
+
+
+def get_dates(start_date, end_date):
+
+    """
+    This function returns the list of simulated days
+    """
+
+    return [start_date + timedelta(days=i) for i in range((end_date - start_date).days)]
+
+
+def build_contacts_TEF(basin_dict, dates):
+
+    """
+    This function pre-computes the TEF contacts matrices over the given dates
+    """
+
+    # baseline contacts matrix
+    C0 = basin_dict["home_contacts"] + basin_dict["school_contacts"] + basin_dict["work_contacts"] + basin_dict["other_loc_contacts"]
+
+    # overall reductions (same periods as update_contacts_TEF)
+    r1 = 0.5621746959575077
+    r2 = 0.4516456264414326
+    days  = pd.to_datetime(pd.Series(dates))
+    omega = np.where(days <= datetime(2020, 3, 16), 1.0, np.where(days < datetime(2020, 5, 15), r1, r2))
+
+    return ContactSchedule(dates, omega[:, None, None] * C0)
+
+
+def build_contacts_GOOGLE(basin_dict, dates):
+
+    """
+    This function pre-computes the GOOGLE / OXFORD contacts matrices over the given dates
+    """
+
+    # get year-week of each date
+    year_weeks = ["%d-%02d" % tuple(date.isocalendar()[0:2]) for date in dates]
+
+    # get home / work / other_loc reductions by week
+    omega_h = basin_dict["home_restr"].set_index("year_week")["home_red"].reindex(year_weeks).values
+    omega_w = basin_dict["work_restr"].set_index("year_week")["work_red"].reindex(year_weeks).values
+    omega_o = basin_dict["other_loc_restr"].set_index("year_week")["oth_red"].reindex(year_weeks).values
+
+    # get school reductions by day
+    school_reductions = basin_dict["school_restr"].set_index(pd.to_datetime(basin_dict["school_restr"]["date"]))
+    omega_s = (3 - school_reductions["C1_School closing"].reindex(pd.to_datetime(pd.Series(dates))).values) / 3
+
+    # contacts matrices with reductions
+    Cs = (omega_h[:, None, None] * basin_dict["home_contacts"]) + (omega_s[:, None, None] * basin_dict["school_contacts"]) + \
+         (omega_w[:, None, None] * basin_dict["work_contacts"]) + (omega_o[:, None, None] * basin_dict["other_loc_contacts"])
+
+    return ContactSchedule(dates, Cs)
+
+
+
+# random streams of a replicate (see get_rng)
+dynamics, observation = 0, 1
+
+
+def get_rng(seed, replicate=0, stream=dynamics):
+
+    """
+    This function returns a random stream of a replicate. Streams are counter-based (Philox) and 
+    keyed by (seed, replicate), so any replicate can be regenerated alone, in any process. 
+    The dynamics and the observation (deaths) of a replicate draw from two separate streams, 
+    so a replicate gives the same run whether its days are simulated in one go or day by day
+    """
+
+    counter = np.array([0, 0, 0, stream], dtype=np.uint64)
+    return np.random.Generator(np.random.Philox(counter=counter, key=np.array([seed, replicate], dtype=np.uint64)))
+
+
 
-@jit(fastmath=True)
-def stochastic_SEIRD(Cs, basin_dict, initial_conditions, beta, dates):
+@jit(nopython=True, fastmath=True)
+def step_SEIRD(state, C, Nk, beta, rng):
 
     """
-    This function simulates a stochastic SEIR model
+    This function advances the (ncomp, nage) state of a stochastic SEIR model by one day, drawing from rng
+    """
+
+    # next step solution 
+    next_step = np.zeros((ncomp, nage))
+
+    # iterate over ages
+    for age1 in range(nage):
+
+        # compute force of infection (clamped like step_SEIRD_ensemble)
+        # S:0 L:1 I:2 R:3
+        force_inf = min(np.sum(beta * C[age1, :] * state[2, :] / Nk), 1.0)
+
+        # S -> L
+        if force_inf == 0:
+            new_latent = 0
+        else:
+            new_latent  = rng.binomial(int(state[0, age1]), force_inf)
+
+        # L -> I 
+        new_infected  = rng.binomial(int(state[1, age1]), eps)
+
+        # I -> R
+        new_recovered = rng.binomial(int(state[2, age1]), mu)
+
+        # update next step solution
+        next_step[0, age1] = state[0, age1] - new_latent                       # S
+        next_step[1, age1] = state[1, age1] + new_latent   - new_infected      # L
+        next_step[2, age1] = state[2, age1] + new_infected - new_recovered     # I
+        next_step[3, age1] = state[3, age1] + new_recovered                    # R
+
+    return next_step
+
+
+
+@jit(nopython=True, fastmath=True)
+def stochastic_SEIRD(Cs, Nk, initial_conditions, beta, rng):
+
+    """
+    This function simulates a stochastic SEIR model, drawing from the random generator rng
     """
 
     # initial conditions
-    T = len(dates)
+    T = Cs.shape[0]
     compartments = np.zeros((ncomp, nage, T))
     compartments[:,:,0] = initial_conditions
 
     # simulate 
     for i in range(T - 1): 
+        compartments[:,:,i+1] = step_SEIRD(compartments[:,:,i], Cs[i], Nk, beta, rng)
 
-        C = Cs[dates[i]]
+    return compartments
 
-        # next step solution 
-        next_step = np.zeros((ncomp, nage))
 
-        # iterate over ages
-        for age1 in range(nage):
 
-            # compute force of infection
-            # S:0 L:1 I:2 R:3
-            force_inf = np.sum(beta * C[age1, :] * compartments[2, :, i] / basin_dict["Nk"])
+def step_SEIRD_ensemble(state, C, Nk, betas, rng=np.random):
 
-            # S -> L
-            if force_inf == 0:
-                new_latent = 0
-            else:
-                new_latent  = np.random.binomial(compartments[0, age1, i], force_inf)
+    """
+    This function advances a (batch, ncomp, nage) state of stochastic SEIR models by one day
+    """
 
-            # L -> I 
-            new_infected  = np.random.binomial(compartments[1, age1, i], eps)
+    # S:0 L:1 I:2 R:3 (shape: batch x age)
+    S, L, I, R = state[:, 0], state[:, 1], state[:, 2], state[:, 3]
 
-            # I -> R
-            new_recovered = np.random.binomial(compartments[2, age1, i], mu)
+    # compute force of infection for every run and age at once
+    force_inf = np.minimum(betas[:, None] * ((I / Nk) @ C.T), 1.0)
 
-            # update next step solution
-            next_step[0, age1] = compartments[0, age1, i] - new_latent                       # S
-            next_step[1, age1] = compartments[1, age1, i] + new_latent   - new_infected      # L
-            next_step[2, age1] = compartments[2, age1, i] + new_infected - new_recovered     # I
-            next_step[3, age1] = compartments[3, age1, i] + new_recovered                    # R
+    # S -> L, L -> I, I -> R
+    new_latent    = rng.binomial(S.astype(np.int64), force_inf)
+    new_infected  = rng.binomial(L.astype(np.int64), eps)
+    new_recovered = rng.binomial(I.astype(np.int64), mu)
 
-        # update solution at the next step 
-        compartments[:,:,i+1] = next_step
+    # next step solution 
+    next_state = np.empty_like(state)
+    next_state[:, 0] = S - new_latent                                       # S
+    next_state[:, 1] = L + new_latent   - new_infected                      # L
+    next_state[:, 2] = I + new_infected - new_recovered                     # I
+    next_state[:, 3] = R + new_recovered                                    # R
+
+    return next_state
+
+
+
+def stochastic_SEIRD_ensemble(Cs, Nk, initial_conditions, betas, rngs=None):
+
+    """
+    This function simulates a batch of stochastic SEIR models at once. If rngs is given 
+    (one generator per run, see get_rng) each run draws from its own stream: a generator can 
+    not be shared by a vectorized draw, so each run is then one compiled call of stochastic_SEIRD 
+    (same model, as fast as the batched steps, which draw the runs from a single stream)
+    """
+
+    # independent streams: one compiled run per stream
+    if rngs is not None:
+        initial_conditions = np.asarray(initial_conditions, dtype=float)
+        return np.stack([stochastic_SEIRD(Cs, Nk, initial_conditions, beta, rng) for beta, rng in zip(betas, rngs)])
+
+    # initial conditions
+    B, T = len(betas), Cs.shape[0]
+    compartments = np.zeros((B, ncomp, nage, T))
+    compartments[:,:,:,0] = initial_conditions
+
+    # simulate 
+    for i in range(T - 1): 
+        compartments[:,:,:,i+1] = step_SEIRD_ensemble(compartments[:,:,:,i], Cs[i], Nk, betas)
 
     return compartments
 
 
 
-def simulate(Cs, basin_dict, initial_conditions, R0, Delta, dates):
+def simulate_ensemble(Cs, basin_dict, initial_conditions, R0s, Deltas, n_replicates=1, shape=None, seed=None, runs=None):
 
     """
-    This function runs the SEIR model
+    This function runs n_replicates stochastic SEIR models for each (R0, Delta) pair.
+    Runs are ordered as (R0, Delta) x replicate, with the replicate index varying fastest.
+    If shape is given, Delta is the mean of a gamma distributed delay (see get_delay_pmf).
+    If seed is given, run b draws from the streams of get_rng(seed, b), and runs selects a subset 
+    of the run indices to simulate (e.g. to split an ensemble across processes, or replay one run)
     """
 
+    # expand (R0, Delta) pairs over replicates
+    R0s    = np.repeat(np.asarray(R0s, dtype=float), n_replicates)
+    Deltas = np.repeat(np.asarray(Deltas, dtype=int), n_replicates)
+    runs   = np.arange(len(R0s)) if runs is None else np.asarray(runs, dtype=int)
+    R0s, Deltas = R0s[runs], Deltas[runs]
+    rngs   = None if seed is None else [get_rng(seed, b) for b in runs]
+    obs_rngs = None if seed is None else [get_rng(seed, b, observation) for b in runs]
+
     # get beta from Rt w.r.t to initial_date
-    beta = get_beta(R0, mu, Cs[dates[0]])
+    betas = np.array([get_beta(R0, mu, Cs[0]) for R0 in R0s])
 
     # simulate
-    compartments = stochastic_SEIRD(Cs, basin_dict, initial_conditions, beta, dates)
+    compartments = stochastic_SEIRD_ensemble(Cs, np.asarray(basin_dict["Nk"], dtype=float), initial_conditions, betas, rngs)
 
     # compute deaths
-    deaths = compute_deaths(compartments, Delta)
+    deaths = compute_deaths_ensemble(compartments, Deltas, shape, obs_rngs)
 
     return compartments, deaths
 
 
 
-@jit(fastmath=True)
-def compute_deaths(compartments, Delta):
+def simulate(Cs, basin_dict, initial_conditions, R0, Delta, seed=None, replicate=0, shape=None):
+
+    """
+    This function runs the SEIR model on a (T, nage, nage) contacts schedule.
+    With a seed, the run is the same as run `replicate` of simulate_ensemble with that seed
+    (and as particle `replicate` of an ABC-SMC calibration with that seed, see calibration.py)
+    """
+
+    # random streams of the run
+    rng = np.random.default_rng() if seed is None else get_rng(seed, replicate)
+    obs_rng = rng if seed is None else get_rng(seed, replicate, observation)
+
+    # get beta from Rt w.r.t to initial_date
+    beta = get_beta(R0, mu, Cs[0])
+
+    # simulate
+    compartments = stochastic_SEIRD(Cs, np.asarray(basin_dict["Nk"], dtype=float), np.asarray(initial_conditions, dtype=float), beta, rng)
+
+    # compute deaths
+    deaths = compute_deaths(compartments, Delta, shape, rng=obs_rng)
+
+    return compartments, deaths
+
+
+
+def compute_deaths(compartments, Delta, shape=None, rng=None):
 
     """
     This function computes the number of daily deaths
     """
 
-    # initialize deaths
-    nage, T = compartments.shape[1], compartments.shape[2]
-    deaths  = np.zeros((nage, T))
+    # get recovered of each step
+    recovered = np.zeros(compartments.shape[1:])
+    recovered[:, 1:] = np.diff(compartments[3], axis=1)
 
-    # get recovered of this step
-    recovered = np.diff(compartments[3], axis=1)
+    return observe_deaths(recovered[None], get_delay_pmf(Delta, shape), rngs=None if rng is None else [rng])[0]
 
-    for age in range(nage):
-        deaths[age] = np.concatenate(([0], np.random.binomial(recovered[age].astype(int), IFR[age])))
-        deaths[age] = np.roll(deaths[age], shift=Delta)
-        deaths[age][0:Delta] = 0
 
-    return deaths
+def compute_deaths_ensemble(compartments, Deltas, shape=None, rngs=None):
+
+    """
+    This function computes the number of daily deaths for a batch of runs
+    """
+
+    # get recovered of each step
+    recovered = np.zeros((compartments.shape[0],) + compartments.shape[2:])
+    recovered[:, :, 1:] = np.diff(compartments[:, 3], axis=2)
+
+    return observe_deaths(recovered, get_delay_pmf(Deltas, shape), rngs=rngs)
+
+
+def get_delay_pmf(Delta, shape=None, max_delay=None):
+
+    """
+    This function returns the recovery-to-death delay distribution over 0..max_delay days.
+    If shape is None the delay is exactly Delta days, otherwise it follows a (discretized) gamma 
+    distribution with mean Delta and the given shape (a delay of Delta <= 0 is always 0 days). 
+    Delta can be a scalar or an array (one row per run)
+    """
+
+    Deltas = np.atleast_1d(np.asarray(Delta, dtype=float))
+    if max_delay is None:
+        max_delay = int(np.max(Deltas)) if shape is None else int(np.ceil(np.max(Deltas) * (1 + 6 / np.sqrt(shape))))
+
+    days = np.arange(max_delay + 1)
+    if shape is None:
+        pmf = (days[None, :] == np.rint(Deltas)[:, None]).astype(float)
+    else:
+        # gamma density at the middle of each day (the first day covers [0, 0.5])
+        x = np.maximum(days, 0.25)[None, :]
+        scale = np.maximum(Deltas[:, None], 1e-12) / shape
+        pmf = np.exp((shape - 1) * np.log(x / scale) - x / scale)
+        pmf[:, 0] *= 0.5
+        pmf /= pmf.sum(axis=1, keepdims=True)
+        pmf[Deltas <= 0] = (days == 0)
+
+    return pmf if np.ndim(Delta) > 0 else pmf[0]
+
+
+def get_death_probs(delay_pmf):
+
+    """
+    This function returns the lags with a nonzero delay probability, and P[b, age, j]: the probability 
+    that a recovered of run b dies lags[j] days later (IFR x delay), for a (L,) or (batch, L) delay_pmf
+    """
+
+    delay_pmf = np.atleast_2d(delay_pmf)
+    lags = np.where(delay_pmf.any(axis=0))[0]
+    return lags, IFR[None, :, None] * delay_pmf[:, None, lags]
+
+
+@jit(nopython=True)
+def draw_deaths(delayed, recovered, P, lags, t, rng):
+
+    """
+    This function draws the deaths among the (nage,) recovered of day t, then their delays (a multinomial 
+    draw over the lags, as sequential binomials), and adds them to the (nage, T) delayed deaths. 
+    Deaths delayed beyond the last day are dropped
+    """
+
+    T = delayed.shape[1]
+    for age in range(len(recovered)):
+        rest = np.sum(P[age])
+        n = rng.binomial(int(recovered[age]), min(rest, 1.0)) if recovered[age] > 0 else 0
+        for j in range(len(lags)):
+            if n == 0:
+                break
+            c = rng.binomial(n, min(P[age, j] / rest, 1.0)) if rest > 0 else n
+            n -= c
+            rest -= P[age, j]
+            if t + lags[j] < T:
+                delayed[age, t + lags[j]] += c
+
+
+@jit(nopython=True)
+def draw_delayed_deaths(recovered, P, lags, rng):
+
+    """
+    This function draws the (nage, T) daily deaths of the (nage, T) daily recovered of a run, day by day
+    """
+
+    nage, T = recovered.shape
+    delayed = np.zeros((nage, T))
+    for t in range(T):
+        draw_deaths(delayed, recovered[:, t], P, lags, t, rng)
+    return delayed
+
+
+def observe_deaths(recovered, delay_pmf, stochastic=True, rngs=None):
+
+    """
+    This function turns a (batch, nage, T) array of daily recovered into (batch, nage, T) daily deaths. 
+    Each recovered dies with the age specific IFR, after a delay drawn from delay_pmf (see draw_deaths), 
+    or deaths are their expected value if not stochastic. delay_pmf is a (L,) distribution shared by all runs 
+    or a (batch, L) one per run. Deaths delayed beyond the last day are dropped (no wrap-around). 
+    If rngs is given, run b draws from rngs[b]
+    """
+
+    B, nage, T = recovered.shape
+    if stochastic:
+        lags, P = get_death_probs(delay_pmf)
+        P = np.broadcast_to(P, (B,) + P.shape[1:])
+        rngs = rngs if rngs is not None else [np.random.default_rng(np.random.randint(2**31))] * B
+        return np.stack([draw_delayed_deaths(recovered[b], np.ascontiguousarray(P[b]), lags, rng) for b, rng in enumerate(rngs)])
+
+    deaths = recovered * IFR[None, :, None]
+    delay_pmf = np.broadcast_to(np.atleast_2d(delay_pmf), (B, np.shape(delay_pmf)[-1]))
+    lags = np.where(delay_pmf[:, :T].any(axis=0))[0]
+
+    # few distinct lags (e.g. point delays): sum of shifted copies, otherwise FFT convolution
+    if len(lags) <= 16:
+        delayed = np.zeros_like(deaths)
+        for lag in lags:
+            delayed[:, :, lag:] += delay_pmf[:, lag, None, None] * deaths[:, :, :T - lag]
+    else:
+        n = T + delay_pmf.shape[1] - 1
+        n = 1 << int(np.ceil(np.log2(n)))
+        delayed = np.fft.irfft(np.fft.rfft(deaths, n, axis=2) * np.fft.rfft(delay_pmf, n, axis=1)[:, None, :], n, axis=2)[:, :, :T]
+        delayed = np.maximum(delayed, 0.0)
+
+    return delayed
+
+
+def deterministic_SEIRD(Cs, Nk, initial_conditions, betas, scenarios, return_compartments=True):
+
+    """
+    This function integrates the mean-field (expected value) SEIR model for a grid of P points at once.
+    Cs is a (n_scenarios, T, nage, nage) array of contacts schedules and point p uses Cs[scenarios[p]].
+    Returns the (P, ncomp, nage, T) compartments (None if not requested) and the (P, nage, T) recovered flows
+    """
+
+    # initial conditions
+    P, T = len(betas), Cs.shape[1]
+    state = np.repeat(np.asarray(initial_conditions, dtype=float)[None], P, axis=0)
+    recovered = np.zeros((P, nage, T))
+    compartments = np.zeros((P, ncomp, nage, T)) if return_compartments else None
+    if return_compartments:
+        compartments[:,:,:,0] = state
+
+    # points sharing the same scenario are advanced with a single matrix product
+    groups = [(s, np.where(scenarios == s)[0]) for s in np.unique(scenarios)]
+
+    # simulate 
+    for i in range(T - 1):
+
+        # S:0 L:1 I:2 R:3 (shape: points x age)
+        S, L, I = state[:, 0], state[:, 1], state[:, 2]
+
+        # compute force of infection
+        force_inf = np.empty((P, nage))
+        for s, points in groups:
+            force_inf[points] = (I[points] / Nk) @ Cs[s, i].T
+        force_inf = np.minimum(betas[:, None] * force_inf, 1.0)
+
+        # expected transitions
+        new_latent    = S * force_inf
+        new_infected  = L * eps
+        new_recovered = I * mu
+
+        # update solution at the next step 
+        state[:, 0] = S - new_latent                       # S
+        state[:, 1] = L + new_latent   - new_infected      # L
+        state[:, 2] = I + new_infected - new_recovered     # I
+        state[:, 3] = state[:, 3] + new_recovered          # R
+        recovered[:, :, i+1] = new_recovered
+        if return_compartments:
+            compartments[:,:,:,i+1] = state
+
+    return compartments, recovered
+
+
+
+def simulate_mean_field(Cs, basin_dict, initial_conditions, R0s, Deltas, scenarios=None, return_compartments=True, shape=None):
+
+    """
+    This function runs the mean-field SEIR model over a grid of (R0, Delta, scenario) points.
+    Cs is either one (T, nage, nage) schedule or a (n_scenarios, T, nage, nage) stack of schedules
+    """
+
+    Cs = np.asarray(Cs, dtype=float)
+    if Cs.ndim == 3:
+        Cs = Cs[None]
+
+    R0s       = np.asarray(R0s, dtype=float)
+    Deltas    = np.asarray(Deltas, dtype=int)
+    scenarios = np.zeros(len(R0s), dtype=int) if scenarios is None else np.asarray(scenarios, dtype=int)
+
+    # get beta from Rt w.r.t to initial_date of each scenario
+    betas = R0s * mu / get_spectral_radius(Cs[:, 0])[scenarios]
+
+    # simulate
+    compartments, recovered = deterministic_SEIRD(Cs, np.asarray(basin_dict["Nk"], dtype=float), initial_conditions, 
+                                                  betas, scenarios, return_compartments)
+
+    # expected deaths, delayed by Delta days
+    deaths = observe_deaths(recovered, get_delay_pmf(Deltas, shape), stochastic=False)
+
+    return compartments, deaths
+
+
+
+# dominant eigenvalues of already seen contacts matrices (keyed by matrix content)
+spectral_cache = {}
+
+
+def get_spectral_radius(Cs):
+
+    """
+    This function returns the dominant eigenvalue of a contacts matrix, or of 
+    each matrix of a (T, nage, nage) schedule
+    """
+
+    Cs = np.asarray(Cs, dtype=float)
+    n  = Cs.shape[-1]
+
+    # find distinct matrices
+    unique, inverse = np.unique(Cs.reshape(-1, n * n), axis=0, return_inverse=True)
+    keys = [u.tobytes() for u in unique]
+
+    # batched eigen-decomposition of matrices not seen yet
+    missing = [i for i, key in enumerate(keys) if key not in spectral_cache]
+    if len(missing) > 0:
+        eigvals = np.linalg.eigvals(unique[missing].reshape(-1, n, n))
+        for i, rho in zip(missing, eigvals.real.max(axis=1)):
+            spectral_cache[keys[i]] = rho
+
+    rhos = np.array([spectral_cache[key] for key in keys])[inverse.ravel()]
+    return rhos.reshape(Cs.shape[:-2]) if Cs.ndim > 2 else rhos[0]
 
 
 def get_beta(R0, mu, C):
@@ -240,49 +636,79 @@ def get_beta(R0, mu, C):
     """
 
     # get seasonality adjustment
-    return R0 * mu / (np.max([e.real for e in np.linalg.eig(C)[0]]))
+    return R0 * mu / get_spectral_radius(C)
 
 
+def get_Rt(R0, mu, Cs):
 
-# import data on the basin
-basin_dict = import_basin()
-    
-    
-# real deaths
-tot_deaths = basin_dict["epi_data"]
-tot_deaths.index = pd.to_datetime(tot_deaths["fecha"])
-tot_deaths = tot_deaths.resample("W").sum().loc[tot_deaths.resample("W").sum().index <='2020-08-02']["count"].values
-    
-    
-# initial conditions
-initial_conditions = np.zeros((ncomp, nage))
-age_cols = ['0-4', '5-9', '10-14', '15-19', '20-24', '25-29', '30-34', '35-39', '40-44', '45-49', '50-54', '55-59', 
-            '60-64', '65-69', '70-74', '75+']
-for age_id, age_str in zip(range(16), age_cols):
-    # (S: 0, L1: 1, L2: 2, I1: 3, I2: 4, R1: 5, R2: 6)
-    initial_conditions[1, age_id] = int(basin_dict["exposed_ic"][age_str]) 
-    initial_conditions[2, age_id] = int(basin_dict["infectious_ic"][age_str]) 
-    initial_conditions[3, age_id] = int(0)
-    initial_conditions[0, age_id] = int(basin_dict["Nk"][age_id] - initial_conditions[1, age_id] - initial_conditions[2, age_id])
-
-
-
-# pre-compute contacts matrices over time
-Cs_TEF, Cs_GOOGLE = {}, {}
-date, dates = start_date, [start_date]
-for i in range((end_date - start_date).days - 1):
-    Cs_TEF[date] = update_contacts_TEF(basin_dict, date)
-    Cs_GOOGLE[date] = update_contacts_TEF(basin_dict, date)
-    date += timedelta(days=1)
-    dates.append(date)
-
-
-# sample run
-R0 = 2.66
-Delta = 17
-
-# TEF
-compartments_TEF, deaths_TEF = simulate(Cs_TEF, basin_dict, initial_conditions, R0, Delta, dates)
-
-# GOOGLE / OXFORD
-compartments_GOOGLE, deaths_GOOGLE = simulate(Cs_GOOGLE, basin_dict, initial_conditions, R0, Delta, dates)
+    """
+    This function returns beta w.r.t. the first day of a (T, nage, nage) contacts 
+    schedule, and the implied Rt time series
+    """
+
+    rhos = get_spectral_radius(Cs)
+    beta = R0 * mu / rhos[0]
+
+    return beta, beta * rhos / mu
+
+
+
+def get_weekly_deaths(basin_dict, end_date):
+
+    """
+    This function returns the weekly number of real deaths up to end_date
+    """
+
+    epi_data = basin_dict["epi_data"].set_index(pd.to_datetime(basin_dict["epi_data"]["fecha"]))
+    weekly   = epi_data[["count"]].resample("W").sum()
+    return weekly.loc[weekly.index <= end_date]["count"].values
+
+
+def get_initial_conditions(basin_dict):
+
+    """
+    This function returns the (ncomp, nage) initial conditions
+    """
+
+    initial_conditions = np.zeros((ncomp, nage))
+    age_cols = ['0-4', '5-9', '10-14', '15-19', '20-24', '25-29', '30-34', '35-39', '40-44', '45-49', '50-54', '55-59', 
+                '60-64', '65-69', '70-74', '75+']
+    for age_id, age_str in zip(range(16), age_cols):
+        # (S: 0, L1: 1, L2: 2, I1: 3, I2: 4, R1: 5, R2: 6)
+        initial_conditions[1, age_id] = int(basin_dict["exposed_ic"][age_str]) 
+        initial_conditions[2, age_id] = int(basin_dict["infectious_ic"][age_str]) 
+        initial_conditions[3, age_id] = int(0)
+        initial_conditions[0, age_id] = int(basin_dict["Nk"][age_id] - initial_conditions[1, age_id] - initial_conditions[2, age_id])
+    return initial_conditions
+
+
+
+if __name__ == "__main__":
+
+    # import data on the basin
+    basin_dict = import_basin()
+
+    # real deaths
+    tot_deaths = get_weekly_deaths(basin_dict, end_date)
+
+    # initial conditions
+    initial_conditions = get_initial_conditions(basin_dict)
+
+    # pre-compute contacts matrices over time
+    dates     = get_dates(start_date, end_date)
+    Cs_TEF    = build_contacts_TEF(basin_dict, dates)
+    Cs_GOOGLE = build_contacts_GOOGLE(basin_dict, dates)
+
+    # sample run
+    R0 = 2.66
+    Delta = 17
+
+    # effective reproduction number over the fit period
+    beta_TEF, Rt_TEF       = get_Rt(R0, mu, Cs_TEF.Cs)
+    beta_GOOGLE, Rt_GOOGLE = get_Rt(R0, mu, Cs_GOOGLE.Cs)
+
+    # TEF
+    compartments_TEF, deaths_TEF = simulate(Cs_TEF.Cs, basin_dict, initial_conditions, R0, Delta, seed=0)
+
+    # GOOGLE / OXFORD
+    compartments_GOOGLE, deaths_GOOGLE = simulate(Cs_GOOGLE.Cs, basin_dict, initial_conditions, R0, Delta, seed=0)
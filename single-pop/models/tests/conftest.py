@@ -0,0 +1,23 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The models are scripts of the parent folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import single_pop_model as spm
+
+
+@pytest.fixture
+def toy_basin():
+    # small synthetic basin: (T, nage, nage) contacts, populations and initial conditions
+    rng = np.random.default_rng(0)
+    T = 60
+    Cs = rng.random((T, spm.nage, spm.nage)) * 0.5
+    Nk = np.full(spm.nage, 1e5)
+    initial_conditions = np.zeros((spm.ncomp, spm.nage))
+    initial_conditions[2] = 50
+    initial_conditions[0] = Nk - initial_conditions[2]
+    return Cs, {"Nk": Nk}, initial_conditions
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+import calibration as cal
+import single_pop_model as spm
+
+
+@pytest.mark.parametrize("shape", [None, 4.0])
+def test_particle_replays_from_its_seed(toy_basin, shape):
+    Cs, basin_dict, ic = toy_basin
+    T = len(Cs)
+    day_week = np.where(np.arange(T) >= 4, (np.arange(T) - 4) // 7, -1)
+    day_week[day_week == day_week.max()] = -1
+    obs = np.full(day_week.max() + 1, 10.0)
+    cal.context.update(Cs=[Cs], rho=[spm.get_spectral_radius(Cs[0])], Nk=basin_dict["Nk"], initial_conditions=ic,
+                       obs=obs, day_week=day_week)
+
+    R0s, Deltas = np.array([2.0, 2.5, 3.0]), np.array([5, 8, 0])
+    particles, R0s, Deltas, _, distances, _ = cal.run_batch(R0s, Deltas, np.zeros(3, dtype=int), np.inf, 11, 20, shape)
+    assert list(particles) == [20, 21, 22]
+
+    for particle, R0, Delta, distance in zip(particles, R0s, Deltas, distances):
+        _, deaths = spm.simulate(Cs, basin_dict, ic, R0, Delta, seed=11, replicate=particle, shape=shape)
+        weekly = np.array([deaths.sum(axis=0)[day_week == w].sum() for w in range(len(obs))])
+        assert np.isclose(np.sqrt(np.sum((weekly - obs) ** 2)), distance)
+
+
+def test_collapsed_population_has_finite_weights():
+    population = cal.Population([2.5] * 4, [10] * 4, [0] * 4, [1.0] * 4, np.ones(4))
+    assert population.sigma_R0 > 0
+    weights = population.weight(np.array([2.5, 2.6]), np.array([10, 11]), np.array([0, 0]), cal.default_prior, 0.2)
+    assert np.all(np.isfinite(weights))
@@ -0,0 +1,54 @@
+import numpy as np
+
+import single_pop_model as spm
+
+
+def test_seeded_ensemble_is_reproducible(toy_basin):
+    Cs, basin_dict, ic = toy_basin
+    a = spm.simulate_ensemble(Cs, basin_dict, ic, [2.0, 3.0], [10, 12], n_replicates=2, seed=5)
+    b = spm.simulate_ensemble(Cs, basin_dict, ic, [2.0, 3.0], [10, 12], n_replicates=2, seed=5)
+    c = spm.simulate_ensemble(Cs, basin_dict, ic, [2.0, 3.0], [10, 12], n_replicates=2, seed=6)
+    assert all(np.array_equal(x, y) for x, y in zip(a, b))
+    assert not np.array_equal(a[0], c[0])
+
+
+def test_run_replays_alone(toy_basin):
+    Cs, basin_dict, ic = toy_basin
+    compartments, deaths = spm.simulate_ensemble(Cs, basin_dict, ic, [2.0, 3.0], [10, 12], n_replicates=2, seed=5)
+    one_c, one_d = spm.simulate_ensemble(Cs, basin_dict, ic, [2.0, 3.0], [10, 12], n_replicates=2, seed=5, runs=[3])
+    assert np.array_equal(one_c[0], compartments[3]) and np.array_equal(one_d[0], deaths[3])
+    c, d = spm.simulate(Cs, basin_dict, ic, 3.0, 12, seed=5, replicate=3)
+    assert np.array_equal(c, compartments[3]) and np.array_equal(d, deaths[3])
+
+
+def test_daily_steps_match_full_run(toy_basin):
+    Cs, basin_dict, ic = toy_basin
+    compartments = spm.stochastic_SEIRD(Cs, basin_dict["Nk"], ic, 0.05, spm.get_rng(1, 2))
+    rng, state = spm.get_rng(1, 2), ic.copy()
+    for t in range(len(Cs) - 1):
+        state = spm.step_SEIRD(state, Cs[t], basin_dict["Nk"], 0.05, rng)
+        assert np.array_equal(state, compartments[:, :, t + 1])
+
+
+def test_force_of_infection_is_clamped(toy_basin):
+    Cs, basin_dict, ic = toy_basin
+    # with a huge beta every susceptible is infected on the first day, in both engines
+    seeded = spm.stochastic_SEIRD(Cs, basin_dict["Nk"], ic, 1e6, spm.get_rng(0))
+    batched = spm.stochastic_SEIRD_ensemble(Cs, basin_dict["Nk"], ic, np.array([1e6]))
+    assert seeded[0, :, 1].sum() == 0 and batched[0, 0, :, 1].sum() == 0
+
+
+def test_zero_delay_pmf():
+    assert np.array_equal(spm.get_delay_pmf(0, 4.0), [1.0])
+    pmf = spm.get_delay_pmf([0, 10], 4.0)
+    assert pmf[0, 0] == 1.0 and np.isclose(pmf[1].sum(), 1.0)
+
+
+def test_stochastic_delays_match_expected_deaths():
+    recovered = np.zeros((2000, len(spm.IFR), 40))
+    recovered[:, :, 5] = 1000
+    pmf = spm.get_delay_pmf(8, 4.0)
+    expected = spm.observe_deaths(recovered[:1], pmf, stochastic=False)[0]
+    drawn = spm.observe_deaths(recovered, pmf, stochastic=True, rngs=[spm.get_rng(1, b) for b in range(2000)])
+    assert np.array_equal(drawn, np.round(drawn))
+    assert np.allclose(drawn.mean(axis=0), expected, atol=0.5)